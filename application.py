@@ -1,13 +1,14 @@
 import subprocess
 import time
-from typing import List
-from threading import Thread
+from typing import List, NamedTuple, Optional, Tuple
 
 from job_group_data import JobGroupData
-from resource_manager import ResourceManager
+from resource_manager import ResourceManager, RUNNING, FINISHED, FAILED, KILLED
 from abc import ABCMeta, abstractmethod
+from collections.abc import Sequence
 import uuid
 import datetime
+import shlex
 
 
 class NotCorrectlyScheduledError(Exception):
@@ -15,14 +16,11 @@ class NotCorrectlyScheduledError(Exception):
 
 
 class Container(metaclass=ABCMeta):
-    def __init__(self):
-        self.container_id = None
-        self.node = None
-        self.pid = None
-        # used to distinguish between the application master and the tasks container
-        # the application master is considered to be negligible as it does not have
-        # much influence on the resource usage
-        self.is_negligible = False
+    __slots__ = ()
+    # used to distinguish between the application master and the tasks container
+    # the application master is considered to be negligible as it does not have
+    # much influence on the resource usage
+    is_negligible = False
 
     @property
     @abstractmethod
@@ -36,29 +34,77 @@ class Container(metaclass=ABCMeta):
 class Application(Container):
     print_command_line = False
     experiment_name = ""
+    # export.Exporter exporting the metrics of the finished applications with the experiment
+    exporter = None
+    # seconds an application may stay unknown to the RM or not running before it is considered failed
+    submission_timeout = 600
+
+    is_negligible = True
 
     def __init__(self, name, n_tasks, data_set=''):
-        super().__init__()
+        self.container_id = None
+        self.node = None
+        self.pid = None
         self.name = name
         self.n_tasks = n_tasks
         self.id = None
         self.is_running = False
-        self.tasks = [Task(self) for i in range(self.n_tasks)]
+        # node of every task, allocated with the first placed task, the Task objects are views of it
+        self._task_nodes = None
+        self._n_placed = 0
         self.thread = None
-        self.is_negligible = True
         self.n_containers = self.n_tasks
-        self.containers = self.tasks
         self.data_set = data_set
         self.nodes = set()
-        self.group = JobGroupData.groupIndexes[name]
+        # -1 for the jobs which are not part of a group
+        self.group = JobGroupData.groupIndexes.get(name, -1)
         self.cluster_slot = JobGroupData.SLOT_FULL
         self.waiting_time = 0
-
+        self.arrival_time = None
+        self.attempts = 0
+        self.failure = None
+        self.submitted_at = None
+        self.last_seen_at = None
 
     @property
     def application(self):
         return self
 
+    @property
+    def tasks(self) -> 'Tasks':
+        return Tasks(self)
+
+    @property
+    def containers(self) -> 'Tasks':
+        return Tasks(self)
+
+    def placed_tasks(self) -> int:
+        return self._n_placed
+
+    def task_node(self, index):
+        return None if self._task_nodes is None else self._task_nodes[index]
+
+    def set_task_node(self, index, node):
+        if self._task_nodes is None:
+            if node is None:
+                return
+            self._task_nodes = [None] * self.n_tasks
+        self._n_placed += (node is not None) - (self._task_nodes[index] is not None)
+        self._task_nodes[index] = node
+
+    def release(self, node):
+        # the containers of the application on the node are freed
+        if self.node is node:
+            self.node = None
+        if self._task_nodes is None:
+            return
+        for i, task_node in enumerate(self._task_nodes):
+            if task_node is node:
+                self._task_nodes[i] = None
+                self._n_placed -= 1
+        if self._n_placed == 0:
+            self._task_nodes = None
+
     def __str__(self):
         return "{} ({}) [{}]".format(self.id, self.name, self.waiting_time)
 
@@ -67,188 +113,154 @@ class Application(Container):
 
     def start(self, resource_manager: ResourceManager, on_finish=None, sleep_during_loop=5):
         self.id = resource_manager.next_application_id()
+        self.attempts += 1
         print("Start Application {}".format(self))
 
-        for task in self.tasks:
-            if task.node is None:
-                raise NotCorrectlyScheduledError(
-                    "A task of the application {} is not scheduled on a node".format(self.name)
-                )
-            self.nodes.add(task.node.address)
+        if self._n_placed < self.n_tasks:
+            raise NotCorrectlyScheduledError(
+                "A task of the application {} is not scheduled on a node".format(self.name)
+            )
+        self.nodes.update(node.address for node in self._task_nodes)
 
         # print(self.nodes)
         print(datetime.datetime.utcnow().strftime('%Y-%m-%d"T"%H:%M:%S"Z"'))
 
-        self.thread = Thread(target=self._run, args=[resource_manager, on_finish, sleep_during_loop])
-        self.thread.start()
+        resource_manager.run_application(self, on_finish, sleep_during_loop)
 
     def command_line(self) -> List[str]:
         return [""]
 
     def _run(self, resource_manager: ResourceManager, on_finish, sleep_during_loop):
+        self._submit()
+
+        time.sleep(sleep_during_loop + 30)
+        while not self._observe(resource_manager.application_state(self.id)):
+            time.sleep(sleep_during_loop)
+
+        if self.is_lost():
+            resource_manager.kill_application(self.id)
+        self._complete(on_finish)
+
+    def _submit(self):
         cmd = " ".join(self.command_line())
         #if self.print_command_line:
         print("Start {} with cmd: {}".format(self.id, cmd))
         subprocess.Popen(cmd, shell=True)
+        self._on_submitted()
 
+    def _on_submitted(self):
         self.start_at = datetime.datetime.utcnow()
+        self.submitted_at = time.time()
+        self.last_seen_at = self.submitted_at
+
+    def _observe(self, state, now=None) -> bool:
+        # update the application with the state reported by the RM (None if the RM does not know it),
+        # returns whether the application has reached a terminal state
+        now = time.time() if now is None else now
+        if state is not None:
+            self.last_seen_at = now
+
+        if state == RUNNING:
+            self.is_running = True
+        elif state in (FAILED, KILLED):
+            self.failure = state
+        elif state is None and now - self.last_seen_at > self.submission_timeout:
+            self.failure = "MISSING"
+        elif state != FINISHED and not self.is_running and now - self.submitted_at > self.submission_timeout:
+            self.failure = "TIMEOUT"
+
+        return state == FINISHED or self.failure is not None
+
+    def is_lost(self) -> bool:
+        # given up while the RM has not started it or does not report it, it may still start later
+        return self.failure in ("MISSING", "TIMEOUT")
+
+    def _complete(self, on_finish):
+        if self.failure is not None:
+            self._fail(on_finish)
+        else:
+            self._finish(on_finish)
+
+    def _fail(self, on_finish):
+        print("Application {} has failed: {}".format(self, self.failure))
 
-        time.sleep(sleep_during_loop + 30)
-        while not resource_manager.is_application_finished(self.id):
-            if not self.is_running and resource_manager.is_application_running(self.id):
-                self.is_running = True
+        self.end_at = datetime.datetime.utcnow()
 
-            time.sleep(sleep_during_loop)
+        if callable(on_finish):
+            on_finish(self)
 
+    def reset(self):
+        # prepare a failed application to be scheduled again
+        self.id = None
+        self.is_running = False
+        self.failure = None
+        self.nodes = set()
+
+    def _finish(self, on_finish):
         print("Application {} has finished".format(self))
 
         self.end_at = datetime.datetime.utcnow()
 
-        host_list = "|".join([address for address in self.nodes])
-        export_file_name = self.id + "_" + self.name
-
-        cmd_query_cpu = "\nmkdir /data/vinh.tran/new/expData/{}/{}" \
-                        "&& influx -precision rfc3339 -username root -password root" \
-                        " -database 'telegraf' -host 'localhost' -execute 'SELECT usage_user,usage_iowait " \
-                        "FROM \"telegraf\".\"autogen\".\"cpu\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                        "AND cpu = '\\''cpu-total'\\'' GROUP BY host' -format 'csv' > /data/vinh.tran/new/expData/{}/{}/cpu_{}.csv" \
-            .format(self.experiment_name,
-                    export_file_name,
-                    self.start_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.end_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    host_list,
-                    self.experiment_name,
-                    export_file_name,
-                    self.name)
-        print(cmd_query_cpu)
-        # subprocess.Popen(cmd_query_cpu, shell=True)
-
-        cmd_query_cpu_mean = "\ninflux -precision rfc3339 -username root -password root" \
-                        " -database 'telegraf' -host 'localhost' -execute 'SELECT mean(usage_user) as \"mean_cpu_percent\",mean(usage_iowait) as \"mean_io_wait\" " \
-                        "FROM \"telegraf\".\"autogen\".\"cpu\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                        "AND cpu = '\\''cpu-total'\\'' GROUP BY time(10s)' -format 'csv' > /data/vinh.tran/new/expData/{}/{}/cpu_{}_mean.csv" \
-            .format(self.start_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.end_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    host_list,
-                    self.experiment_name,
-                    export_file_name,
-                    self.name)
-        print(cmd_query_cpu_mean)
-
-        cmd_query_mem = "\ninflux -precision rfc3339 -username root -password root " \
-                        "-database 'telegraf' -host 'localhost' -execute 'SELECT used_percent " \
-                        "FROM \"telegraf\".\"autogen\".\"mem\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                        "GROUP BY host' -format 'csv' > /data/vinh.tran/new/expData/{}/{}/mem_{}.csv" \
-            .format(self.start_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.end_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    host_list,
-                    self.experiment_name,
-                    export_file_name,
-                    self.name)
-        print(cmd_query_mem)
-
-        cmd_query_mem_mean = "\ninflux -precision rfc3339 -username root -password root " \
-                        "-database 'telegraf' -host 'localhost' -execute 'SELECT mean(used_percent) " \
-                        "FROM \"telegraf\".\"autogen\".\"mem\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                        "GROUP BY time(10s)' -format 'csv' > /data/vinh.tran/new/expData/{}/{}/mem_{}_mean.csv" \
-            .format(self.start_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.end_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    host_list,
-                    self.experiment_name,
-                    export_file_name,
-                    self.name)
-        print(cmd_query_mem_mean)
-
-        cmd_query_disk = "\ninflux -precision rfc3339 -username root -password root " \
-                        "-database 'telegraf' -host 'localhost' -execute 'SELECT sum(read_bytes),sum(write_bytes) " \
-                        "FROM (SELECT derivative(last(\"read_bytes\"),1s) as \"read_bytes\",derivative(last(\"write_bytes\"),1s) as \"write_bytes\",derivative(last(\"io_time\"),1s) as \"io_time\" " \
-                        "FROM \"telegraf\".\"autogen\".\"diskio\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                        "GROUP BY \"host\",\"name\",time(10s)) WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' GROUP BY host,time(10s)' -format 'csv' > /data/vinh.tran/new/expData/{}/{}/disk_{}.csv" \
-            .format(self.start_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.end_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    host_list,
-                    self.start_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.end_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.experiment_name,
-                    export_file_name,
-                    self.name)
-        print(cmd_query_disk)
-
-        cmd_query_disk_mean = "\ninflux -precision rfc3339 -username root -password root " \
-                         "-database 'telegraf' -host 'localhost' -execute 'SELECT sum(read_bytes),sum(write_bytes) " \
-                         "FROM (SELECT derivative(last(\"read_bytes\"),1s) as \"read_bytes\",derivative(last(\"write_bytes\"),1s) as \"write_bytes\",derivative(last(\"io_time\"),1s) as \"io_time\" " \
-                         "FROM \"telegraf\".\"autogen\".\"diskio\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                         "GROUP BY \"host\",\"name\",time(10s)) WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' GROUP BY time(10s)' -format 'csv' > /data/vinh.tran/new/expData/{}/{}/disk_{}_mean.csv" \
-            .format(self.start_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.end_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    host_list,
-                    self.start_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.end_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.experiment_name,
-                    export_file_name,
-                    self.name)
-        print(cmd_query_disk_mean)
-
-        cmd_query_net = "\ninflux -precision rfc3339 -username root -password root " \
-                         "-database 'telegraf' -host 'localhost' -execute 'SELECT sum(download_bytes),sum(upload_bytes) FROM (SELECT  derivative(first(\"bytes_recv\"),1s) " \
-                         "as \"download_bytes\",derivative(first(\"bytes_sent\"),1s) as \"upload_bytes\"" \
-                         "FROM \"telegraf\".\"autogen\".\"net\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                         "GROUP BY \"host\",time(10s)) WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' GROUP BY host,time(10s)' -format 'csv' > /data/vinh.tran/new/expData/{}/{}/net_{}.csv" \
-            .format(self.start_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.end_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    host_list,
-                    self.start_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.end_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.experiment_name,
-                    export_file_name,
-                    self.name)
-        print(cmd_query_net)
-
-        cmd_query_net_mean = "\ninflux -precision rfc3339 -username root -password root " \
-                        "-database 'telegraf' -host 'localhost' -execute 'SELECT sum(download_bytes),sum(upload_bytes) FROM (SELECT  derivative(first(\"bytes_recv\"),1s) " \
-                        "as \"download_bytes\",derivative(first(\"bytes_sent\"),1s) as \"upload_bytes\"" \
-                        "FROM \"telegraf\".\"autogen\".\"net\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                        "GROUP BY \"host\",time(10s)) WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' GROUP BY time(10s)' -format 'csv' > /data/vinh.tran/new/expData/{}/{}/net_{}_mean.csv" \
-            .format(self.start_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.end_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    host_list,
-                    self.start_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.end_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    self.experiment_name,
-                    export_file_name,
-                    self.name)
-        print(cmd_query_net_mean)
-
-        subprocess.Popen(cmd_query_cpu + " && " + cmd_query_mem + " && " + cmd_query_disk + " && " + cmd_query_net + " && "
-                         + cmd_query_cpu_mean + " && " + cmd_query_mem_mean + " && " + cmd_query_disk_mean + " && " + cmd_query_net_mean, shell=True)
-
-        time.sleep(1)
-
-        with open("/data/vinh.tran/new/expData/{}/{}/cmd_{}.txt".format(self.experiment_name, export_file_name, self.name), 'a') as file:
-            file.write("{}\n\n{}\n\n{}\n\n{}\n\n\n\n{}\n\n{}\n\n{}\n\n{}\n".
-                       format(cmd_query_cpu, cmd_query_mem, cmd_query_disk, cmd_query_net,
-                              cmd_query_cpu_mean, cmd_query_mem_mean, cmd_query_disk_mean, cmd_query_net_mean))
+        if self.exporter is not None:
+            self.exporter.add_application(self)
 
         if callable(on_finish):
             on_finish(self)
 
     def copy(self):
-        return Application(self.name, len(self.tasks), data_set=self.data_set)
+        return Application(self.name, self.n_tasks, data_set=self.data_set)
 
     def is_a_copy_of(self, application):
-        return application.name == self.name and len(self.tasks) == len(application.tasks) \
+        return application.name == self.name and self.n_tasks == application.n_tasks \
                and self.data_set == application.data_set
 
 
+# A task is a view on the placement kept by its application, the objects are only created when
+# the tasks are accessed one by one
 class Task(Container):
-    def __init__(self, application: Application):
-        super().__init__()
+    __slots__ = ('app', 'index')
+
+    def __init__(self, application: Application, index=0):
         self.app = application
+        self.index = index
 
     @property
     def application(self):
         return self.app
 
+    @property
+    def node(self):
+        return self.app.task_node(self.index)
+
+    @node.setter
+    def node(self, node):
+        self.app.set_task_node(self.index, node)
+
+    def __eq__(self, other):
+        return isinstance(other, Task) and other.app is self.app and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.app), self.index))
+
+
+class Tasks(Sequence):
+    __slots__ = ('app',)
+
+    def __init__(self, application: Application):
+        self.app = application
+
+    def __len__(self):
+        return self.app.n_tasks
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Task(self.app, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("task index out of range")
+        return Task(self.app, index)
+
 
 class DummyApplication(Application):
     def __init__(self, name="app", n_tasks=8, id="id", is_running=False, data_set='1'):
@@ -263,21 +275,42 @@ class DummyApplication(Application):
 class SparkApplication(Application):
     def __init__(self, name, n_task, jar, args, jar_class=None, tm=None, **kwargs):
         super().__init__(name, n_task, **kwargs)
-        self.jar = jar
-        self.jar_class = jar_class
-        self.tm = tm
-        self.args = args
+        self.template = JobTemplate(name, n_task, jar, tuple(args), jar_class, tm)
+
+    @classmethod
+    def from_template(cls, template: 'JobTemplate', data_set=''):
+        # submission of a job sharing its template
+        app = cls.__new__(cls)
+        Application.__init__(app, template.name, template.n_tasks, data_set=data_set)
+        app.template = template
+        return app
+
+    @property
+    def jar(self):
+        return self.template.jar
+
+    @property
+    def args(self):
+        return self.template.args
+
+    @property
+    def jar_class(self):
+        return self.template.jar_class
+
+    @property
+    def tm(self):
+        return self.template.tm
 
     def command_line(self):
         cmd = [
             "$SPARK_HOME/bin/spark-submit",
             "--master yarn",
             "--deploy-mode cluster",
-            "--num-executors {}".format(len(self.tasks)),
+            "--num-executors {}".format(self.n_tasks),
             "--name {}".format(self.name)
             #"--conf spark.yarn.executor.nodeLabelExpression=\"{}\"".format(self.cluster_slot)
             # "-ynm {}_{}".format(self.name, self.data_set),
-            # "-yn {}".format(len(self.tasks)),
+            # "-yn {}".format(self.n_tasks),
             # "-yD fix.container.hosts={tasks_host}".format(
             #     tasks_host=",".join(self.tasks_hosts()),
             # ),
@@ -295,38 +328,135 @@ class SparkApplication(Application):
             cmd.append("--class {}".format(self.jar_class))
 
         cmd.append(self.jar)
+        cmd.extend(self.arguments())
+        cmd.append("1> apps_log/{}.log".format(self.id + "_" + self.name))
+
+        return cmd
 
+    def arguments(self) -> List[str]:
+        args = []
         for arg in self.args:
             if "TEMP" in arg:
-                cmd.append(arg.replace('TEMP', 'hdfs:///tmp/' + str(uuid.uuid4()).replace('-', '')))
+                args.append(arg.replace('TEMP', 'hdfs:///tmp/' + str(uuid.uuid4()).replace('-', '')))
             elif 'DATASET' in arg:
-                cmd.append(arg.replace('DATASET', self.data_set))
+                args.append(arg.replace('DATASET', self.data_set))
             else:
-                cmd.append(arg)
-
-        cmd.append("1> apps_log/{}.log".format(self.id + "_" + self.name))
+                args.append(arg)
+        return args
+
+    def is_staged(self, spark: dict) -> bool:
+        return self.jar in spark.get('jars', {})
+
+    def yarn_submission(self, application_id, spark: dict) -> Optional[dict]:
+        # Submission context of the application for the REST API of the RM, what spark-submit sends in cluster
+        # mode, None if its jar is not staged. spark: the staged resources and the settings of the submission
+        # (see Yarn).
+        if not self.is_staged(spark):
+            return None
+        jar = spark['jars'][self.jar]
+
+        properties = dict(spark.get('properties', {}))
+        properties.update({
+            "spark.app.name": self.name,
+            "spark.master": "yarn",
+            "spark.submit.deployMode": "cluster",
+            "spark.executor.instances": self.n_tasks,
+        })
+        if self.cluster_slot is not JobGroupData.SLOT_FULL:
+            properties["spark.yarn.executor.nodeLabelExpression"] = self.cluster_slot
 
-        return cmd
+        am_memory = spark.get('am_memory', 1024)
+        command = ["{{JAVA_HOME}}/bin/java", "-server", "-Xmx{}m".format(am_memory),
+                   "-Djava.io.tmpdir={{PWD}}/tmp", "-Dspark.yarn.app.container.log.dir=<LOG_DIR>"]
+        command += [shlex.quote("-D{}={}".format(key, value)) for key, value in sorted(properties.items())]
+        command.append("org.apache.spark.deploy.yarn.ApplicationMaster")
+        if self.jar_class is not None:
+            command += ["--class", shlex.quote(self.jar_class)]
+        command += ["--jar", "__app__.jar"]
+        # the arguments were split by the shell running spark-submit
+        for arg in self.arguments():
+            for word in arg.split():
+                command += ["--arg", shlex.quote(word)]
+        command += ["--properties-file", "{{PWD}}/__spark_conf__/__spark_conf__.properties",
+                    "1><LOG_DIR>/stdout", "2><LOG_DIR>/stderr"]
+
+        def resource(key, staged, kind):
+            return {"key": key, "value": dict(staged, type=kind, visibility="APPLICATION")}
+
+        return {
+            "application-id": application_id,
+            "application-name": self.name,
+            "application-type": "SPARK",
+            "queue": spark.get('queue', "default"),
+            "max-app-attempts": 1,
+            "am-container-spec": {
+                "local-resources": {"entry": [
+                    resource("__app__.jar", jar, "FILE"),
+                    resource("__spark_libs__", spark['archive'], "ARCHIVE"),
+                    resource("__spark_conf__", spark['conf'], "ARCHIVE"),
+                ]},
+                "environment": {"entry": [
+                    {"key": "CLASSPATH", "value": "<CPS>".join([
+                        "{{PWD}}", "{{PWD}}/__spark_conf__", "{{PWD}}/__spark_libs__/*", "{{HADOOP_CONF_DIR}}",
+                        "{{HADOOP_COMMON_HOME}}/share/hadoop/common/*", "{{HADOOP_COMMON_HOME}}/share/hadoop/common/lib/*",
+                        "{{HADOOP_HDFS_HOME}}/share/hadoop/hdfs/*", "{{HADOOP_HDFS_HOME}}/share/hadoop/hdfs/lib/*",
+                        "{{HADOOP_YARN_HOME}}/share/hadoop/yarn/*", "{{HADOOP_YARN_HOME}}/share/hadoop/yarn/lib/*",
+                    ])},
+                    {"key": "SPARK_YARN_STAGING_DIR",
+                     "value": "{}/{}".format(spark.get('staging_dir', ".sparkStaging"), application_id)},
+                ]},
+                "commands": {"command": " ".join(command)},
+            },
+            "resource": {"memory": am_memory + max(384, am_memory // 10), "vCores": 1},
+        }
 
     def tasks_hosts(self):
         hosts = []
-        for task in self.tasks:
-            hosts.append(task.node.address)
+        for i in range(self.n_tasks):
+            hosts.append(self.task_node(i).address)
 
         return hosts
 
     def copy(self):
-        return SparkApplication(
-            self.name,
-            len(self.tasks),
-            self.jar,
-            self.args,
-            jar_class=self.jar_class,
-            tm=self.tm,
-            data_set=self.data_set
-        )
+        return SparkApplication.from_template(self.template, self.data_set)
 
     def is_a_copy_of(self, application):
         return super().is_a_copy_of(application) and self.jar == application.jar \
                and self.args == application.args and self.jar_class == application.jar_class \
                and self.tm == application.tm
+
+
+# Immutable part of a Spark job, shared by all its submissions
+class JobTemplate(NamedTuple):
+    name: str
+    n_tasks: int
+    jar: str
+    args: Tuple[str, ...]
+    jar_class: Optional[str] = None
+    tm: Optional[int] = None
+
+    def instantiate(self, data_set='') -> SparkApplication:
+        return SparkApplication.from_template(self, data_set)
+
+
+# Job of an experiment waiting in the queue, it is only instantiated when the scheduler looks at it.
+# The jobs with the same template and data set are the same object.
+class QueuedJob(NamedTuple):
+    template: JobTemplate
+    data_set: str = ''
+    waiting_time = 0
+
+    @property
+    def name(self):
+        return self.template.name
+
+    @property
+    def n_containers(self):
+        return self.template.n_tasks
+
+    @property
+    def group(self):
+        return JobGroupData.groupIndexes.get(self.template.name, -1)
+
+    def instantiate(self) -> SparkApplication:
+        return self.template.instantiate(self.data_set)
@@ -0,0 +1,134 @@
+import math
+import numpy as np
+from abc import ABCMeta, abstractmethod
+from typing import Iterator, List
+
+
+# Arrival times of the jobs of an experiment, in seconds since its start. The scheduler releases
+# its jobs into the queue one by one at these times. The draws are made with the seeded generator
+# of the process, so that two runs with the same seed see the same arrivals.
+class ArrivalProcess(metaclass=ABCMeta):
+    def __init__(self, seed=None):
+        self.random = np.random.RandomState(seed)
+
+    @abstractmethod
+    def next_arrival(self, t: float) -> float:
+        # time of the arrival following the one at t
+        pass
+
+    @abstractmethod
+    def rate(self, t: float) -> float:
+        # jobs per second at t
+        pass
+
+    def mean_rate(self) -> float:
+        return self.rate(0.)
+
+    def times(self, n) -> Iterator[float]:
+        t = 0.
+        for _ in range(n):
+            t = self.next_arrival(t)
+            yield t
+
+
+# Arrivals of a Poisson process of rate jobs per second
+class Poisson(ArrivalProcess):
+    def __init__(self, rate, seed=None):
+        super().__init__(seed)
+        if rate <= 0:
+            raise ValueError("The arrival rate must be positive")
+        self._rate = rate
+
+    def next_arrival(self, t):
+        return t + self.random.exponential(1. / self._rate)
+
+    def rate(self, t):
+        return self._rate
+
+
+# Poisson arrivals whose rate follows a day: rate * (1 + amplitude * sin(2 pi (t - phase) / period)).
+# The arrivals are drawn by thinning a Poisson process of the peak rate.
+class Diurnal(ArrivalProcess):
+    def __init__(self, rate, amplitude=0.5, period=86400., phase=0., seed=None):
+        super().__init__(seed)
+        if rate <= 0 or not 0 <= amplitude <= 1:
+            raise ValueError("The arrival rate must be positive and the amplitude between 0 and 1")
+        self._rate = rate
+        self.amplitude = amplitude
+        self.period = period
+        self.phase = phase
+
+    def next_arrival(self, t):
+        peak = self._rate * (1 + self.amplitude)
+        while True:
+            t += self.random.exponential(1. / peak)
+            if self.random.uniform() * peak <= self.rate(t):
+                return t
+
+    def rate(self, t):
+        return self._rate * (1 + self.amplitude * math.sin(2 * math.pi * (t - self.phase) / self.period))
+
+    def mean_rate(self):
+        return self._rate
+
+
+# Bursty arrivals of a Markov-modulated Poisson process: in state i the jobs arrive with a Poisson process
+# of rate rates[i], the process stays durations[i] seconds on average in the state before moving to
+# another one drawn uniformly.
+class MMPP(ArrivalProcess):
+    def __init__(self, rates: List[float], durations: List[float], seed=None):
+        super().__init__(seed)
+        if len(rates) != len(durations) or len(rates) < 2:
+            raise ValueError("An MMPP needs a rate and a duration for at least two states")
+        self.rates = list(rates)
+        self.durations = list(durations)
+        self.state = 0
+        self._state_end = self.random.exponential(self.durations[0])
+
+    def next_arrival(self, t):
+        while True:
+            rate = self.rates[self.state]
+            arrival = t + self.random.exponential(1. / rate) if rate > 0 else math.inf
+            if arrival <= self._state_end:
+                return arrival
+            # memoryless: the next arrival is drawn again from the end of the state
+            t = self._state_end
+            others = [i for i in range(len(self.rates)) if i != self.state]
+            self.state = others[self.random.randint(len(others))]
+            self._state_end = t + self.random.exponential(self.durations[self.state])
+
+    def rate(self, t):
+        return self.rates[self.state]
+
+    def mean_rate(self):
+        # states are visited equally often, the time spent in each is proportional to its duration
+        return float(np.dot(self.rates, self.durations) / np.sum(self.durations))
+
+
+# Arrivals replayed from a trace: the times (or the first column of the lines of the file at path) are
+# seconds since the start, multiplied by scale. Once the trace is over, the remaining jobs arrive at once.
+class Trace(ArrivalProcess):
+    def __init__(self, times: List[float] = None, path=None, scale=1., seed=None):
+        super().__init__(seed)
+        if path is not None:
+            with open(path) as file:
+                times = [float(line.split(',')[0]) for line in file if line.strip() and not line.startswith('#')]
+        if times is None:
+            raise ValueError("A trace needs times or a path")
+        self._times = np.sort(np.asarray(times, dtype=float)) * scale
+        self._next = 0
+
+    def next_arrival(self, t):
+        if self._next >= len(self._times):
+            return t
+        self._next += 1
+        return max(t, float(self._times[self._next - 1]))
+
+    def rate(self, t):
+        # arrivals of the trace in the minute around t
+        return (np.searchsorted(self._times, t + 30.) - np.searchsorted(self._times, t - 30.)) / 60.
+
+    def mean_rate(self):
+        if len(self._times) < 2 or self._times[-1] == self._times[0]:
+            return math.inf
+        return (len(self._times) - 1) / (self._times[-1] - self._times[0])
@@ -0,0 +1,264 @@
+import json
+import os
+import time
+import numpy as np
+from typing import Dict, List
+import scheduler
+import complementarity
+from application import DummyApplication
+from cluster import Cluster
+from job_group_data import JobGroupData
+from resource_manager import DummyRM
+from stat_collector import DummyStatCollector, InfluxDB, Server, TelegrafStatCollector
+
+NAMES = sorted(JobGroupData.groupIndexes.keys())
+
+# (nodes, queue) of the scheduling benchmarks
+SCHEDULING_SIZES = [(10, 10), (100, 1000), (2000, 100000)]
+QUICK_SCHEDULING_SIZES = [(10, 10), (100, 1000)]
+CLUSTER_SIZES = [10, 100, 2000]
+QUICK_CLUSTER_SIZES = [10, 100]
+# number of concurrent applications given to the estimations
+CONCURRENT_APPS = [1, 4, 16]
+# hosts of the InfluxDB responses
+INFLUX_HOSTS = [10, 2000]
+# nodes of the usage ticks given to update_batch
+TICK_NODES = [10, 100]
+# recurrent applications of the dense and sparse estimations
+CATALOG_SIZES = [2000]
+
+
+def measure(function, min_time=0.2, repeat=5) -> Dict[str, float]:
+    # seconds per call of function, the number of calls per run is calibrated to last about min_time
+    number = 1
+    while True:
+        started_at = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - started_at
+        if elapsed >= min_time / 10 or number >= 1e6:
+            break
+        number *= 10
+
+    number = max(1, int(number * min_time / 10 / max(elapsed, 1e-9)))
+    runs = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        for _ in range(number):
+            function()
+        runs.append((time.perf_counter() - started_at) / number)
+
+    return {
+        'min': min(runs),
+        'mean': float(np.mean(runs)),
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def gen_apps(n, n_tasks=8, prefix="Q") -> List[DummyApplication]:
+    return [
+        DummyApplication(name=NAMES[i % len(NAMES)], n_tasks=n_tasks, id="{}{}".format(prefix, i))
+        for i in range(n)
+    ]
+
+
+def gen_cluster(n_nodes, n_containers=8, fill=0.5) -> Cluster:
+    # cluster with applications of every name on a part of its containers
+    rm = DummyRM(n_nodes=n_nodes, n_containers=n_containers)
+    cluster = Cluster(rm, DummyStatCollector(), application_master=None)
+    nodes = list(cluster.nodes.values())
+    n_apps = max(1, int(n_nodes * n_containers * fill) // 8)
+    for i, app in enumerate(gen_apps(n_apps, prefix="R")):
+        app.is_running = True
+        for k, task in enumerate(app.tasks):
+            node = nodes[(i * 8 + k) % len(nodes)]
+            if node.available_containers() > 0:
+                node.add_container(task)
+    return cluster
+
+
+def bench_get_application_to_schedule(scheduler_class, estimation_class, n_nodes, n_jobs):
+    s = scheduler_class(
+        estimation=estimation_class(gen_apps(len(NAMES), prefix="E")),
+        cluster=gen_cluster(n_nodes)
+    )
+    s.add_all(gen_apps(n_jobs))
+    # count waiting rounds, but never pick a job because it waited too long
+    s.scheduled_apps_num = 3
+    s.waiting_limit = np.iinfo(np.int64).max
+
+    def get_application_to_schedule():
+        app = s.get_application_to_schedule()
+        s.queue.appendleft(app[0] if isinstance(app, tuple) else app)
+
+    return measure(get_application_to_schedule)
+
+
+def bench_place_containers(n_nodes):
+    s = scheduler.RoundRobin(
+        estimation=complementarity.EpsilonGreedy(gen_apps(len(NAMES), prefix="E")),
+        cluster=gen_cluster(n_nodes)
+    )
+    app = gen_apps(1, n_tasks=min(64, s.cluster.available_containers()))[0]
+
+    def place_containers():
+        s.place_containers(app)
+        s.cluster.remove_applications(app)
+
+    return measure(place_containers)
+
+
+def bench_cluster_applications(n_nodes, with_full_nodes):
+    cluster = gen_cluster(n_nodes)
+    return measure(lambda: cluster.applications(with_full_nodes=with_full_nodes, by_name=True))
+
+
+def bench_apps_rates(n_nodes):
+    # usage tick: the rate of every node running applications
+    cluster = gen_cluster(n_nodes)
+    for app in cluster.scheduled_applications():
+        app.is_running = True
+    mean_usage = cluster.stat_collector.mean_usage(cluster.nodes)
+    return measure(lambda: cluster.apps_rates(mean_usage))
+
+
+def bench_update_app(estimation_class, n_concurrent):
+    apps = gen_apps(len(NAMES), prefix="E")
+    estimation = estimation_class(apps)
+    concurrent_apps = gen_apps(n_concurrent, prefix="C")
+    return measure(lambda: estimation.update_app(apps[0], concurrent_apps, 1.5))
+
+
+def bench_best_app_index(estimation_class, n_concurrent, n_jobs=8):
+    estimation = estimation_class(gen_apps(len(NAMES), prefix="E"))
+    scheduled_apps = gen_apps(n_concurrent, prefix="S")
+    apps = gen_apps(n_jobs, prefix="J")[::-1]
+    return measure(lambda: estimation.best_app_index(scheduled_apps, apps))
+
+
+def bench_update_batch(estimation_class, n_nodes, apps_per_node=4):
+    # one usage tick: every application updated with the other applications of its node
+    estimation = estimation_class(gen_apps(len(NAMES), prefix="E"))
+    apps = gen_apps(n_nodes * apps_per_node, prefix="T")
+    apps_rates = [(apps[i:i + apps_per_node], 1.5) for i in range(0, len(apps), apps_per_node)]
+    return measure(lambda: estimation.update_batch(*estimation.leave_one_out(apps_rates)))
+
+
+def bench_update_catalog(estimation_class, n_apps, n_concurrent=4):
+    # update of a large catalog where each application has only been observed with a few others
+    apps = [DummyApplication(name="A{}".format(i), id="A{}".format(i)) for i in range(n_apps)]
+    estimation = estimation_class(apps)
+    for i in range(0, n_apps, n_concurrent):
+        estimation.update_app(apps[i], apps[i + 1:i + n_concurrent], 1.)
+    return measure(lambda: estimation.update_app(apps[0], apps[1:n_concurrent], 1.5))
+
+
+def bench_influx_parse(n_hosts):
+    # response of the three aggregation statements
+    columns = ['time', 'a', 'a_max', 'b', 'b_max']
+    results = [
+        {'statement_id': i, 'series': [
+            {'name': name, 'tags': {'host': "node{}".format(h)}, 'columns': columns,
+             'values': [['1970-01-01T00:00:00Z', 1., 2., None, None]]}
+            for h in range(n_hosts)
+        ]}
+        for i, name in enumerate(['cpu', 'diskio', 'net'])
+    ]
+    return measure(lambda: InfluxDB._parse(results))
+
+
+def bench_telegraf_mean_usage(n_hosts, n_points=60):
+    collector = TelegrafStatCollector(port=0)
+    now = time.time()
+    for i in range(n_points):
+        collector.receive("\n".join(
+            "cpu,cpu=cpu-total,host=node{} usage_user=50,usage_iowait=1 {}".format(h, int((now - i) * 1e9))
+            for h in range(n_hosts)
+        ).encode())
+    servers = {"node{}".format(h): Server("node{}".format(h)) for h in range(n_hosts)}
+    try:
+        return measure(lambda: collector.mean_usage(servers))
+    finally:
+        collector.close()
+
+
+def cases(quick=False):
+    scheduling_sizes = QUICK_SCHEDULING_SIZES if quick else SCHEDULING_SIZES
+    cluster_sizes = QUICK_CLUSTER_SIZES if quick else CLUSTER_SIZES
+
+    for scheduler_class, estimation_class in [(scheduler.Adaptive, complementarity.Gradient),
+                                              (scheduler.GroupAdaptive, complementarity.GroupGradient),
+                                              (scheduler.GroupAdaptiveExtend, complementarity.GroupGradient)]:
+        for n_nodes, n_jobs in scheduling_sizes:
+            yield "{}.get_application_to_schedule[nodes={},queue={}]".format(
+                scheduler_class.__name__, n_nodes, n_jobs
+            ), bench_get_application_to_schedule, (scheduler_class, estimation_class, n_nodes, n_jobs)
+
+    for n_nodes in cluster_sizes:
+        yield "RoundRobin.place_containers[nodes={}]".format(n_nodes), bench_place_containers, (n_nodes,)
+
+    for n_nodes in cluster_sizes:
+        for with_full_nodes in (True, False):
+            yield "Cluster.applications[nodes={},with_full_nodes={}]".format(n_nodes, with_full_nodes), \
+                  bench_cluster_applications, (n_nodes, with_full_nodes)
+
+    for n_nodes in cluster_sizes:
+        yield "Cluster.apps_rates[nodes={}]".format(n_nodes), bench_apps_rates, (n_nodes,)
+
+    for estimation_class in [complementarity.EpsilonGreedy, complementarity.Gradient, complementarity.GroupGradient]:
+        for n_concurrent in CONCURRENT_APPS:
+            yield "{}.update_app[concurrent={}]".format(estimation_class.__name__, n_concurrent), \
+                  bench_update_app, (estimation_class, n_concurrent)
+            yield "{}.best_app_index[concurrent={}]".format(estimation_class.__name__, n_concurrent), \
+                  bench_best_app_index, (estimation_class, n_concurrent)
+
+        for n_nodes in TICK_NODES:
+            yield "{}.update_batch[nodes={}]".format(estimation_class.__name__, n_nodes), \
+                  bench_update_batch, (estimation_class, n_nodes)
+
+    for estimation_class in [complementarity.EpsilonGreedy, complementarity.SparseEpsilonGreedy,
+                             complementarity.Gradient, complementarity.SparseGradient]:
+        for n_apps in CATALOG_SIZES:
+            yield "{}.update_app[catalog={}]".format(estimation_class.__name__, n_apps), \
+                  bench_update_catalog, (estimation_class, n_apps)
+
+    for n_hosts in INFLUX_HOSTS:
+        yield "InfluxDB._parse[hosts={}]".format(n_hosts), bench_influx_parse, (n_hosts,)
+        yield "TelegrafStatCollector.mean_usage[hosts={}]".format(n_hosts), bench_telegraf_mean_usage, (n_hosts,)
+
+
+def run(quick=False, pattern=None, seed=0) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, function, args in cases(quick):
+        if pattern is not None and pattern not in name:
+            continue
+        np.random.seed(seed)
+        results[name] = function(*args)
+        print("{:<90} {:>12.1f} us".format(name, results[name]['min'] * 1e6))
+    return results
+
+
+def compare(results, baseline, tolerance=0.25) -> List[str]:
+    # names of the benchmarks slower than the baseline by more than tolerance
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        ratio = result['min'] / baseline[name]['min']
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = " <- regression"
+        print("{:<90} {:>8.2f}x{}".format(name, ratio, flag))
+    return regressions
+
+
+def save(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(path) -> Dict[str, Dict[str, float]]:
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,159 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import time
+from repeated_timer import RepeatedTimer
+from threading import Timer
+
+
+def _call(function, *args):
+    try:
+        return function(*args)
+    except Exception as e:
+        print(e)
+        return None
+
+
+class WallClock:
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+    def utcnow(self) -> datetime.datetime:
+        return datetime.datetime.utcnow()
+
+    def timer(self, interval, function, daemon=False):
+        timer = RepeatedTimer(interval, function)
+        timer.daemon = daemon
+        return timer
+
+    def call_later(self, delay, function, *args):
+        timer = Timer(delay, function, args)
+        timer.start()
+        return timer
+
+    def run_blocking(self, callback, function, *args):
+        # function may block, callback is called with its result (None if it raised)
+        callback(_call(function, *args))
+
+    def stop(self):
+        pass
+
+
+class VirtualClock:
+    def __init__(self, now=0.):
+        self.now = float(now)
+        self._events = []
+        self._sequence = itertools.count()
+        # number of queued events which keep the simulation alive (timers do not)
+        self._active = 0
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+    def utcnow(self) -> datetime.datetime:
+        return datetime.datetime.utcfromtimestamp(self.now)
+
+    def timer(self, interval, function, daemon=False):
+        # timers never keep the simulation alive
+        return ClockTimer(self, interval, function)
+
+    def call_at(self, when, function, *args, daemon=False):
+        heapq.heappush(self._events, (when, next(self._sequence), daemon, function, args))
+        if not daemon:
+            self._active += 1
+
+    def call_later(self, delay, function, *args, daemon=False):
+        self.call_at(self.now + delay, function, *args, daemon=daemon)
+
+    def run_blocking(self, callback, function, *args):
+        callback(_call(function, *args))
+
+    def stop(self):
+        pass
+
+    def pending(self) -> int:
+        return self._active
+
+    def run(self) -> float:
+        # Events are processed in time order until only daemon events are left.
+        # A handler may have advanced the clock past the next event (e.g. by sleeping
+        # while submitting), in which case that event is handled late, like it would be
+        # while waiting for the scheduler lock.
+        while self._active > 0:
+            when, _, daemon, function, args = heapq.heappop(self._events)
+            if not daemon:
+                self._active -= 1
+            self.now = max(self.now, when)
+            function(*args)
+
+        return self.now
+
+
+# Runs every event on one asyncio loop: timers, retries, launches and the handling of the RM and stat collector
+# responses. The requests themselves block, so run_blocking sends them to the default executor and their result
+# is handled back on the loop. run() returns once stop() is called.
+class AsyncioClock:
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self.loop = asyncio.new_event_loop() if loop is None else loop
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float):
+        # blocks the loop, only for code which does not run on it
+        time.sleep(seconds)
+
+    def utcnow(self) -> datetime.datetime:
+        return datetime.datetime.utcnow()
+
+    def timer(self, interval, function, daemon=False):
+        return ClockTimer(self, interval, function)
+
+    def call_at(self, when, function, *args, daemon=False):
+        return self.call_later(when - self.time(), function, *args)
+
+    def call_later(self, delay, function, *args, daemon=False):
+        return self.loop.call_later(max(0., delay), function, *args)
+
+    def call_soon_threadsafe(self, function, *args):
+        return self.loop.call_soon_threadsafe(function, *args)
+
+    def run_blocking(self, callback, function, *args):
+        future = self.loop.run_in_executor(None, _call, function, *args)
+        future.add_done_callback(lambda f: callback(f.result()))
+
+    def run(self) -> float:
+        self.loop.run_forever()
+        return self.time()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+# Repeated timer on top of the call_later of a clock, which does not keep a VirtualClock running
+class ClockTimer:
+    def __init__(self, clock, interval, function):
+        self.clock = clock
+        self.interval = interval
+        self.function = function
+        self.cancelled = False
+
+    def start(self):
+        self.clock.call_later(self.interval, self._fire, daemon=True)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def _fire(self):
+        if self.cancelled:
+            return
+        self.function()
+        if not self.cancelled:
+            self.clock.call_later(self.interval, self._fire, daemon=True)
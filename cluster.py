@@ -1,18 +1,37 @@
-from stat_collector import StatCollector, Server, Usage
-from resource_manager import ResourceManager
+from stat_collector import StatCollector, Server, Usage, UsageFrame
+from resource_manager import ResourceManager, NodeReport
 from application import Application, Container
-from typing import List, Tuple
+from job_group_data import JobGroupData
+from typing import Dict, List, Tuple
 from tabulate import tabulate
+import math
 import operator
 
 
+# The occupancy of a node is counted per application, the containers themselves are only known by their
+# application, so placing or removing an application costs O(applications on the node)
 class Node(Server):
-    def __init__(self, address: str, n_containers: int):
+    __slots__ = ('n_containers', 'cluster', '_containers', '_tasks', '_n_used')
+
+    def __init__(self, address: str, n_containers: int, cluster=None):
         super().__init__(address)
         self.n_containers = n_containers
-        self.containers = []
+        # the cluster is notified of every change to keep its indexes up to date
+        self.cluster = cluster
+        # application -> number of containers of the application on the node
+        self._containers = {}
+        # application -> number of non negligible containers of the application on the node
+        self._tasks = {}
+        self._n_used = 0
         print("Init new node: {} - container number: {}".format(address, n_containers))
 
+    @property
+    def containers(self) -> List[Container]:
+        return [
+            container for app in self._containers
+            for container in ([app] if app.node is self else []) + [t for t in app.tasks if t.node is self]
+        ]
+
     def add_container(self, container: Container):
         if self.available_containers() < 1:
             raise ValueError("No container is available")
@@ -20,62 +39,219 @@ class Node(Server):
         if container.node is not None:
             raise ValueError("Container has already been scheduled on a node")
 
-        self.containers.append(container)
+        app = container.application
+        apps = list(self._tasks.keys()) if self.cluster is not None else None
+        self._containers[app] = self._containers.get(app, 0) + 1
+        if not container.is_negligible:
+            self._tasks[app] = self._tasks.get(app, 0) + 1
+        self._n_used += 1
         container.node = self
 
+        if self.cluster is not None:
+            self.cluster._on_node_changed(self, apps, 1, app, 0 if container.is_negligible else 1)
+
     def remove_application(self, app: Application):
-        staying_containers = []
-        for container in self.containers:
-            if container.application == app:
-                container.node = None
-            else:
-                staying_containers.append(container)
-        self.containers = staying_containers
+        n_containers = self._containers.pop(app, None)
+        if n_containers is None:
+            return
+
+        apps = list(self._tasks.keys()) if self.cluster is not None else None
+        n_tasks = self._tasks.pop(app, 0)
+        app.release(self)
+        self._n_used -= n_containers
+
+        if self.cluster is not None:
+            self.cluster._on_node_changed(self, apps, -n_containers, app, -n_tasks)
 
     def applications(self, by_name=False, is_running=False):
-        apps = {}
-        #print("node {} has {} running containers".format(self.address, len(self.containers)))
+        apps = [app for app in self._tasks.keys() if app.is_running or not is_running]
+        if not by_name:
+            # the applications are the keys of the index, no need to deduplicate them by id
+            # (which is only known once they are launched)
+            return apps
 
-        for container in self.containers:
-            #print("container.is_negligible = {} | container.application.is_running = {}".format(container.is_negligible, container.application.is_running))
-            if not container.is_negligible and (container.application.is_running or not is_running):
-                key = getattr(container.application, 'name' if by_name else 'id')
-                apps[key] = container.application
-                #print("cluster.applications() found an scheduled app: {}".format(container.application.__str__()))
+        return list({app.name: app for app in apps}.values())
 
-        return list(apps.values())
+    def task_count(self, app: Application) -> int:
+        return self._tasks.get(app, 0)
+
+    def running_containers(self) -> int:
+        # containers of the node the RM knows as allocated
+        return sum(n for app, n in self._containers.items() if app.is_running)
 
     def available_containers(self):
-        return self.n_containers - len(self.containers)
+        return self.n_containers - self._n_used
 
     def is_empty(self):
-        return len(self.containers) == 0
+        return self._n_used == 0
 
 
 class Cluster:
+    # memory of a container in MB, the containers of a node are also bounded by its memory when it is set
+    container_memory = None
+
     def __init__(self, resource_manager: ResourceManager, stat_collector: StatCollector, application_master, node_containers=None):
         self.resource_manager = resource_manager
         self.stat_collector = stat_collector
         self.nodes = {}
         self.application_master = application_master
+        self.node_containers = node_containers
+        # indexes updated by the nodes on every change
+        self._n_containers = 0
+        self._available = 0
+        self._available_by_slot = {}
+        # application -> {address: number of tasks}
+        self._app_nodes = {}
+        # name -> {address: number of tasks}
+        self._name_nodes = {}
+        # application or name -> number of non full nodes running it
+        self._open_nodes = {}
 
         for address, n_containers in self.resource_manager.nodes().items():
             if address == self.application_master: # Don't place job on node running application master
                 continue
-            self.nodes[address] = Node(address, n_containers if node_containers is None else node_containers)
+            self._add_node(Node(address, n_containers if node_containers is None else node_containers, cluster=self))
+
+    def _add_node(self, node: Node):
+        self.nodes[node.address] = node
+        slot = JobGroupData.cluster_slots_index.get(node.address)
+        self._n_containers += node.n_containers
+        self._available += node.available_containers()
+        self._available_by_slot[slot] = self._available_by_slot.get(slot, 0) + node.available_containers()
+
+    def _remove_node(self, node: Node):
+        # the node must be empty
+        del self.nodes[node.address]
+        slot = JobGroupData.cluster_slots_index.get(node.address)
+        self._n_containers -= node.n_containers
+        self._available -= node.available_containers()
+        self._available_by_slot[slot] -= node.available_containers()
+
+    def _set_capacity(self, node: Node, n_containers):
+        available_before = node.available_containers()
+        self._n_containers += n_containers - node.n_containers
+        node.n_containers = n_containers
+        delta = node.available_containers() - available_before
+        self._available += delta
+        slot = JobGroupData.cluster_slots_index.get(node.address)
+        self._available_by_slot[slot] += delta
+
+        # the node may have become full or non full
+        if available_before > 0 and node.available_containers() == 0:
+            for key in self._open_keys(node.applications()):
+                self._open_nodes[key] -= 1
+                if self._open_nodes[key] == 0:
+                    del self._open_nodes[key]
+        elif available_before == 0 and node.available_containers() > 0:
+            for key in self._open_keys(node.applications()):
+                self._open_nodes[key] = self._open_nodes.get(key, 0) + 1
+
+    def _report_containers(self, report: NodeReport) -> Tuple[int, int]:
+        # (capacity, allocated containers) of a node report, in containers
+        capacity = report.capacity if self.node_containers is None else self.node_containers
+        used = report.used
+        if self.container_memory is not None and report.memory is not None:
+            capacity = min(capacity, report.memory // self.container_memory)
+            used = max(used, math.ceil(report.used_memory / self.container_memory))
+        return (capacity if report.healthy else 0), used
+
+    def reconcile(self, reports: Dict[str, NodeReport] = None):
+        # Applies the nodes reported by the RM: nodes which joined are added, nodes which left are removed once
+        # their containers are, and the capacity of a node is what its report leaves after the containers
+        # allocated by other applications than the ones of the node, never less than the containers placed on it.
+        if reports is None:
+            reports = self.resource_manager.node_reports()
+            if reports is None:
+                return
+
+        # the nodes may be iterated by the usage updates meanwhile, they get a new dict
+        self.nodes = dict(self.nodes)
+        for address, report in reports.items():
+            if address == self.application_master:
+                continue
+            capacity, used = self._report_containers(report)
+            node = self.nodes.get(address)
+            if node is None:
+                if report.healthy:
+                    print("Node {} joined".format(address))
+                    self._add_node(Node(address, max(0, capacity - used), cluster=self))
+                continue
 
-    def apps_usage(self) -> List[Tuple[List[Application], Usage]]:
-        mean_usage = self.stat_collector.mean_usage(self.nodes)
+            n_containers = max(node._n_used, capacity - max(0, used - node.running_containers()))
+            if n_containers != node.n_containers:
+                print("Node {}: {} -> {} containers".format(address, node.n_containers, n_containers))
+                self._set_capacity(node, n_containers)
+
+        for address, node in list(self.nodes.items()):
+            if address in reports:
+                continue
+            if node.is_empty():
+                print("Node {} left".format(address))
+                self._remove_node(node)
+            elif node.n_containers != node._n_used:
+                self._set_capacity(node, node._n_used)
+
+    def _on_node_changed(self, node: Node, apps_before, n_containers, app: Application, n_tasks):
+        self._available -= n_containers
+        slot = JobGroupData.cluster_slots_index.get(node.address)
+        self._available_by_slot[slot] -= n_containers
+
+        if n_tasks != 0:
+            app_nodes = self._app_nodes.setdefault(app, {})
+            name_nodes = self._name_nodes.setdefault(app.name, {})
+            for nodes in (app_nodes, name_nodes):
+                nodes[node.address] = nodes.get(node.address, 0) + n_tasks
+                if nodes[node.address] == 0:
+                    del nodes[node.address]
+            if len(app_nodes) == 0:
+                del self._app_nodes[app]
+            if len(name_nodes) == 0:
+                del self._name_nodes[app.name]
+
+        if node.available_containers() + n_containers > 0:
+            for key in self._open_keys(apps_before):
+                self._open_nodes[key] -= 1
+                if self._open_nodes[key] == 0:
+                    del self._open_nodes[key]
+        if node.available_containers() > 0:
+            for key in self._open_keys(node.applications()):
+                self._open_nodes[key] = self._open_nodes.get(key, 0) + 1
+
+    @staticmethod
+    def _open_keys(apps):
+        return set(apps) | {app.name for app in apps}
+
+    def apps_usage(self, mean_usage: UsageFrame = None) -> List[Tuple[List[Application], Usage]]:
+        if mean_usage is None:
+            mean_usage = self.stat_collector.mean_usage(self.nodes)
         nodes_applications = self.node_running_apps()
         
         apps_usage = []
         for address in self.nodes.keys():
-            apps_usage.append(
-                (nodes_applications[address], mean_usage[address])
-            )
+            # the usage may have been collected before a node joined
+            if address in mean_usage:
+                apps_usage.append(
+                    (nodes_applications[address], mean_usage[address])
+                )
         
         return apps_usage
 
+    def apps_rates(self, mean_usage: UsageFrame = None) -> List[Tuple[List[Application], float]]:
+        # (running applications, rate) of the nodes running applications which are not idle
+        if mean_usage is None:
+            mean_usage = self.stat_collector.mean_usage(self.nodes)
+        rates = mean_usage.rate()
+        not_idle = mean_usage.is_not_idle()
+
+        apps_rates = []
+        for address, apps in self.node_running_apps().items():
+            # the usage may have been collected before a node joined
+            row = mean_usage.index.get(address)
+            if row is not None and len(apps) > 0 and not_idle[row]:
+                apps_rates.append((apps, rates[row]))
+
+        return apps_rates
+
     def empty_nodes(self):
         return [node for node in self.nodes.values() if node.is_empty()]
 
@@ -91,42 +267,73 @@ class Cluster:
             
         return apps
 
-    def available_containers(self):
-        return sum(n.available_containers() for n in self.nodes.values())
+    def available_containers(self, slot=None):
+        if slot is None:
+            return self._available
+        return self._available_by_slot.get(slot, 0)
 
+    # applications scheduled on the cluster (oldest first) with the number of nodes they run on
     def applications(self, with_full_nodes=True, by_name=False):
         apps = {}
-        for node in self.nodes.values():
-            if node.available_containers() > 0 or with_full_nodes:
-                for app in node.applications(by_name=by_name, is_running=False):
-                    key = getattr(app, 'name' if by_name else 'id')
-                    if key in apps:
-                        apps[key][1] += 1
-                    else:
-                        apps[key] = [app, 1]
-        return zip(*apps.values()) if len(apps) > 0 else ([], [])
+        weights = {}
+        for app, app_nodes in self._app_nodes.items():
+            key = app.name if by_name else app.id
+            if key is None:
+                # not launched yet
+                key = app
+            if by_name:
+                if with_full_nodes or app in self._open_nodes:
+                    apps[key] = app
+                    weights[key] = len(self._name_nodes[key]) if with_full_nodes else self._open_nodes[key]
+            else:
+                # the id of an application is only known once it is started, so it is not indexed
+                apps[key] = app
+                weights.setdefault(key, set()).update(
+                    address for address in app_nodes
+                    if with_full_nodes or self.nodes[address].available_containers() > 0
+                )
+
+        if not by_name:
+            weights = {key: len(addresses) for key, addresses in weights.items()}
+        apps = [(app, weights[key]) for key, app in apps.items() if weights[key] > 0]
+        return zip(*apps) if len(apps) > 0 else ([], [])
+
+    def scheduled_applications(self) -> List[Application]:
+        return list(self._app_nodes.keys())
+
+    def running_applications(self) -> List[Application]:
+        return [app for app in self._app_nodes.keys() if app.is_running]
+
+    def application_nodes(self, application: Application) -> Dict[str, int]:
+        return self._app_nodes.get(application, {})
 
     def has_application_scheduled(self):
-        for node in self.nodes.values():
-            if len(node.applications()) > 0:
-                return True
-        return False
+        return len(self._app_nodes) > 0
 
     def has_application_running(self):
-        if self.available_containers() < sum(n.n_containers for n in self.nodes.values()):
-            return True
-        return False
+        return self._available < self._n_containers
 
     def remove_applications(self, application: Application):
-        for node in self.nodes.values():
-            node.remove_application(application)
+        # copy as the index is updated by the nodes
+        addresses = set(self._app_nodes.get(application, {}).keys())
+        if application.node is not None:
+            addresses.add(application.node.address)
+        for address in addresses:
+            if address in self.nodes:
+                self.nodes[address].remove_application(application)
+
+    def node_applications(self) -> Dict[str, List[str]]:
+        return {
+            address: [str(app) for app in node.applications()]
+            for address, node in sorted(self.nodes.items())
+        }
 
     def print_nodes(self):
         headers = ["Nodes", "Applications"]
         rows = []
 
-        for address, node in self.nodes.items():
-            rows.append([address, ",".join(map(str, node.applications()))])
+        for address, apps in self.node_applications().items():
+            rows.append([address, ",".join(apps)])
 
         sorted_rows = sorted(
             rows,
@@ -1,3 +1,4 @@
+import math
 import numpy as np
 from abc import ABCMeta, abstractmethod
 import operator
@@ -5,9 +6,11 @@ from typing import Dict, List
 from application import Application
 import os
 import errno
+import sys
 from pprint import pprint
 from tabulate import tabulate
 from job_group_data import JobGroupData
+import decision_trace
 
 
 class ComplementarityEstimation(metaclass=ABCMeta):
@@ -35,6 +38,25 @@ class ComplementarityEstimation(metaclass=ABCMeta):
     def update_app(self, app: Application, concurrent_apps: List[Application], rate: float):
         pass
 
+    @abstractmethod
+    def update_batch(self, app_indices, concurrent, rates):
+        # updates for the (app index, concurrent apps, rate) of leave_one_out, in order
+        pass
+
+    @abstractmethod
+    def leave_one_out(self, apps_rates):
+        # batch updating every application with the other applications of its node, for [(apps, rate)] of the nodes
+        pass
+
+    @abstractmethod
+    def concurrent_columns(self, concurrent) -> List[List[int]]:
+        # concurrent apps of an update_batch as lists of columns, and back
+        pass
+
+    @abstractmethod
+    def concurrent_from_columns(self, columns):
+        pass
+
     @abstractmethod
     def save(self, folder):
         pass
@@ -60,6 +82,10 @@ class ComplementarityEstimation(metaclass=ABCMeta):
             indices = [indices]
         return [self.reverse_index[i] for i in indices]
 
+    def _load(self, folder, filename):
+        # memory-mapped copy on write, the pages are read when used and the updates stay in memory
+        return np.load("{}/{}.npy".format(folder, filename), mmap_mode='c')
+
     def _save(self, folder, filename, matrix):
         try:
             os.makedirs(folder)
@@ -73,18 +99,73 @@ class ComplementarityEstimation(metaclass=ABCMeta):
                 f.write(self.reverse_index[i] + "\n")
 
 
-class EpsilonGreedy(ComplementarityEstimation):
-    def __init__(self, recurrent_apps, initial_average=0., epsilon=0.1):
-        super().__init__(recurrent_apps)
-        self.epsilon = epsilon
-        self.average = np.full(self.shape, float(initial_average))
-        self.update_count = np.full(self.shape, 0 if initial_average == 0 else 1, dtype=np.int64)
+# Storage of dense matrices over the whole catalog. The concurrent applications of an update are boolean
+# masks over the columns, and the updates of a batch are applied to whole rows at once.
+class DenseEstimation(ComplementarityEstimation):
+    def update_app(self, app: Application, concurrent_apps: List[Application], rate: float):
+        app_indices = self.indices(app)
+        concurrent_masks = np.zeros((len(app_indices), self.shape[1]), dtype=bool)
+        concurrent_masks[:, self.indices(concurrent_apps)] = True
+        self.update_batch(app_indices, concurrent_masks, np.full(len(app_indices), float(rate)))
+
+    def update_batch(self, app_indices, concurrent_masks, rates):
+        # Same result as calling update_app for each (app index, mask of the concurrent apps, rate) in order.
+        # Updates of different apps are independent, so the k-th updates of every app are applied at once.
+        app_indices = np.asarray(app_indices, dtype=np.int64)
+        concurrent_masks = np.asarray(concurrent_masks, dtype=bool)
+        rates = np.asarray(rates, dtype=float)
+        if len(app_indices) == 0:
+            return
+
+        order = np.argsort(app_indices, kind='stable')
+        sorted_indices = app_indices[order]
+        first = np.flatnonzero(np.r_[True, sorted_indices[1:] != sorted_indices[:-1]])
+        rounds = np.empty(len(order), dtype=np.int64)
+        rounds[order] = np.arange(len(order)) - np.repeat(first, np.diff(np.r_[first, len(order)]))
+
+        masks = self._update_masks(concurrent_masks)
+        for k in range(rounds.max() + 1):
+            updates = np.flatnonzero(rounds == k)
+            self._update_rows(app_indices[updates], masks[updates], rates[updates])
+
+    def _update_masks(self, concurrent_masks: np.ndarray) -> np.ndarray:
+        # what _update_rows needs of the concurrent apps, computed once for the whole batch
+        return concurrent_masks
 
-    def update_app(self, app, concurrent_apps, rate):
-        ix = np.ix_(self.indices(app), self.indices(concurrent_apps))
+    @abstractmethod
+    def _update_rows(self, rows: np.ndarray, masks: np.ndarray, rates: np.ndarray):
+        # update of distinct apps
+        pass
+
+    def leave_one_out(self, apps_rates):
+        apps = [app for node_apps, _ in apps_rates for app in node_apps]
+        sizes = [len(node_apps) for node_apps, _ in apps_rates]
+        app_indices = np.array(self.indices(apps), dtype=np.int64)
+        rates = np.repeat(np.array([rate for _, rate in apps_rates], dtype=float), sizes)
+        nodes = np.repeat(np.arange(len(sizes)), sizes)
+
+        node_counts = np.zeros((len(sizes), self.shape[1]), dtype=np.int64)
+        np.add.at(node_counts, (nodes, app_indices), 1)
+        counts = node_counts[nodes]
+        counts[np.arange(len(app_indices)), app_indices] -= 1
+
+        return app_indices, counts > 0, rates
 
-        self.update_count[ix] += 1
-        self.average[ix] += (rate - self.average[ix]) / self.update_count[ix]
+    def concurrent_columns(self, concurrent_masks):
+        return [np.flatnonzero(mask).tolist() for mask in concurrent_masks]
+
+    def concurrent_from_columns(self, columns):
+        concurrent_masks = np.zeros((len(columns), self.shape[1]), dtype=bool)
+        for mask, mask_columns in zip(concurrent_masks, columns):
+            mask[mask_columns] = True
+        return concurrent_masks
+
+
+# Choice of the app with the highest expected rate, or of a random one with probability epsilon
+class EpsilonGreedyPolicy(ComplementarityEstimation):
+    @abstractmethod
+    def expected_rates(self, apps, apps_to_schedule, apps_weight=None) -> np.ndarray:
+        pass
 
     def best_app_index(self, scheduled_apps, apps, scheduled_apps_weight=None):
         if len(scheduled_apps) == 0:
@@ -99,16 +180,6 @@ class EpsilonGreedy(ComplementarityEstimation):
 
         return self.__greedy(ix)
 
-    def expected_rates(self, apps, apps_to_schedule, apps_weight=None):
-        avg = self.average[np.ix_(
-            self.indices(apps),
-            self.indices(apps_to_schedule)
-        )]
-        if apps_weight is not None:
-            avg = (avg.T * apps_weight).T
-
-        return avg.sum(axis=0)
-
     def __greedy(self, items):
         if np.random.uniform() < self.epsilon:
             return items[np.random.randint(0, len(items) - 1)]
@@ -129,13 +200,41 @@ class EpsilonGreedy(ComplementarityEstimation):
         sorted_addresses = list(map(operator.itemgetter(0), sorted_nodes_apps))
         return self.__greedy(sorted_addresses)
 
+
+class EpsilonGreedy(DenseEstimation, EpsilonGreedyPolicy):
+    def __init__(self, recurrent_apps, initial_average=0., epsilon=0.1):
+        super().__init__(recurrent_apps)
+        self.epsilon = epsilon
+        self.average = np.full(self.shape, float(initial_average))
+        self.update_count = np.full(self.shape, 0 if initial_average == 0 else 1, dtype=np.int64)
+
+    def _update_rows(self, rows, concurrent_masks, rates):
+        count = self.update_count[rows] + concurrent_masks
+        average = self.average[rows]
+        self.update_count[rows] = count
+        self.average[rows] = np.where(
+            concurrent_masks,
+            average + (rates[:, None] - average) / np.maximum(count, 1),
+            average
+        )
+
+    def expected_rates(self, apps, apps_to_schedule, apps_weight=None):
+        avg = self.average[np.ix_(
+            self.indices(apps),
+            self.indices(apps_to_schedule)
+        )]
+        if apps_weight is not None:
+            avg = (avg.T * apps_weight).T
+
+        return avg.sum(axis=0)
+
     def save(self, folder):
         self._save(folder, "average", self.average)
         self._save(folder, "ucount", self.update_count)
 
     def load(self, folder):
-        self.average = np.load("{}/average.npy".format(folder))
-        self.update_count = np.load("{}/ucount.npy".format(folder))
+        self.average = self._load(folder, "average")
+        self.update_count = self._load(folder, "ucount")
 
     def print(self):
         rows = []
@@ -146,37 +245,15 @@ class EpsilonGreedy(ComplementarityEstimation):
         print(tabulate(rows, headers, tablefmt='pipe'))
 
 
-class Gradient(ComplementarityEstimation):
-    def __init__(self, recurrent_apps, alpha=0.01, initial_average=0):
-        super().__init__(recurrent_apps)
-        self.alpha = alpha
-        self.average = np.full(self.shape[0], float(initial_average))
-        self.update_count = np.full(self.shape[0], 0 if initial_average == 0 else 1, dtype=np.int64)
-        self.preferences = np.zeros(self.shape)
-
-    def update_app(self, app, concurrent_apps, rate):
-        app = self.indices(app)
-        concurrent_apps = self.indices(concurrent_apps)
-
-        self.update_count[app] += 1
-        self.average[app] += (rate - self.average[app]) / self.update_count[app]
-
-        other_apps = np.delete(list(self.index.values()), concurrent_apps)
-        ap_concurrent = self.__action_probabilities(app, concurrent_apps)
-        ap_other = self.__action_probabilities(app, other_apps)
-
-        constant = self.alpha * (rate - self.average[app])
-
-        ix = np.ix_(app, concurrent_apps)
-        self.preferences[ix] += constant * (1 - ap_concurrent)
-
-        ix = np.ix_(app, other_apps)
-        self.preferences[ix] -= constant * ap_other
-
-    def __action_probabilities(self, apps_index, concurrent_apps_index):
-        exp = np.exp(self.preferences[apps_index])
+# Choice of the app with the probabilities of a softmax over the preferences of the scheduled apps
+class GradientPolicy(ComplementarityEstimation):
+    @abstractmethod
+    def _action_probabilities(self, apps_index, concurrent_apps_index) -> np.ndarray:
+        pass
 
-        return (exp[:, concurrent_apps_index].T / exp.sum(axis=1)).T
+    @abstractmethod
+    def _action_log_probabilities(self, apps_index, concurrent_apps_index) -> np.ndarray:
+        pass
 
     def best_app_index(self, scheduled_apps, apps, scheduled_apps_weight=None):
         if len(scheduled_apps) == 0:
@@ -187,10 +264,22 @@ class Gradient(ComplementarityEstimation):
         )
 
     def normalized_action_probabilities(self, apps, apps_to_schedule, apps_weight=None):
-        p = self.__action_probabilities(self.indices(apps), self.indices(apps_to_schedule))
+        rows, columns = self.indices(apps), self.indices(apps_to_schedule)
+        p = self._action_probabilities(rows, columns)
         if apps_weight is not None:
             p = (p.T * apps_weight).T
-        p = p.sum(axis=0)
+        return self._normalize(p.sum(axis=0), rows, columns, apps_weight)
+
+    def _normalize(self, p, rows, columns, weights=None):
+        if p.sum() > 0:
+            return p / p.sum()
+        # every probability underflowed (preferences far apart after a long run), they are compared in the
+        # log domain instead
+        log_p = self._action_log_probabilities(rows, columns)
+        if weights is not None:
+            log_p = log_p + np.log(np.asarray(weights, dtype=float))[:, None]
+        log_p = np.logaddexp.reduce(log_p, axis=0)
+        p = np.exp(log_p - log_p.max())
         return p / p.sum()
 
     @staticmethod
@@ -208,15 +297,78 @@ class Gradient(ComplementarityEstimation):
 
         return self.__choose(nodes, p / p.sum())
 
+
+class Gradient(DenseEstimation, GradientPolicy):
+    def __init__(self, recurrent_apps, alpha=0.01, initial_average=0):
+        super().__init__(recurrent_apps)
+        self.alpha = alpha
+        self.average = np.full(self.shape[0], float(initial_average))
+        self.update_count = np.full(self.shape[0], 0 if initial_average == 0 else 1, dtype=np.int64)
+        self.preferences = np.zeros(self.shape)
+
+    def _columns(self) -> List[int]:
+        # apps whose preference decreases when they are not concurrent
+        return list(self.index.values())
+
+    def _update_masks(self, concurrent_masks):
+        # masks of the concurrent apps and of the others (np.delete(self._columns(), concurrent apps) of the
+        # sequential update)
+        columns = self._columns()
+        other_masks = np.zeros(concurrent_masks.shape, dtype=bool)
+        other_masks[:, columns] = ~concurrent_masks[:, :len(columns)]
+        return np.stack([concurrent_masks, other_masks], axis=1)
+
+    def _update_rows(self, rows, masks, rates):
+        self.update_count[rows] += 1
+        self.average[rows] += (rates - self.average[rows]) / self.update_count[rows]
+
+        probabilities = self._probabilities[rows]
+        constant = self.alpha * (rates - self.average[rows])
+
+        preferences = self._preferences[rows] + constant[:, None] * (
+            masks[:, 0] * (1 - probabilities) - masks[:, 1] * probabilities
+        )
+        self._preferences[rows] = preferences
+        # only the updated rows of the cache change
+        self._probabilities[rows] = self._softmax(preferences)
+
+    @property
+    def preferences(self) -> np.ndarray:
+        return self._preferences
+
+    @preferences.setter
+    def preferences(self, preferences):
+        self._preferences = np.asarray(preferences, dtype=float)
+        self._probabilities = self._softmax(self._preferences)
+
+    @staticmethod
+    def _softmax(preferences) -> np.ndarray:
+        # shifted by the max of each row so that large preferences do not overflow
+        exp = np.exp(preferences - preferences.max(axis=1, keepdims=True))
+        exp /= exp.sum(axis=1, keepdims=True)
+        return exp
+
+    def _action_probabilities(self, apps_index, concurrent_apps_index):
+        # gather of the cached probabilities, nothing is exponentiated at decision time
+        return self._probabilities[np.ix_(apps_index, concurrent_apps_index)]
+
+    def _action_log_probabilities(self, apps_index, concurrent_apps_index):
+        # log of the row normalizers, from the most probable column of each row which cannot underflow
+        rows = np.asarray(apps_index, dtype=np.int64)
+        probabilities = self._probabilities[rows]
+        best = (np.arange(len(rows)), probabilities.argmax(axis=1))
+        log_sums = self._preferences[rows][best] - np.log(probabilities[best])
+        return self._preferences[np.ix_(rows, concurrent_apps_index)] - log_sums[:, None]
+
     def save(self, folder):
         self._save(folder, "average", self.average)
         self._save(folder, "preferences", self.preferences)
         self._save(folder, "ucount", self.update_count)
 
     def load(self, folder):
-        self.average = np.load("{}/average.npy".format(folder))
-        self.update_count = np.load("{}/ucount.npy".format(folder))
-        self.preferences = np.load("{}/preferences.npy".format(folder))
+        self.average = self._load(folder, "average")
+        self.update_count = self._load(folder, "ucount")
+        self.preferences = self._load(folder, "preferences")
 
     def print(self):
         apps_name = list(self.reverse_index.values())
@@ -255,36 +407,8 @@ class GroupGradient(Gradient):
         self.update_count = np.full(self.shape[0], 0 if initial_average == 0 else 1, dtype=np.int64)
         self.preferences = np.zeros(self.shape)
 
-    def update_app(self, app, concurrent_apps, rate):
-        #print("+++++++++++ Complementarity Update_app()")
-        #print("+++++++++++ App to update: {}".format(str(app)))
-        #print("+++++++++++ Concurrent apps with above app: {}".format(str(concurrent_apps)))
-        app = self.indices(app)
-        concurrent_apps = self.indices(concurrent_apps)
-        #print("+++++++++++ Apps to update (indices): {}".format(str(app)))
-        #print("+++++++++++ Concurrent apps with above app (indices): {}".format(str(concurrent_apps)))
-
-        self.update_count[app] += 1
-        self.average[app] += (rate - self.average[app]) / self.update_count[app]
-
-        other_apps = np.delete(list(set(self.index.values())), concurrent_apps)
-        #print("+++++++++++ Other apps: {}".format(str(other_apps)))
-        ap_concurrent = self.__action_probabilities(app, concurrent_apps)
-        ap_other = self.__action_probabilities(app, other_apps)
-        #print("+++++++++++ ap_concurrent: {}".format(str(ap_concurrent)))
-        #print("+++++++++++ ap_other: {}".format(str(ap_other)))
-
-        constant = self.alpha * (rate - self.average[app])
-
-        ix = np.ix_(app, concurrent_apps)
-        #print("+++++++++++ ix (app, concurrent_apps): {}".format(str(ix)))
-        self.preferences[ix] += constant * (1 - ap_concurrent)
-        np.set_printoptions(threshold=np.nan)
-        #print("+++++++++++ Preference matrix = {}".format(print(self.preferences)))
-
-        ix = np.ix_(app, other_apps)
-        #print("+++++++++++ ix (app, other_apps): {}".format(str(ix)))
-        self.preferences[ix] -= constant * ap_other
+    def _columns(self):
+        return list(set(self.index.values()))
 
     def __str__(self):
         return type(self).__name__
@@ -292,10 +416,7 @@ class GroupGradient(Gradient):
     def best_app_index(self, scheduled_apps, apps, scheduled_apps_weight=None):
         if len(scheduled_apps) == 0 or len(scheduled_apps) == 2:
             return -1, -1
-        print("- scheduled_apps: {}".format(",".join(app.name for app in scheduled_apps)))
-        print("- apps: {}".format(",".join(app.name for app in apps)))
         probabilities = self.normalized_action_probabilities(scheduled_apps, apps, scheduled_apps_weight)
-        print("- probabilities = {}".format(str(probabilities)))
         selected_app_group_index = self.__choose(
             np.arange(len(probabilities)),
             probabilities
@@ -303,28 +424,30 @@ class GroupGradient(Gradient):
         list_groups_to_scheduled = list(set(self.indices(apps)))
         if len(list_groups_to_scheduled) > len(probabilities):
             list_groups_to_scheduled.remove(JobGroupData.groupIndexes[scheduled_apps[0].name])
-        print("- list groups to considered: {}".format(str(list_groups_to_scheduled)))
         selected_app_group = list_groups_to_scheduled[selected_app_group_index]
         # Select which exist job group to co-located with new job
-        selected_ongoing_job = np.argmax(self.preferences, axis=0)[selected_app_group]
-        print("-----------App group to schedule next = {}".format(selected_app_group))
-        #print("-----------Ongoing group to schedule with = {}".format(selected_ongoing_job))
-        print("-----------Preference matrix = {}".format(self.preferences[JobGroupData.groupIndexes[scheduled_apps[0].name],:]))
-        max_preference = -100
+        preferences = self.preferences[JobGroupData.groupIndexes[scheduled_apps[0].name], :]
+        max_preference = -np.inf
         selected_ongoing_job = -1
         for app in scheduled_apps:
             index = JobGroupData.groupIndexes[app.name]
-            if self.preferences[JobGroupData.groupIndexes[scheduled_apps[0].name],:][index] > max_preference:
-                max_preference = self.preferences[JobGroupData.groupIndexes[scheduled_apps[0].name],:][index]
+            if preferences[index] > max_preference:
+                max_preference = preferences[index]
                 selected_ongoing_job = index
-        print("-----------Ongoing job to schdule with = {}".format(selected_ongoing_job))
 
-        return selected_app_group, selected_ongoing_job
+        if decision_trace.enabled(decision_trace.DEBUG):
+            decision_trace.debug(
+                "estimation.best_group",
+                scheduled_apps=[app.name for app in scheduled_apps],
+                apps=[app.name for app in apps],
+                groups=list_groups_to_scheduled,
+                probabilities=probabilities,
+                group=selected_app_group,
+                preferences=preferences.copy(),
+                ongoing_group=selected_ongoing_job
+            )
 
-    def __action_probabilities(self, apps_index, concurrent_apps_index):
-        exp = np.exp(self.preferences[apps_index])
-
-        return (exp[:, concurrent_apps_index].T / exp.sum(axis=1)).T
+        return selected_app_group, selected_ongoing_job
 
     def normalized_action_probabilities(self, apps, apps_to_schedule, apps_weight=None):
         list_scheduled = list(set(self.indices(apps)))
@@ -332,13 +455,11 @@ class GroupGradient(Gradient):
         list_to_schedule_excluded = [app for app in list_to_schedule if app not in list_scheduled]
         if len(list_to_schedule_excluded) is not 0:
             list_to_schedule = list_to_schedule_excluded
-        print("- list_scheduled={}".format(str(list_scheduled)))
-        print("- list_to_scheduled={}".format(str(list_to_schedule)))
-        p = self.__action_probabilities(list_scheduled, list_to_schedule)
+        decision_trace.debug("estimation.groups", scheduled_groups=list_scheduled, groups=list_to_schedule)
+        p = self._action_probabilities(list_scheduled, list_to_schedule)
         # if apps_weight is not None:
         #     p = (p.T * apps_weight).T
-        p = p.sum(axis=0)
-        return p / p.sum()
+        return self._normalize(p.sum(axis=0), list_scheduled, list_to_schedule)
 
     @staticmethod
     def __choose(items, p):
@@ -351,9 +472,9 @@ class GroupGradient(Gradient):
         self._save(folder, "ucount", self.update_count)
 
     def load(self, folder):
-        self.average = np.load("{}/average.npy".format(folder))
-        self.update_count = np.load("{}/ucount.npy".format(folder))
-        self.preferences = np.load("{}/preferences.npy".format(folder))
+        self.average = self._load(folder, "average")
+        self.update_count = self._load(folder, "ucount")
+        self.preferences = self._load(folder, "preferences")
 
     def print(self):
         apps_name = list(self.reverse_index.values())
@@ -372,5 +493,233 @@ class GroupGradient(Gradient):
             rows.append([name] + self.preferences[i].tolist())
 
         #print(tabulate(rows, headers, tablefmt='pipe'))
-        np.set_printoptions(threshold=np.nan)
+        np.set_printoptions(threshold=sys.maxsize)
         print(self.preferences)
+
+
+# Storage of the observed pairs only, for catalogs of recurrent applications too large for dense matrices.
+# The concurrent applications of an update are lists of indices instead of masks over the whole catalog,
+# and each update only touches the observed pairs of its row.
+class SparseEstimation(ComplementarityEstimation):
+    def update_app(self, app: Application, concurrent_apps: List[Application], rate: float):
+        columns = set(self.indices(concurrent_apps))
+        for row in self.indices(app):
+            self._update_row(row, columns, float(rate))
+
+    def update_batch(self, app_indices, concurrent_columns, rates):
+        # rows are independent, applying the updates in order is the sequential result
+        for row, columns, rate in zip(app_indices, concurrent_columns, rates):
+            self._update_row(int(row), set(columns), float(rate))
+
+    def leave_one_out(self, apps_rates):
+        app_indices, concurrent_columns, rates = [], [], []
+        for node_apps, rate in apps_rates:
+            indices = self.indices(node_apps)
+            counts = {}
+            for i in indices:
+                counts[i] = counts.get(i, 0) + 1
+            for i in indices:
+                app_indices.append(i)
+                concurrent_columns.append([j for j, count in counts.items() if j != i or count > 1])
+                rates.append(rate)
+
+        return np.array(app_indices, dtype=np.int64), concurrent_columns, np.array(rates, dtype=float)
+
+    def concurrent_columns(self, concurrent_columns):
+        return [list(columns) for columns in concurrent_columns]
+
+    def concurrent_from_columns(self, columns):
+        return columns
+
+    @abstractmethod
+    def _update_row(self, row: int, columns, rate: float):
+        pass
+
+    def _save_pairs(self, folder, filename, pairs):
+        # [(row, column, value...)] saved as a structured array
+        self._save(folder, filename, np.array(pairs, dtype=self.pair_dtype))
+
+
+class SparseEpsilonGreedy(SparseEstimation, EpsilonGreedyPolicy):
+    pair_dtype = [('row', np.int64), ('column', np.int64), ('average', float), ('count', np.int64)]
+
+    def __init__(self, recurrent_apps, initial_average=0., epsilon=0.1):
+        ComplementarityEstimation.__init__(self, recurrent_apps)
+        self.epsilon = epsilon
+        self.initial_average = float(initial_average)
+        self.initial_count = 0 if initial_average == 0 else 1
+        # row -> {column: (average, count)} of the observed pairs
+        self._pairs = [{} for _ in range(self.shape[0])]
+
+    def _update_row(self, row, columns, rate):
+        pairs = self._pairs[row]
+        for column in columns:
+            average, count = pairs.get(column, (self.initial_average, self.initial_count))
+            count += 1
+            pairs[column] = (average + (rate - average) / count, count)
+
+    @property
+    def average(self) -> np.ndarray:
+        # dense copy
+        average = np.full(self.shape, self.initial_average)
+        for row, column, value, _ in self._items():
+            average[row, column] = value
+        return average
+
+    @property
+    def update_count(self) -> np.ndarray:
+        # dense copy
+        update_count = np.full(self.shape, self.initial_count, dtype=np.int64)
+        for row, column, _, count in self._items():
+            update_count[row, column] = count
+        return update_count
+
+    def n_pairs(self) -> int:
+        return sum(len(pairs) for pairs in self._pairs)
+
+    def _items(self):
+        for row, pairs in enumerate(self._pairs):
+            for column, (average, count) in pairs.items():
+                yield row, column, average, count
+
+    def expected_rates(self, apps, apps_to_schedule, apps_weight=None):
+        columns = self.indices(apps_to_schedule)
+        avg = np.array([
+            [self._pairs[row].get(column, (self.initial_average,))[0] for column in columns]
+            for row in self.indices(apps)
+        ], dtype=float).reshape(-1, len(columns))
+        if apps_weight is not None:
+            avg = (avg.T * apps_weight).T
+
+        return avg.sum(axis=0)
+
+    def save(self, folder):
+        self._save_pairs(folder, "average_pairs", list(self._items()))
+
+    def load(self, folder):
+        self._pairs = [{} for _ in range(self.shape[0])]
+        for row, column, average, count in self._load(folder, "average_pairs").tolist():
+            self._pairs[row][column] = (average, count)
+
+    def print(self):
+        rows = [[self.reverse_index[row], self.reverse_index[column], average, count]
+                for row, column, average, count in self._items()]
+        print(tabulate(rows, ["Application", "Concurrent application", "Average", "Count"], tablefmt='pipe'))
+
+
+class SparseGradient(SparseEstimation, GradientPolicy):
+    pair_dtype = [('row', np.int64), ('column', np.int64), ('preference', float)]
+
+    def __init__(self, recurrent_apps, alpha=0.01, initial_average=0):
+        ComplementarityEstimation.__init__(self, recurrent_apps)
+        self.alpha = alpha
+        self.average = np.full(self.shape[0], float(initial_average))
+        self.update_count = np.full(self.shape[0], 0 if initial_average == 0 else 1, dtype=np.int64)
+        self._set_pairs(np.zeros(self.shape[0]), [])
+
+    def _update_row(self, row, columns, rate):
+        self.update_count[row] += 1
+        self.average[row] += (rate - self.average[row]) / self.update_count[row]
+        constant = self.alpha * (rate - self.average[row])
+
+        pairs = self._pairs[row]
+        default = self._default[row]
+        shift, total = self._max[row], self._sum[row]
+        for column, preference in pairs.items():
+            if column not in columns:
+                pairs[column] = preference - constant * math.exp(preference - shift) / total
+        for column in columns:
+            preference = pairs.get(column, default)
+            pairs[column] = preference + constant * (1 - math.exp(preference - shift) / total)
+        # the unobserved columns share the default preference, and so the same update
+        self._default[row] = default - constant * math.exp(default - shift) / total
+        self._refresh(row)
+
+    def _refresh(self, row):
+        # max and sum of the shifted exponentials of the row, for the probabilities of its columns
+        preferences = np.fromiter(self._pairs[row].values(), dtype=float, count=len(self._pairs[row]))
+        n_default = self.shape[1] - len(preferences)
+        shift = max(preferences.max(initial=-np.inf), self._default[row] if n_default > 0 else -np.inf)
+        self._max[row] = shift
+        self._sum[row] = np.exp(preferences - shift).sum() + n_default * np.exp(self._default[row] - shift)
+
+    @property
+    def preferences(self) -> np.ndarray:
+        # dense copy
+        preferences = np.repeat(self._default[:, None], self.shape[1], axis=1)
+        for row, column, preference in self._items():
+            preferences[row, column] = preference
+        return preferences
+
+    @preferences.setter
+    def preferences(self, preferences):
+        # conversion of the dense preferences of a Gradient, the zero preferences are left unobserved
+        preferences = np.asarray(preferences, dtype=float)
+        self._set_pairs(
+            np.zeros(self.shape[0]),
+            [(row, column, preferences[row, column]) for row, column in zip(*np.nonzero(preferences))]
+        )
+
+    def _set_pairs(self, default, items):
+        self._default = np.asarray(default, dtype=float)
+        self._pairs = [{} for _ in range(self.shape[0])]
+        for row, column, preference in items:
+            self._pairs[row][column] = preference
+        self._max = np.zeros(self.shape[0])
+        self._sum = np.zeros(self.shape[0])
+        for row in range(self.shape[0]):
+            self._refresh(row)
+
+    def n_pairs(self) -> int:
+        return sum(len(pairs) for pairs in self._pairs)
+
+    def _items(self):
+        for row, pairs in enumerate(self._pairs):
+            for column, preference in pairs.items():
+                yield row, column, preference
+
+    def _action_probabilities(self, apps_index, concurrent_apps_index):
+        rows = np.asarray(apps_index, dtype=np.int64)
+        preferences = np.array([
+            [self._pairs[row].get(column, self._default[row]) for column in concurrent_apps_index]
+            for row in rows
+        ], dtype=float).reshape(len(rows), -1)
+        return np.exp(preferences - self._max[rows, None]) / self._sum[rows, None]
+
+    def _action_log_probabilities(self, apps_index, concurrent_apps_index):
+        rows = np.asarray(apps_index, dtype=np.int64)
+        preferences = np.array([
+            [self._pairs[row].get(column, self._default[row]) for column in concurrent_apps_index]
+            for row in rows
+        ], dtype=float).reshape(len(rows), -1)
+        return preferences - (self._max[rows] + np.log(self._sum[rows]))[:, None]
+
+    def save(self, folder):
+        self._save(folder, "average", self.average)
+        self._save(folder, "ucount", self.update_count)
+        self._save(folder, "preferences_default", self._default)
+        self._save_pairs(folder, "preferences_pairs", list(self._items()))
+
+    def load(self, folder):
+        self.average = self._load(folder, "average")
+        self.update_count = self._load(folder, "ucount")
+        self._set_pairs(
+            self._load(folder, "preferences_default"),
+            self._load(folder, "preferences_pairs").tolist()
+        )
+
+    def print(self):
+        apps_name = list(self.reverse_index.values())
+        print(tabulate(
+            [
+                ["Average"] + self.average.tolist(),
+                ["Count"] + self.update_count.tolist(),
+                ["Default preference"] + self._default.tolist(),
+            ],
+            apps_name,
+            tablefmt='pipe'
+        ))
+
+        rows = [[self.reverse_index[row], self.reverse_index[column], preference]
+                for row, column, preference in self._items()]
+        print(tabulate(rows, ["Application", "Concurrent application", "Preference"], tablefmt='pipe'))
@@ -0,0 +1,122 @@
+import atexit
+import gzip
+import json
+import queue
+import threading
+import time
+import numpy as np
+
+DEBUG = 10
+INFO = 20
+OFF = 100
+LEVELS = {"debug": DEBUG, "info": INFO, "off": OFF}
+LEVEL_NAMES = {level: name for name, level in LEVELS.items()}
+
+
+def _default(o):
+    # numpy values are only converted by the writer thread
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    return str(o)
+
+
+# Leveled JSONL log of the scheduling decisions.
+# event() only queues the record (time, level, kind, fields), the encoding and the writes are done by a
+# background thread in batches. Callers building costly fields should check enabled() first, with the
+# trace off an event costs one comparison.
+class DecisionTrace:
+    def __init__(self, path=None, level=OFF, clock=None, flush_interval=1., batch_size=1024):
+        self.path = path
+        self.level = level if path is not None else OFF
+        self.clock = clock
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._records = queue.SimpleQueue()
+        self._writer = None
+        if self.level < OFF:
+            self._writer = threading.Thread(target=self._write, daemon=True)
+            self._writer.start()
+
+    def enabled(self, level) -> bool:
+        return level >= self.level
+
+    def event(self, level, kind, **fields):
+        if level < self.level:
+            return
+        now = self.clock.time() if self.clock is not None else time.time()
+        self._records.put((now, level, kind, fields))
+
+    def debug(self, kind, **fields):
+        self.event(DEBUG, kind, **fields)
+
+    def info(self, kind, **fields):
+        self.event(INFO, kind, **fields)
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._records.put(None)
+        self._writer.join()
+        self._writer = None
+        self.level = OFF
+
+    def _open(self):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, "at")
+        return open(self.path, "a", buffering=1 << 16)
+
+    def _write(self):
+        with self._open() as f:
+            closed = False
+            while not closed:
+                try:
+                    records = [self._records.get(timeout=self.flush_interval)]
+                except queue.Empty:
+                    continue
+                while len(records) < self.batch_size:
+                    try:
+                        records.append(self._records.get_nowait())
+                    except queue.Empty:
+                        break
+                if records[-1] is None:
+                    closed = True
+                    records.pop()
+
+                lines = []
+                for now, level, kind, fields in records:
+                    record = {"t": now, "level": LEVEL_NAMES.get(level, level), "event": kind}
+                    record.update(fields)
+                    lines.append(json.dumps(record, default=_default))
+                if len(lines) > 0:
+                    f.write("\n".join(lines) + "\n")
+                    f.flush()
+
+
+tracer = DecisionTrace()
+
+
+def configure(path, level="info", clock=None) -> DecisionTrace:
+    # replaces the trace used by the schedulers, the estimations and the cluster
+    global tracer
+    tracer.close()
+    tracer = DecisionTrace(path, LEVELS[level] if isinstance(level, str) else level, clock)
+    return tracer
+
+
+def enabled(level) -> bool:
+    return tracer.enabled(level)
+
+
+def debug(kind, **fields):
+    tracer.event(DEBUG, kind, **fields)
+
+
+def info(kind, **fields):
+    tracer.event(INFO, kind, **fields)
+
+
+@atexit.register
+def _close():
+    tracer.close()
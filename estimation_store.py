@@ -0,0 +1,149 @@
+import json
+import os
+import shutil
+from complementarity import ComplementarityEstimation
+
+CURRENT = "CURRENT"
+WAL = "wal.jsonl"
+
+
+def _fsync_dir(folder):
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _replace(path, content):
+    # the file is either the old one or the new one, even after a crash
+    with open(path + ".tmp", "w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    _fsync_dir(os.path.dirname(path) or ".")
+
+
+def read_current(folder):
+    # (snapshot folder, sequence number of its last update) of a store, None if the folder is not a store
+    try:
+        with open(os.path.join(folder, CURRENT)) as f:
+            current = json.load(f)
+    except FileNotFoundError:
+        return None
+    return os.path.join(folder, current["snapshot"]), current["seq"]
+
+
+def read_wal(folder, after=0):
+    # updates of the write-ahead log with a sequence number above after, a torn last record is ignored
+    records = []
+    try:
+        with open(os.path.join(folder, WAL)) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record["seq"] > after:
+                    records.append(record)
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def load(estimation: ComplementarityEstimation, folder) -> int:
+    # state of a store: its last snapshot (memory-mapped) with the updates of the log replayed,
+    # or the files of ComplementarityEstimation.save. Returns the sequence number of the last update.
+    current = read_current(folder)
+    if current is None:
+        estimation.load(folder)
+        return 0
+
+    snapshot, seq = current
+    estimation.load(snapshot)
+    for record in read_wal(folder, seq):
+        estimation.update_batch(
+            record["rows"], estimation.concurrent_from_columns(record["columns"]), record["rates"]
+        )
+        seq = record["seq"]
+    return seq
+
+
+# Crash-safe storage of an estimation in a folder:
+# - a snapshot, saved by the estimation in snapshot-<seq>/ and pointed by the CURRENT file,
+# - a write-ahead log of the update batches applied since, each fsynced before it is applied.
+# Every compact_every updates a new snapshot is written and CURRENT is atomically replaced, then the log
+# is truncated. A crash loses at most the update being written.
+class EstimationStore:
+    def __init__(self, folder, estimation: ComplementarityEstimation, compact_every=10, sync=True):
+        self.folder = folder
+        self.estimation = estimation
+        self.compact_every = compact_every
+        self.sync = sync
+        os.makedirs(folder, exist_ok=True)
+        current = read_current(folder)
+        records = read_wal(folder)
+        # new sequence numbers follow the ones already in the folder
+        self.seq = max([0 if current is None else current[1]] + [record["seq"] for record in records])
+        self._snapshot_seq = None
+        self._wal = None
+
+    def update(self, app_indices, concurrent, rates):
+        # logs then applies an update_batch
+        if self._snapshot_seq is None:
+            self.compact()
+        self.seq += 1
+        record = {
+            "seq": self.seq,
+            "rows": [int(row) for row in app_indices],
+            "columns": self.estimation.concurrent_columns(concurrent),
+            "rates": [float(rate) for rate in rates],
+        }
+        self._wal.write(json.dumps(record) + "\n")
+        self._wal.flush()
+        if self.sync:
+            os.fsync(self._wal.fileno())
+
+        self.estimation.update_batch(app_indices, concurrent, rates)
+        if self.seq - self._snapshot_seq >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        if self._snapshot_seq == self.seq:
+            # nothing was updated since the last snapshot
+            return
+        snapshot = self._new_snapshot()
+        path = os.path.join(self.folder, snapshot)
+        self.estimation.save(path)
+        for filename in os.listdir(path):
+            with open(os.path.join(path, filename), "rb") as f:
+                os.fsync(f.fileno())
+        _fsync_dir(path)
+        _replace(os.path.join(self.folder, CURRENT), json.dumps({"snapshot": snapshot, "seq": self.seq}))
+        self._snapshot_seq = self.seq
+
+        # the updates of the log are in the snapshot now
+        if self._wal is not None:
+            self._wal.close()
+        _replace(os.path.join(self.folder, WAL), "")
+        self._wal = open(os.path.join(self.folder, WAL), "a")
+
+        for filename in os.listdir(self.folder):
+            if filename.startswith("snapshot-") and filename != snapshot:
+                shutil.rmtree(os.path.join(self.folder, filename), ignore_errors=True)
+
+    def _new_snapshot(self):
+        # name of a folder which does not exist yet: the snapshot of CURRENT may have the same sequence number
+        # (after a restart), it is only removed once CURRENT names the new one
+        snapshot = "snapshot-{}".format(self.seq)
+        n = 0
+        while os.path.exists(os.path.join(self.folder, snapshot)):
+            n += 1
+            snapshot = "snapshot-{}.{}".format(self.seq, n)
+        return snapshot
+
+    def close(self):
+        self.compact()
+        self._wal.close()
+        self._wal = None
@@ -0,0 +1,264 @@
+from influxdb import InfluxDBClient
+from typing import Iterable, List
+import calendar
+import csv
+import datetime
+import gzip
+import os
+import queue
+import threading
+import time
+import warnings
+import numpy as np
+
+# mean usage of every host in buckets of BUCKET seconds, the columns are the metrics of the archive
+BUCKET = 10
+QUERY = """
+    SELECT mean(usage_user) AS cpu, mean(usage_iowait) AS io_wait FROM "telegraf"."autogen"."cpu"
+    WHERE time > '{start}' AND time < '{end}' AND host =~ /^({hosts})$/ AND cpu = 'cpu-total'
+    GROUP BY host, time({bucket}s);
+    SELECT mean(used_percent) AS mem FROM "telegraf"."autogen"."mem"
+    WHERE time > '{start}' AND time < '{end}' AND host =~ /^({hosts})$/
+    GROUP BY host, time({bucket}s);
+    SELECT sum(read_bytes) AS dsk_read, sum(write_bytes) AS dsk_write FROM (
+        SELECT derivative(last("read_bytes"), 1s) AS "read_bytes",
+               derivative(last("write_bytes"), 1s) AS "write_bytes"
+        FROM "telegraf"."autogen"."diskio"
+        WHERE time > '{start}' AND time < '{end}' AND host =~ /^({hosts})$/
+        GROUP BY "host", "name", time({bucket}s)
+    ) WHERE time > '{start}' AND time < '{end}'
+    GROUP BY host, time({bucket}s);
+    SELECT sum(download_bytes) AS net_recv, sum(upload_bytes) AS net_sent FROM (
+        SELECT derivative(first("bytes_recv"), 1s) AS "download_bytes",
+               derivative(first("bytes_sent"), 1s) AS "upload_bytes"
+        FROM "telegraf"."autogen"."net"
+        WHERE time > '{start}' AND time < '{end}' AND host =~ /^({hosts})$/
+        GROUP BY "host", time({bucket}s)
+    ) WHERE time > '{start}' AND time < '{end}'
+    GROUP BY host, time({bucket}s)"""
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def epoch(timestamp) -> int:
+    # seconds since the epoch of an rfc3339 string or a naive utc datetime
+    if isinstance(timestamp, str):
+        timestamp = datetime.datetime.strptime(timestamp, TIME_FORMAT)
+    return calendar.timegm(timestamp.utctimetuple())
+
+
+# Metrics of an experiment: values[host, metric, bucket] is the mean of the metric on the host during the bucket
+# starting at times[bucket], nan without points. The applications of the experiment are indexed by id with
+# their hosts and their time range, their view is a slice of the archive.
+class MetricsArchive:
+    metrics = ['cpu', 'io_wait', 'mem', 'dsk_read', 'dsk_write', 'net_recv', 'net_sent']
+    # metrics summed over the hosts by total(), the others are averaged
+    summed = ['dsk_read', 'dsk_write', 'net_recv', 'net_sent']
+
+    def __init__(self, hosts: List[str], times, values, applications=None):
+        self.hosts = list(hosts)
+        self.times = np.asarray(times, dtype=np.int64)
+        self.values = np.asarray(values, dtype=float)
+        self.host_index = {host: i for i, host in enumerate(self.hosts)}
+        # application id -> (name, start, end, hosts)
+        self.applications = {} if applications is None else applications
+
+    @classmethod
+    def from_series(cls, hosts: List[str], series: Iterable[dict], bucket=BUCKET):
+        # archive of the series of a query grouped by host and time, with epoch times
+        host_index = {host: i for i, host in enumerate(hosts)}
+        metric_index = {metric: i for i, metric in enumerate(cls.metrics)}
+        columns = []
+        for s in series:
+            if s.get('values') is None or s.get('tags', {}).get('host') not in host_index:
+                continue
+            values = np.array(s['values'], dtype=float)
+            for j, column in enumerate(s['columns'][1:], 1):
+                if column in metric_index:
+                    columns.append((host_index[s['tags']['host']], metric_index[column], values[:, 0], values[:, j]))
+
+        if len(columns) == 0:
+            return cls(hosts, [], np.full((len(hosts), len(cls.metrics), 0), np.nan))
+        first = int(min(c[2].min() for c in columns))
+        last = int(max(c[2].max() for c in columns))
+        times = np.arange(first, last + bucket, bucket, dtype=np.int64)
+        values = np.full((len(hosts), len(cls.metrics), len(times)), np.nan)
+        for host, metric, t, v in columns:
+            values[host, metric, ((t - first) // bucket).astype(np.int64)] = v
+        return cls(hosts, times, values)
+
+    def add_application(self, app_id, name, start, end, hosts: Iterable[str]):
+        self.applications[app_id] = (name, epoch(start), epoch(end), sorted(hosts))
+
+    def view(self, hosts: Iterable[str], start, end) -> 'MetricsArchive':
+        # the buckets of the hosts overlapping the range from start to end (epoch seconds)
+        hosts = [host for host in hosts if host in self.host_index]
+        first = np.searchsorted(self.times, start - BUCKET, side='right')
+        last = np.searchsorted(self.times, end, side='left')
+        values = self.values[[self.host_index[host] for host in hosts]][:, :, first:last]
+        return MetricsArchive(hosts, self.times[first:last], values)
+
+    def application(self, app_id) -> 'MetricsArchive':
+        _, start, end, hosts = self.applications[app_id]
+        return self.view(hosts, start, end)
+
+    def total(self) -> np.ndarray:
+        # (metrics x buckets) mean or sum over the hosts
+        summed = np.isin(self.metrics, self.summed)
+        with warnings.catch_warnings():
+            # buckets without points stay nan
+            warnings.simplefilter("ignore", RuntimeWarning)
+            means = np.nanmean(self.values, axis=0)
+        sums = np.nansum(self.values, axis=0)
+        sums[np.all(np.isnan(self.values), axis=0)] = np.nan
+        return np.where(summed[:, None], sums, means)
+
+    def save(self, path):
+        # written to a temporary file renamed once complete
+        ids = sorted(self.applications)
+        with open(path + ".tmp", "wb") as file:
+            np.savez_compressed(
+                file,
+                hosts=np.array(self.hosts, dtype=str),
+                metrics=np.array(self.metrics, dtype=str),
+                times=self.times,
+                values=self.values,
+                app_ids=np.array(ids, dtype=str),
+                app_names=np.array([self.applications[i][0] for i in ids], dtype=str),
+                app_ranges=np.array([self.applications[i][1:3] for i in ids], dtype=np.int64).reshape(-1, 2),
+                app_hosts=np.array([np.isin(self.hosts, self.applications[i][3]) for i in ids], dtype=bool)
+                .reshape(-1, len(self.hosts)),
+            )
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path) -> 'MetricsArchive':
+        with np.load(path) as data:
+            hosts = data['hosts'].tolist()
+            archive = cls(hosts, data['times'], data['values'])
+            for app_id, name, (start, end), mask in zip(data['app_ids'].tolist(), data['app_names'].tolist(),
+                                                       data['app_ranges'].tolist(), data['app_hosts']):
+                archive.applications[app_id] = (name, start, end, [h for h, m in zip(hosts, mask) if m])
+        return archive
+
+    def to_csv(self, path, total=False):
+        # gzipped csv of the buckets, one row per host and bucket or per bucket for the total
+        with gzip.open(path + ".tmp", 'wt', newline='') as file:
+            writer = csv.writer(file)
+            if total:
+                writer.writerow(['time'] + self.metrics)
+                for t, values in zip(self.times.tolist(), self.total().T.tolist()):
+                    writer.writerow([t] + values)
+            else:
+                writer.writerow(['host', 'time'] + self.metrics)
+                for host, host_values in zip(self.hosts, self.values):
+                    for t, values in zip(self.times.tolist(), host_values.T.tolist()):
+                        writer.writerow([host, t] + values)
+        os.replace(path + ".tmp", path)
+
+
+# Exports the metrics of an experiment in one query: the usage of every node in buckets of BUCKET seconds
+# is pulled once at the end into a MetricsArchive (metrics_<experiment>.npz), and the views of the finished
+# applications are sliced from it into <id>_<name>/metrics_<name>.csv.gz and metrics_<name>_mean.csv.gz.
+# The jobs run on worker threads sharing the InfluxDB client of the scheduler. At most max_pending jobs wait
+# for a worker: submit blocks until one is taken. The query results are streamed by chunks of chunk_size
+# points, and a job which fails is retried max_retries times, retry_backoff seconds apart, doubled for each
+# further retry.
+class Exporter:
+    root = "/data/vinh.tran/new/expData"
+
+    def __init__(self, client: InfluxDBClient, folder, workers=2, max_pending=64, chunk_size=10000, max_retries=3,
+                 retry_backoff=1.):
+        self.client = client
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.failed = []
+        self.applications = []
+        self._lock = threading.Lock()
+        self._jobs = queue.Queue(max_pending)
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def add_application(self, app):
+        # the finished application is exported with the experiment
+        with self._lock:
+            self.applications.append((app.id, app.name, app.start_at, app.end_at, set(app.nodes)))
+
+    def export_experiment(self, label, hosts: Iterable[str], start, end):
+        # pulls the archive of the hosts between start and end (rfc3339), widened to the range of the
+        # applications, then exports the views of the applications
+        os.makedirs(self.folder, exist_ok=True)
+        hosts = sorted(hosts)
+        with self._lock:
+            applications = list(self.applications)
+        start = min([start] + [a[2].strftime(TIME_FORMAT) for a in applications])
+        end = max([end] + [a[3].strftime(TIME_FORMAT) for a in applications])
+        query = QUERY.format(start=start, end=end, hosts="|".join(hosts), bucket=BUCKET)
+        with open(os.path.join(self.folder, "cmd.txt"), 'a') as file:
+            file.write(query + "\n")
+
+        path = os.path.join(self.folder, "metrics_{}.npz".format(label))
+        self.submit(path, lambda p: self._archive(p, query, hosts, applications))
+        self.join()
+        if path in self.failed:
+            return
+
+        archive = MetricsArchive.load(path)
+        for app_id, name, _, _, _ in applications:
+            folder = os.path.join(self.folder, "{}_{}".format(app_id, name))
+            os.makedirs(folder, exist_ok=True)
+            view = archive.application(app_id)
+            self.submit(os.path.join(folder, "metrics_{}.csv.gz".format(name)), view.to_csv)
+            self.submit(os.path.join(folder, "metrics_{}_mean.csv.gz".format(name)),
+                        lambda p, view=view: view.to_csv(p, total=True))
+
+    def submit(self, path, write):
+        # write(path) is called by a worker
+        self._jobs.put((path, write))
+
+    def join(self):
+        # waits for the queued jobs
+        self._jobs.join()
+
+    def close(self):
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join()
+        if len(self.failed) > 0:
+            print("Failed exports: {}".format(",".join(self.failed)))
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None:
+                    return
+                self._export(*job)
+            finally:
+                self._jobs.task_done()
+
+    def _export(self, path, write):
+        for attempt in range(self.max_retries + 1):
+            try:
+                write(path)
+                return
+            except Exception as e:
+                print("Export of {} failed ({}), attempt {}/{}".format(path, e, attempt + 1, self.max_retries + 1))
+                if attempt < self.max_retries:
+                    time.sleep(self.retry_backoff * 2 ** attempt)
+                if os.path.exists(path + ".tmp"):
+                    os.remove(path + ".tmp")
+        with self._lock:
+            self.failed.append(path)
+
+    def _archive(self, path, query, hosts, applications):
+        series = []
+        for chunk in self.client.query(query, epoch='s', chunked=True, chunk_size=self.chunk_size):
+            series.extend(chunk.raw.get('series', []))
+        archive = MetricsArchive.from_series(hosts, series)
+        for app_id, name, start, end, nodes in applications:
+            archive.add_application(app_id, name, start, end, nodes)
+        archive.save(path)
@@ -1,15 +1,22 @@
+import tempfile
 import yaml
 import stat_collector
 import resource_manager
 from cluster import Cluster
 import numpy as np
-from yarn_workloader import Jobs, Experiment
+from typing import Dict, Iterator, Optional, TextIO
+import arrival
+from arrival import ArrivalProcess
+from application import QueuedJob
+from yarn_workloader import Jobs, Experiment, ExperimentWriter
 import complementarity
 from scheduler import EstimationBenchmark
+from clock import VirtualClock
+from submission import ClockSubmissionPool
 
 
 def cluster(yaml_source):
-    config = yaml.load(yaml_source)
+    config = yaml_source if isinstance(yaml_source, dict) else yaml.safe_load(yaml_source)
     rm = getattr(resource_manager, config['resource_manager']['type'])(
         **config['resource_manager'].get('kwargs', {})
     )
@@ -20,6 +27,7 @@ def cluster(yaml_source):
     stat_collector.Server.net_max = config['server']['net_max']
     stat_collector.Server.disk_name = config['server']['disk_name']
     stat_collector.Server.net_interface = config['server']['net_interface']
+    Cluster.container_memory = config['server'].get('container_memory', None)
 
     return Cluster(
         resource_manager=rm,
@@ -29,36 +37,113 @@ def cluster(yaml_source):
     )
 
 
+def arrival_process(config) -> Optional[ArrivalProcess]:
+    # process of the arrival section of the config, None when the jobs are all queued at the start
+    if config.get('arrival') is None:
+        return None
+    return getattr(arrival, config['arrival']['type'])(**config['arrival'].get('kwargs', {}))
+
+
+def experiment_jobs(jobs: Jobs, n_jobs, chunk_size=10000) -> Iterator[QueuedJob]:
+    # jobs drawn uniformly, the draws are made by chunks (the sequence is the same as one by one)
+    app_names = jobs.names()
+    for start in range(0, n_jobs, chunk_size):
+        for i in np.random.randint(0, len(app_names), size=min(chunk_size, n_jobs - start)):
+            yield jobs.job(app_names[i])
+
+
 def experiment(jobs_xml_str, n_jobs):
     jobs = Jobs()
     jobs.read(jobs_xml_str)
-    n = len(jobs)
-    app_names = jobs.names()
 
-    applications = []
-    for i in range(n_jobs):
-        applications.append(
-            jobs[app_names[np.random.randint(0, n)]]
-        )
+    return Experiment(applications=list(experiment_jobs(jobs, n_jobs)))
 
-    return Experiment(applications=applications)
 
+def write_experiment(jobs_xml_str, n_jobs, file: TextIO, name="generated_experiment"):
+    # the jobs are written as they are drawn
+    jobs = Jobs()
+    jobs.read(jobs_xml_str)
+
+    with ExperimentWriter(file, name) as writer:
+        writer.write_all(experiment_jobs(jobs, n_jobs))
 
-def scheduler(scheduler_class, estimation_class, exp_xml_str, jobs_xml_str, config_yaml, estimation_kwargs=None):
+
+def scheduler(scheduler_class, estimation_class, exp_xml_str, jobs_xml_str, config_yaml, estimation_kwargs=None,
+              clock=None, submissions=None, exp_xml=None, arrivals=None):
+    # with the file exp_xml instead of exp_xml_str, the experiment is streamed into the queue,
+    # arrivals replaces the arrival process of the config
     jobs = Jobs()
     jobs.read(jobs_xml_str)
     exp = Experiment()
-    exp.read(exp_xml_str, jobs)
+    config = yaml.safe_load(config_yaml)
 
     _scheduler = scheduler_class(
         estimation=estimation_class(jobs.applications(), **({} if estimation_kwargs is None else estimation_kwargs)),
-        cluster=cluster(config_yaml)
+        cluster=cluster(config),
+        clock=clock,
+        submissions=submissions,
+        arrivals=arrival_process(config) if arrivals is None else arrivals
+    )
+    if exp_xml is not None:
+        _scheduler.add_stream(exp.stream(exp_xml, jobs))
+    else:
+        exp.read(exp_xml_str, jobs)
+        _scheduler.add_all(exp.jobs)
+
+    return _scheduler
+
+
+def simulation(scheduler_class, estimation_class, exp_xml_str, jobs_xml_str, config_yaml, estimation_kwargs=None,
+               exp_xml=None, arrivals=None):
+    clock = VirtualClock()
+    _scheduler = scheduler(
+        scheduler_class=scheduler_class,
+        estimation_class=estimation_class,
+        exp_xml_str=exp_xml_str,
+        jobs_xml_str=jobs_xml_str,
+        config_yaml=config_yaml,
+        estimation_kwargs=estimation_kwargs,
+        clock=clock,
+        submissions=ClockSubmissionPool(clock, scheduler_class.submission_spacing),
+        exp_xml=exp_xml,
+        arrivals=arrivals
     )
-    _scheduler.add_all(exp.applications)
+    _scheduler.cluster.resource_manager.clock = clock
+    _scheduler.export_data = False
+    _scheduler.print_estimation = False
 
     return _scheduler
 
 
+def load_test(scheduler_class, estimation_class, jobs_xml_str, config_yaml, arrivals: ArrivalProcess, n_jobs,
+              seed=0) -> Dict[str, float]:
+    # simulation of n_jobs drawn with the seed and released by the arrival process: against the offered rate,
+    # a saturated cluster schedules fewer jobs per second and its queue and queueing delay grow with n_jobs
+    np.random.seed(seed)
+    _scheduler = simulation(
+        scheduler_class=scheduler_class,
+        estimation_class=estimation_class,
+        exp_xml_str=experiment(jobs_xml_str, n_jobs).to_xml(),
+        jobs_xml_str=jobs_xml_str,
+        config_yaml=config_yaml,
+        arrivals=arrivals
+    )
+    with tempfile.TemporaryDirectory() as folder:
+        # the estimation is saved at the end of the simulation
+        _scheduler.estimation.output_folder = folder
+        _scheduler.start()
+        duration = _scheduler.clock.run()
+    n_scheduled = max(1, _scheduler.scheduled_apps_num)
+
+    return {
+        'offered_rate': arrivals.mean_rate(),
+        'throughput': _scheduler.scheduled_apps_num / duration,
+        'mean_queue_delay': _scheduler.total_queue_delay / n_scheduled,
+        'max_queue_length': _scheduler.max_queue_length,
+        'duration': duration,
+    }
+
+
 def estimations_bench(exp_xml_str, jobs_xml_str, config_yaml):
     jobs = Jobs()
     jobs.read(jobs_xml_str)
@@ -72,6 +157,6 @@ def estimations_bench(exp_xml_str, jobs_xml_str, config_yaml):
         ],
         cluster=cluster(config_yaml)
     )
-    _scheduler.add_all(exp.applications)
+    _scheduler.add_all(exp.jobs)
 
     return _scheduler
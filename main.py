@@ -1,10 +1,22 @@
 import argparse
+import contextlib
 import sys
+import arrival
 import generator
+import decision_trace
 import scheduler
 import complementarity
-import subprocess
+import estimation_store
+import os
+import time
+import numpy as np
 from application import Application
+from clock import AsyncioClock
+from estimation_store import EstimationStore
+from export import Exporter
+from influxdb import InfluxDBClient
+from stat_collector import InfluxDB
+from submission import ClockSubmissionPool
 from scheduler import Scheduler
 from datetime import datetime
 
@@ -14,33 +26,126 @@ def run(args):
     estimation_class = getattr(complementarity, args.estimation)
     Scheduler.jobs_to_peek_arg = args.jobs_to_peek
     Scheduler.waiting_limit = args.waiting_limit
-    Scheduler.activate_random_arrival = args.random_rate
+    Scheduler.max_retries = args.max_retries
+    Scheduler.retry_backoff = args.retry_backoff
+    Application.submission_timeout = args.submission_timeout
+    Scheduler.submission_workers = args.submission_workers
+    Scheduler.submission_spacing = args.submission_spacing
+    Scheduler.reconcile_interval = args.reconcile_interval
+    clock = AsyncioClock() if args.asyncio else None
     s = generator.scheduler(
         scheduler_class=scheduler_class,
         estimation_class=estimation_class,
-        exp_xml_str=args.experiment_xml.read(),
+        exp_xml_str=None,
+        exp_xml=args.experiment_xml,
         jobs_xml_str=args.jobs_xml.read(),
-        config_yaml=args.config_yaml
+        config_yaml=args.config_yaml,
+        clock=clock,
+        submissions=None if clock is None else ClockSubmissionPool(clock, args.submission_spacing),
+        arrivals=None if args.arrival_rate is None else arrival.Poisson(args.arrival_rate)
     )
+    s.cluster.resource_manager.clock = clock
     Application.print_command_line = args.pcmd
     Application.experiment_name = "experiment_" + datetime.now().strftime("%Y%m%d_%H%M%S") + "_" + args.experiment_name
     print("Experiment folder = {}".format(Application.experiment_name))
-    subprocess.Popen("mkdir /data/vinh.tran/new/expData/{}".format(Application.experiment_name), shell=True)
+    stat = s.cluster.stat_collector
+    client = stat.client if isinstance(stat, InfluxDB) \
+        else InfluxDBClient(host="localhost", username="root", password="root", database="telegraf")
+    Application.exporter = Exporter(
+        client, os.path.join(Exporter.root, Application.experiment_name), args.export_workers, args.export_pending
+    )
 
     #Scheduler.jobs_to_peek_arg = args.jobs_to_peek
 
     if args.estimation_parameters is not None:
-        s.estimation.load(args.estimation_parameters)
+        estimation_store.load(s.estimation, args.estimation_parameters)
+
+    if args.estimation_folder is not None:
+        s.estimation.output_folder = args.estimation_folder
+
+    if args.checkpoint_every > 0:
+        s.estimation_store = EstimationStore(s.estimation.output_folder, s.estimation, args.checkpoint_every)
+
+    if args.trace is not None:
+        decision_trace.configure(args.trace, args.trace_level)
+
+    if clock is None:
+        s.start()
+    else:
+        clock.call_later(0, s.start)
+        clock.run()
+
+
+def simulate(args):
+    scheduler_class = getattr(scheduler, args.scheduler)
+    estimation_class = getattr(complementarity, args.estimation)
+    Scheduler.jobs_to_peek_arg = args.jobs_to_peek
+    Scheduler.waiting_limit = args.waiting_limit
+    Scheduler.max_retries = args.max_retries
+    Scheduler.retry_backoff = args.retry_backoff
+    if args.seed is not None:
+        np.random.seed(args.seed)
+    s = generator.simulation(
+        scheduler_class=scheduler_class,
+        estimation_class=estimation_class,
+        exp_xml_str=None,
+        exp_xml=args.experiment_xml,
+        jobs_xml_str=args.jobs_xml.read(),
+        config_yaml=args.config_yaml,
+        arrivals=None if args.arrival_rate is None else arrival.Poisson(args.arrival_rate, seed=args.seed)
+    )
+
+    if args.estimation_parameters is not None:
+        estimation_store.load(s.estimation, args.estimation_parameters)
 
     if args.estimation_folder is not None:
         s.estimation.output_folder = args.estimation_folder
 
+    if args.checkpoint_every > 0:
+        s.estimation_store = EstimationStore(s.estimation.output_folder, s.estimation, args.checkpoint_every)
+
+    if args.trace is not None:
+        decision_trace.configure(args.trace, args.trace_level, s.clock)
+
+    started_at = time.time()
     s.start()
+    s.clock.run()
+    decision_trace.tracer.close()
+    print("Simulated {} jobs ({:.0f}s of cluster time) in {:.1f}s, {} jobs left in the queue".format(
+        s.n_queued, s.clock.time(), time.time() - started_at, len(s.queue)
+    ))
 
 
 def gen(args):
-    exp = generator.experiment(args.jobs_xml.read(), args.n_jobs)
-    args.output.write(exp.to_xml())
+    generator.write_experiment(args.jobs_xml.read(), args.n_jobs, args.output)
+
+
+def load(args):
+    # one simulation per arrival rate, the cluster is saturated when its throughput stops following the rate
+    scheduler_class = getattr(scheduler, args.scheduler)
+    estimation_class = getattr(complementarity, args.estimation)
+    jobs_xml_str = args.jobs_xml.read()
+    config_yaml = args.config_yaml.read()
+    print("{:>12} {:>12} {:>16} {:>10}".format("rate", "throughput", "queue delay (s)", "max queue"))
+    for rate in args.rates:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = generator.load_test(scheduler_class, estimation_class, jobs_xml_str, config_yaml,
+                                         arrival.Poisson(rate, seed=args.seed), args.n_jobs, args.seed)
+        print("{:>12.5f} {:>12.5f} {:>16.1f} {:>10}".format(
+            rate, result['throughput'], result['mean_queue_delay'], result['max_queue_length']
+        ))
+
+
+def bench(args):
+    import benchmark
+    results = benchmark.run(quick=args.quick, pattern=args.pattern, seed=args.seed)
+    if args.output is not None:
+        benchmark.save(results, args.output)
+    if args.baseline is not None:
+        regressions = benchmark.compare(results, benchmark.load(args.baseline), args.tolerance)
+        if len(regressions) > 0:
+            print("{} benchmarks are slower than the baseline".format(len(regressions)))
+            sys.exit(1)
 
 
 def estimation_bench(args):
@@ -62,6 +167,12 @@ parser_estimations = subparsers.add_parser("estimations", help="Print the differ
 parser_estimations.set_defaults(func=estimation_bench)
 parser_gen = subparsers.add_parser("gen", help="Generate an experiment from jobs list")
 parser_gen.set_defaults(func=gen)
+parser_simulate = subparsers.add_parser("simulate", help="Simulate an experiment with a virtual clock")
+parser_simulate.set_defaults(func=simulate)
+parser_bench = subparsers.add_parser("bench", help="Time the scheduling hot paths")
+parser_bench.set_defaults(func=bench)
+parser_load = subparsers.add_parser("load", help="Simulate the scheduler under increasing arrival rates")
+parser_load.set_defaults(func=load)
 
 # RUN
 parser_run.add_argument(
@@ -105,7 +216,7 @@ parser_run.add_argument(
     nargs="?",
     help="complementarity estimation strategy",
     default="Gradient",
-    choices=["EpsilonGreedy", "Gradient", "GroupGradient"]
+    choices=["EpsilonGreedy", "Gradient", "GroupGradient", "SparseEpsilonGreedy", "SparseGradient"]
 )
 
 parser_run.add_argument(
@@ -144,21 +255,92 @@ parser_run.add_argument(
 )
 
 parser_run.add_argument(
-    "-wl",
-    dest="waiting_limit",
+    "-mr",
+    dest="max_retries",
     type=int,
     nargs="?",
-    help="waiting limit before set job as late job",
-    default=-1
+    help="number of times a failed job is submitted again",
+    default=2
+)
+
+parser_run.add_argument(
+    "-rb",
+    dest="retry_backoff",
+    type=float,
+    nargs="?",
+    help="seconds to wait before the first retry of a failed job, doubled for each further retry",
+    default=30
+)
+
+parser_run.add_argument(
+    "-st",
+    dest="submission_timeout",
+    type=float,
+    nargs="?",
+    help="seconds after which a job which is not running or unknown to the RM is considered failed",
+    default=600
 )
 
 parser_run.add_argument(
-    "-rr",
-    dest="random_rate",
-    type=bool,
+    "--asyncio",
+    action="store_true",
+    help="run the scheduler, the RM polling, the usage updates and the launches on one asyncio event loop "
+         "instead of threads"
+)
+
+parser_run.add_argument(
+    "-sw",
+    dest="submission_workers",
+    type=int,
     nargs="?",
-    help="Decide whether to use random rate",
-    default=False
+    help="number of threads launching the jobs, jobs of different cluster slots are launched concurrently "
+         "with more than one (the application ids predicted for YARN assume launches in scheduling order)",
+    default=1
+)
+
+parser_run.add_argument(
+    "-ss",
+    dest="submission_spacing",
+    type=float,
+    nargs="?",
+    help="seconds between two launches of a submission thread",
+    default=1
+)
+
+parser_run.add_argument(
+    "-ri",
+    dest="reconcile_interval",
+    type=float,
+    nargs="?",
+    help="seconds between two updates of the nodes and of their capacity from the RM (0: never)",
+    default=60
+)
+
+parser_run.add_argument(
+    "-xw",
+    dest="export_workers",
+    type=int,
+    nargs="?",
+    help="number of threads exporting the metrics of the experiment and of its jobs",
+    default=2
+)
+
+parser_run.add_argument(
+    "-xp",
+    dest="export_pending",
+    type=int,
+    nargs="?",
+    help="number of metric files waiting for an export thread before the scheduler waits too",
+    default=64
+)
+
+parser_run.add_argument(
+    "-wl",
+    dest="waiting_limit",
+    type=int,
+    nargs="?",
+    help="waiting limit before set job as late job",
+    default=-1
 )
 
 parser_run.add_argument(
@@ -167,6 +349,144 @@ parser_run.add_argument(
     action='store_true'
 )
 
+# SIMULATE
+parser_simulate.add_argument(
+    "config_yaml",
+    metavar="config.yaml",
+    type=argparse.FileType('r'),
+    nargs="?",
+    help="path to the config.yaml (with SimulatedRM and SimulatedStatCollector)"
+)
+
+parser_simulate.add_argument(
+    "jobs_xml",
+    metavar="jobs.xml",
+    type=argparse.FileType('r'),
+    nargs="?",
+    help="path to the jobs.xml"
+)
+
+parser_simulate.add_argument(
+    "experiment_xml",
+    metavar="exp.xml",
+    type=argparse.FileType('r'),
+    nargs="?",
+    help="path to the experiment.xml"
+)
+
+parser_simulate.add_argument(
+    "-s",
+    dest="scheduler",
+    type=str,
+    nargs="?",
+    help="scheduling strategy",
+    default="RoundRobin",
+    choices=["RoundRobin", "Adaptive", "Random", "GroupAdaptive", "GroupAdaptiveExtend"]
+)
+
+parser_simulate.add_argument(
+    "-e",
+    dest="estimation",
+    type=str,
+    nargs="?",
+    help="complementarity estimation strategy",
+    default="Gradient",
+    choices=["EpsilonGreedy", "Gradient", "GroupGradient", "SparseEpsilonGreedy", "SparseGradient"]
+)
+
+parser_simulate.add_argument(
+    "-ep",
+    dest="estimation_parameters",
+    type=str,
+    nargs="?",
+    help="complementarity estimation parameters folder",
+)
+
+parser_simulate.add_argument(
+    "-eo",
+    dest="estimation_folder",
+    type=str,
+    nargs="?",
+    help="estimation data folder",
+    default="estimation"
+)
+
+parser_simulate.add_argument(
+    "-jtp",
+    dest="jobs_to_peek",
+    type=int,
+    nargs="?",
+    help="number of jobs for scheduler to peek",
+    default=7
+)
+
+parser_simulate.add_argument(
+    "-mr",
+    dest="max_retries",
+    type=int,
+    nargs="?",
+    help="number of times a failed job is submitted again",
+    default=2
+)
+
+parser_simulate.add_argument(
+    "-rb",
+    dest="retry_backoff",
+    type=float,
+    nargs="?",
+    help="seconds to wait before the first retry of a failed job, doubled for each further retry",
+    default=30
+)
+
+parser_simulate.add_argument(
+    "-wl",
+    dest="waiting_limit",
+    type=int,
+    nargs="?",
+    help="waiting limit before set job as late job",
+    default=-1
+)
+
+parser_simulate.add_argument(
+    "--seed",
+    dest="seed",
+    type=int,
+    nargs="?",
+    help="seed of the scheduling decisions"
+)
+
+for p in (parser_run, parser_simulate):
+    p.add_argument(
+        "-rr",
+        dest="arrival_rate",
+        type=float,
+        help="release the jobs into the queue with Poisson arrivals of this many jobs per second (by default with "
+             "the arrival process of the config, or all at the start without one)"
+    )
+
+    p.add_argument(
+        "-tr",
+        dest="trace",
+        help="path of the JSONL decision trace (gzipped if it ends with .gz)"
+    )
+
+    p.add_argument(
+        "-tl",
+        dest="trace_level",
+        choices=sorted(decision_trace.LEVELS.keys()),
+        default="info",
+        help="level of the decision trace"
+    )
+
+    p.add_argument(
+        "-ck",
+        dest="checkpoint_every",
+        type=int,
+        default=10 if p is parser_run else 0,
+        help="checkpoint the estimation in its output folder after every usage update, with a snapshot every "
+             "N updates (0: only save it at the end)"
+    )
+
 # ESTIMATION BENCH
 parser_estimations.add_argument(
     "config_yaml",
@@ -219,6 +539,103 @@ parser_gen.add_argument(
     default="experiment.xml"
 )
 
+# LOAD
+parser_load.add_argument(
+    "config_yaml",
+    metavar="config.yaml",
+    type=argparse.FileType('r'),
+    help="path to the config.yaml of a simulated cluster"
+)
+
+parser_load.add_argument(
+    "jobs_xml",
+    metavar="jobs.xml",
+    type=argparse.FileType('r'),
+    help="path to the jobs.xml"
+)
+
+parser_load.add_argument(
+    "-r",
+    dest="rates",
+    type=float,
+    nargs="+",
+    help="arrival rates to simulate, in jobs per second",
+    default=[0.001, 0.002, 0.005, 0.01, 0.02]
+)
+
+parser_load.add_argument(
+    "-n",
+    dest="n_jobs",
+    type=int,
+    help="number of jobs of each simulation",
+    default=500
+)
+
+parser_load.add_argument(
+    "-s",
+    dest="scheduler",
+    type=str,
+    help="scheduling strategy",
+    default="GroupAdaptiveExtend",
+    choices=["RoundRobin", "Adaptive", "Random", "GroupAdaptive", "GroupAdaptiveExtend"]
+)
+
+parser_load.add_argument(
+    "-e",
+    dest="estimation",
+    type=str,
+    help="complementarity estimation strategy",
+    default="GroupGradient",
+    choices=["EpsilonGreedy", "Gradient", "GroupGradient", "SparseEpsilonGreedy", "SparseGradient"]
+)
+
+parser_load.add_argument(
+    "--seed",
+    type=int,
+    default=0,
+    help="seed of the experiments, the arrivals and the scheduling decisions"
+)
+
+# BENCH
+parser_bench.add_argument(
+    "-o",
+    dest="output",
+    help="path of the json file where the results are saved"
+)
+
+parser_bench.add_argument(
+    "-b",
+    dest="baseline",
+    help="path of the json results to compare with, exits with 1 on regressions"
+)
+
+parser_bench.add_argument(
+    "-t",
+    dest="tolerance",
+    type=float,
+    default=0.25,
+    help="slowdown tolerated before a benchmark is reported as a regression"
+)
+
+parser_bench.add_argument(
+    "-k",
+    dest="pattern",
+    help="run only the benchmarks whose name contains this string"
+)
+
+parser_bench.add_argument(
+    "--quick",
+    action="store_true",
+    help="skip the largest clusters and queues"
+)
+
+parser_bench.add_argument(
+    "--seed",
+    type=int,
+    default=0,
+    help="seed of numpy's random generator"
+)
+
 if len(sys.argv) == 1:
     parser.print_help()
     sys.exit(1)
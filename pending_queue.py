@@ -0,0 +1,215 @@
+import bisect
+import numpy as np
+from typing import Iterable, Iterator, List, Union
+from application import Application, QueuedJob
+
+
+# Queue of the applications waiting to be scheduled.
+# Applications are stored in slots of arrays (group, containers demand, waiting rounds, arrival time)
+# with free slots on both ends, so that appending and prepending is O(1). A Fenwick tree over the
+# occupied slots finds the slot of the i-th application and removes it in O(log n), and each group
+# keeps the sorted list of its slots.
+# The queue also takes QueuedJob entries, which are instantiated once they are accessed, so that only
+# the applications the scheduler has looked at exist.
+class PendingQueue:
+    def __init__(self, applications: List[Application] = None, capacity=64):
+        self._size = 0
+        self._allocate(capacity, capacity // 4)
+        if applications is not None:
+            self.extend(applications)
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, i) -> Application:
+        return self._application(self._slot(i))
+
+    def __iter__(self) -> Iterator[Application]:
+        for slot in np.flatnonzero(self._occupied[self._front:self._back]):
+            yield self._application(self._front + slot)
+
+    def append(self, app: Union[Application, QueuedJob], arrival_time=0.):
+        if self._back == self._capacity:
+            self._compact()
+        self._back += 1
+        self._insert(self._back - 1, app, arrival_time)
+
+    def extend(self, apps: Iterable[Union[Application, QueuedJob]], arrival_time=0.):
+        apps = list(apps)
+        if len(apps) < 64:
+            for app in apps:
+                self.append(app, arrival_time)
+            return
+
+        # many applications, the indexes are rebuilt once
+        for app in apps:
+            if not isinstance(app, QueuedJob):
+                app.arrival_time = arrival_time
+        self._compact(apps, arrival_time)
+
+    def appendleft(self, app: Application):
+        # used to put back an application which could not be scheduled, it keeps its arrival time
+        if self._front == 0:
+            self._compact()
+        self._front -= 1
+        self._insert(self._front, app, app.arrival_time)
+
+    def pop(self, i=0) -> Application:
+        slot = self._slot(i)
+        app = self._application(slot)
+        self._occupied[slot] = False
+        self.applications[slot] = None
+        self._add(slot, -1)
+        bucket = self._buckets[int(self.groups[slot])]
+        del bucket[bisect.bisect_left(bucket, slot)]
+        self._size -= 1
+        return app
+
+    def window(self, k) -> np.ndarray:
+        # slots of the first k applications of the queue
+        k = min(k, self._size)
+        if k == 0:
+            return np.empty(0, dtype=np.int64)
+
+        start = self._select(0)
+        span = 2 * k
+        while True:
+            slots = np.flatnonzero(self._occupied[start:start + span])
+            if len(slots) >= k or start + span >= self._back:
+                return start + slots[:k]
+            span *= 2
+
+    def window_applications(self, k) -> List[Application]:
+        return [self._application(slot) for slot in self.window(k)]
+
+    def window_groups(self, k) -> np.ndarray:
+        return self.groups[self.window(k)]
+
+    def group_positions(self, group, k) -> np.ndarray:
+        # positions of the applications of the group among the first k applications
+        return np.flatnonzero(self.window_groups(k) == group)
+
+    def increment_waiting(self, k) -> np.ndarray:
+        # one more scheduling round waited by the first k applications, returns their waiting rounds
+        slots = self.window(k)
+        self.waiting_rounds[slots] += 1
+        for slot in slots:
+            self._application(slot).waiting_time = int(self.waiting_rounds[slot])
+        return self.waiting_rounds[slots]
+
+    def group_size(self, group) -> int:
+        return len(self._buckets.get(group, []))
+
+    def first_of_group(self, group) -> int:
+        # position of the first application of the group in the queue, -1 if there is none
+        bucket = self._buckets.get(group, [])
+        if len(bucket) == 0:
+            return -1
+        return self._rank(bucket[0])
+
+    def _application(self, slot) -> Application:
+        app = self.applications[slot]
+        if isinstance(app, QueuedJob):
+            app = app.instantiate()
+            app.waiting_time = int(self.waiting_rounds[slot])
+            app.arrival_time = float(self.arrival_times[slot])
+            self.applications[slot] = app
+        return app
+
+    def _insert(self, slot, app: Union[Application, QueuedJob], arrival_time):
+        if not isinstance(app, QueuedJob):
+            app.arrival_time = arrival_time
+        self.applications[slot] = app
+        self.groups[slot] = app.group
+        self.demands[slot] = app.n_containers
+        self.waiting_rounds[slot] = app.waiting_time
+        self.arrival_times[slot] = arrival_time
+        self._occupied[slot] = True
+        self._add(slot, 1)
+        bisect.insort(self._buckets.setdefault(app.group, []), slot)
+        self._size += 1
+
+    def _slot(self, i) -> int:
+        if i < 0:
+            i += self._size
+        if i < 0 or i >= self._size:
+            raise IndexError("queue index out of range")
+        return self._select(i)
+
+    def _allocate(self, capacity, front):
+        self._capacity = capacity
+        self._front = front
+        self._back = front
+        self.applications = np.empty(capacity, dtype=object)
+        self.groups = np.full(capacity, -1, dtype=np.int64)
+        self.demands = np.zeros(capacity, dtype=np.int64)
+        self.waiting_rounds = np.zeros(capacity, dtype=np.int64)
+        self.arrival_times = np.zeros(capacity)
+        self._occupied = np.zeros(capacity, dtype=bool)
+        self._tree = np.zeros(capacity + 1, dtype=np.int64)
+        self._buckets = {}
+
+    def _compact(self, appended=(), arrival_time=0.):
+        # move the applications, followed by the appended ones, to new arrays with free slots on both ends
+        slots = np.flatnonzero(self._occupied)
+        apps, groups, demands = self.applications[slots], self.groups[slots], self.demands[slots]
+        waiting_rounds, arrival_times = self.waiting_rounds[slots], self.arrival_times[slots]
+        if len(appended) > 0:
+            # fromiter keeps the QueuedJob tuples as objects
+            apps = np.concatenate([apps, np.fromiter(appended, object, len(appended))])
+            groups = np.concatenate([groups, np.fromiter((a.group for a in appended), np.int64, len(appended))])
+            demands = np.concatenate(
+                [demands, np.fromiter((a.n_containers for a in appended), np.int64, len(appended))]
+            )
+            waiting_rounds = np.concatenate(
+                [waiting_rounds, np.fromiter((a.waiting_time for a in appended), np.int64, len(appended))]
+            )
+            arrival_times = np.concatenate([arrival_times, np.full(len(appended), arrival_time)])
+            self._size += len(appended)
+        n = len(apps)
+        margin = n // 2 + 16
+        self._allocate(n + 2 * margin, margin)
+        occupied = slice(margin, margin + n)
+        self.applications[occupied] = apps
+        self.groups[occupied] = groups
+        self.demands[occupied] = demands
+        self.waiting_rounds[occupied] = waiting_rounds
+        self.arrival_times[occupied] = arrival_times
+        self._occupied[occupied] = True
+        self._back = margin + n
+
+        # Fenwick tree: node i holds the number of occupied slots in (i - lowbit(i), i]
+        index = np.arange(1, self._capacity + 1)
+        prefix = np.concatenate([[0], np.cumsum(self._occupied)])
+        self._tree[1:] = prefix[index] - prefix[index - (index & -index)]
+
+        for group in np.unique(groups):
+            self._buckets[int(group)] = (margin + np.flatnonzero(groups == group)).tolist()
+
+    def _add(self, slot, delta):
+        i = slot + 1
+        while i <= self._capacity:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _rank(self, slot) -> int:
+        # number of applications before the slot
+        rank = 0
+        i = slot
+        while i > 0:
+            rank += self._tree[i]
+            i -= i & -i
+        return int(rank)
+
+    def _select(self, rank) -> int:
+        # slot of the application with the given rank
+        position = 0
+        remaining = rank + 1
+        step = 1 << (self._capacity.bit_length() - 1)
+        while step > 0:
+            following = position + step
+            if following <= self._capacity and self._tree[following] < remaining:
+                position = following
+                remaining -= self._tree[following]
+            step >>= 1
+        return position
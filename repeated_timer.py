@@ -3,7 +3,5 @@ from threading import Timer
 
 class RepeatedTimer(Timer):
     def run(self):
-        self.finished.wait(self.interval)
-        if not self.finished.is_set():
+        while not self.finished.wait(self.interval):
             self.function(*self.args, **self.kwargs)
-            self.run()
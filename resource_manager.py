@@ -1,10 +1,35 @@
 from abc import ABCMeta, abstractmethod
-from yarn_api_client import ResourceManager as YarnResourceManager
-from typing import Dict
-from threading import Lock
+from job_group_data import JobGroupData
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Optional
+from threading import Lock, Thread
+from clock import WallClock
+import numpy as np
+import random
+import requests
+import time
+
+
+RUNNING = "RUNNING"
+FINISHED = "FINISHED"
+FAILED = "FAILED"
+KILLED = "KILLED"
+
+
+# State of a node reported by the RM: its vcores and memory (MB) and the ones allocated to any application
+class NodeReport:
+    def __init__(self, capacity, used=0, memory=None, used_memory=0, healthy=True):
+        self.capacity = capacity
+        self.used = used
+        self.memory = memory
+        self.used_memory = used_memory
+        self.healthy = healthy
 
 
 class ResourceManager(metaclass=ABCMeta):
+    # clock driving the polling of the applications, a WallClock if it is not set
+    clock = None
+
     @abstractmethod
     # [(node_name, n_containers)]
     def nodes(self) -> Dict[str, int]:
@@ -22,17 +47,124 @@ class ResourceManager(metaclass=ABCMeta):
     def is_application_finished(self, application_id: str) -> bool:
         pass
 
+    # asks the RM to kill an application, which may still be started after it was given up
+    def kill_application(self, application_id: str):
+        pass
+
+    # nodes of the cluster, None if the RM could not be reached
+    def node_reports(self) -> Optional[Dict[str, NodeReport]]:
+        return {address: NodeReport(n_containers) for address, n_containers in self.nodes().items()}
+
+    def run_application(self, application, on_finish=None, sleep_during_loop=5):
+        application.thread = Thread(target=application._run, args=[self, on_finish, sleep_during_loop])
+        application.thread.start()
+
+    # YARN state of the application, None if it is unknown to the RM
+    def application_state(self, application_id: str) -> Optional[str]:
+        if self.is_application_finished(application_id):
+            return FINISHED
+        if self.is_application_running(application_id):
+            return RUNNING
+        return "ACCEPTED"
+
+    # states of the applications known to the RM, None if the RM could not be reached
+    def application_states(self, application_ids: List[str], started_after=None) -> Optional[Dict[str, str]]:
+        states = {}
+        for application_id in application_ids:
+            state = self.application_state(application_id)
+            if state is not None:
+                states[application_id] = state
+        return states
+
+
+class ApplicationPoller:
+    def __init__(self, resource_manager: ResourceManager, interval=5):
+        self.resource_manager = resource_manager
+        self.interval = interval
+        # application id -> (application, on_finish, submission time in ms)
+        self.applications = {}
+        self.lock = Lock()
+        self._timer = None
+        self._polling = False
+
+    @property
+    def clock(self):
+        return WallClock() if self.resource_manager.clock is None else self.resource_manager.clock
+
+    def track(self, application, on_finish=None):
+        with self.lock:
+            self.applications[application.id] = (application, on_finish, int(self.clock.time() * 1000))
+            if self._timer is None:
+                self._timer = self.clock.timer(self.interval, self.poll, daemon=True)
+                self._timer.start()
+
+    def stop(self):
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def poll(self):
+        with self.lock:
+            # skip the tick if the previous request is still running (with an AsyncioClock)
+            if self._polling or len(self.applications) == 0:
+                return
+            self._polling = True
+            tracked = dict(self.applications)
+
+        self.clock.run_blocking(
+            lambda states: self._on_states(tracked, states),
+            self.resource_manager.application_states,
+            list(tracked.keys()),
+            min(submitted_at for _, _, submitted_at in tracked.values())
+        )
+
+    def _on_states(self, tracked, states):
+        with self.lock:
+            self._polling = False
+        if states is None:
+            # the RM could not be reached, try again on the next tick
+            return
+
+        now = self.clock.time()
+        for application_id, (application, on_finish, _) in tracked.items():
+            if application._observe(states.get(application_id), now):
+                with self.lock:
+                    if application_id not in self.applications:
+                        continue
+                    del self.applications[application_id]
+                if application.is_lost():
+                    # killed before its containers are given to other applications, off the event loop of an
+                    # AsyncioClock
+                    self.clock.run_blocking(
+                        lambda _, app=application, callback=on_finish: self._complete(app, callback),
+                        self.resource_manager.kill_application,
+                        application_id
+                    )
+                else:
+                    self._complete(application, on_finish)
+
+    @staticmethod
+    def _complete(application, on_finish):
+        # an error in a callback must not stop the polling of the other applications
+        try:
+            application._complete(on_finish)
+        except Exception as e:
+            print(e)
+
 
 class DummyRM(ResourceManager):
     def __init__(self, n_nodes=4, n_containers=8, node_pattern="N{}", app_pattern="A{}", apps_running=None,
-                 apps_submitted=0, apps_finished=None):
+                 apps_submitted=0, apps_finished=None, apps_failed=None):
         self.n_nodes = n_nodes
         self.n_containers = n_containers
         self.node_pattern = node_pattern
         self.app_pattern = app_pattern
         self.apps_running = {} if apps_running is None else apps_running
         self.apps_finished = {} if apps_finished is None else apps_finished
+        self.apps_failed = {} if apps_failed is None else apps_failed
         self.apps_submitted = apps_submitted
+        self.apps_killed = []
 
     def nodes(self):
         nodes = {}
@@ -50,48 +182,347 @@ class DummyRM(ResourceManager):
     def is_application_finished(self, application_id: str):
         return self.apps_finished.get(application_id, False)
 
+    def kill_application(self, application_id: str):
+        self.apps_killed.append(application_id)
+
+    def application_state(self, application_id):
+        if self.apps_failed.get(application_id, False):
+            return FAILED
+        return super().application_state(application_id)
+
+
+class SimulatedRM(ResourceManager):
+    def __init__(self, nodes=None, n_containers=8, app_pattern="application_0_{:04}", durations=None,
+                 default_duration=(600., 60.), startup_time=35., failure_rate=0., seed=None):
+        # by default, simulate the cluster the group schedulers are configured for
+        self.addresses = list(JobGroupData.cluster_slots_index.keys()) if nodes is None else nodes
+        self.n_containers = n_containers
+        self.app_pattern = app_pattern
+        # job name -> (mean, standard deviation) of the run time in seconds
+        self.durations = {} if durations is None else durations
+        self.default_duration = default_duration
+        self.startup_time = startup_time
+        # probability for an application to fail instead of finishing
+        self.failure_rate = failure_rate
+        self.random = np.random.RandomState(seed)
+        self.clock = None
+        self.apps_submitted = 0
+        self.apps_running = {}
+        self.apps_finished = {}
+        self.apps_failed = {}
+
+    def nodes(self):
+        return {address: self.n_containers for address in self.addresses}
+
+    def next_application_id(self):
+        self.apps_submitted += 1
+        return self.app_pattern.format(self.apps_submitted)
+
+    def is_application_running(self, application_id):
+        return self.apps_running.get(application_id, False)
+
+    def is_application_finished(self, application_id):
+        return self.apps_finished.get(application_id, False)
+
+    def duration(self, name) -> float:
+        mean, std = self.durations.get(name, self.default_duration)
+        return max(1., self.random.normal(mean, std))
+
+    def run_application(self, application, on_finish=None, sleep_during_loop=5):
+        if self.clock is None:
+            raise ValueError("SimulatedRM needs a clock to run applications")
+
+        application.start_at = self.clock.utcnow()
+        self.clock.call_later(self.startup_time, self._on_running, application)
+        self.clock.call_later(self.startup_time + self.duration(application.name),
+                              self._on_finished, application, on_finish)
+
+    def _on_running(self, application):
+        self.apps_running[application.id] = True
+        application.is_running = True
+
+    def application_state(self, application_id):
+        if self.apps_failed.get(application_id, False):
+            return FAILED
+        return super().application_state(application_id)
+
+    def _on_finished(self, application, on_finish):
+        self.apps_running[application.id] = False
+        application.end_at = self.clock.utcnow()
+        if self.random.uniform() < self.failure_rate:
+            self.apps_failed[application.id] = True
+            application.failure = FAILED
+            print("Application {} has failed: {}".format(application, application.failure))
+        else:
+            self.apps_finished[application.id] = True
+            print("Application {} has finished".format(application))
+
+        if callable(on_finish):
+            on_finish(application)
+
 
-class Yarn(YarnResourceManager, ResourceManager):
-    def __init__(self, address, port=8088, timeout=30):
-        super().__init__(address=address, port=port, timeout=timeout)
-        self.cluster_started_on = self.cluster_information().data['clusterInfo']['startedOn']
-        self.__next_app_id = self.cluster_metrics().data['clusterMetrics']['appsSubmitted']
+class YarnError(Exception):
+    pass
+
+
+class CircuitOpenError(YarnError):
+    pass
+
+
+# Retries allowed to the calls of a client: each call deposits ratio of a retry, each retry withdraws one,
+# so that a failing RM gets at most about ratio retries per call instead of retries per call.
+class RetryBudget:
+    def __init__(self, ratio=0.2, initial=10, maximum=10):
+        self.ratio = ratio
+        self.maximum = maximum
+        self.tokens = initial
         self.lock = Lock()
 
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.maximum, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+# Stops the calls to an unreachable RM: after failure_threshold calls failing in a row, every call fails
+# immediately for reset_timeout seconds, then one call is let through and closes the circuit if it succeeds.
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self.lock = Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def on_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def on_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+# Client of the YARN RM REST API keeping its connections alive in a pool. A call fails after deadline
+# seconds, each request after timeout seconds; failed requests (connection errors, timeouts, 5xx) are retried
+# with a jittered exponential backoff while the retry budget and the deadline allow it.
+class YarnClient:
+    def __init__(self, address, port=8088, timeout=5., deadline=30., max_retries=3, backoff=0.5, max_backoff=5.,
+                 pool_size=4, retry_budget: RetryBudget = None, circuit_breaker: CircuitBreaker = None):
+        self.url = "http://{}:{}/ws/v1/cluster".format(address, port)
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_budget = RetryBudget() if retry_budget is None else retry_budget
+        self.circuit_breaker = CircuitBreaker() if circuit_breaker is None else circuit_breaker
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def get(self, path="", **params) -> dict:
+        return self.request("GET", path, params=params)
+
+    def post(self, path, body=None) -> dict:
+        return self.request("POST", path, body=body)
+
+    def put(self, path, body=None) -> dict:
+        return self.request("PUT", path, body=body)
+
+    def request(self, method, path, body=None, params=None) -> dict:
+        if not self.circuit_breaker.allow():
+            raise CircuitOpenError("the RM at {} is not reachable".format(self.url))
+
+        deadline = time.monotonic() + self.deadline
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, self.url + path, params=params, json=body,
+                                                timeout=max(0.001, min(self.timeout, deadline - time.monotonic())))
+                if response.status_code < 500:
+                    self.circuit_breaker.on_success()
+                    if response.status_code >= 400:
+                        raise YarnError("{} {}".format(response.status_code, response.text[:200]))
+                    return response.json() if len(response.content) > 0 else {}
+                error = YarnError("{} {}".format(response.status_code, response.text[:200]))
+            except requests.RequestException as e:
+                error = YarnError(str(e))
+
+            # full jitter
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            attempt += 1
+            if attempt > self.max_retries or time.monotonic() + delay >= deadline or not self.retry_budget.withdraw():
+                self.circuit_breaker.on_failure()
+                raise error
+            time.sleep(delay)
+
+    def cluster_information(self):
+        return self.get("/info")
+
+    def cluster_metrics(self):
+        return self.get("/metrics")
+
+    def cluster_nodes(self):
+        return self.get("/nodes")
+
+    def cluster_applications(self, started_time_begin=None):
+        return self.get("/apps", **({} if started_time_begin is None else {"startedTimeBegin": started_time_begin}))
+
+    def cluster_application(self, application_id):
+        return self.get("/apps/{}".format(application_id))
+
+    def new_application(self):
+        return self.post("/apps/new-application")
+
+    def submit_application(self, context):
+        return self.post("/apps", context)
+
+    def kill_application(self, application_id):
+        return self.put("/apps/{}/state".format(application_id), {"state": KILLED})
+
+    def close(self):
+        self.session.close()
+
+
+# spark: submits the applications which have a yarn_submission (SparkApplication) with the REST API of the RM
+# instead of their command line, with the real id of the application. Their command line is still used when
+# the submission fails or when their jar is not staged. The resources are on a file system of the cluster
+# (resource: URL, size in bytes and modification timestamp in ms, as the RM checks them):
+#   archive: the jars of Spark (spark.yarn.archive), conf: an archive of __spark_conf__.properties,
+#   jars: application jar path -> its staged copy,
+#   and optionally am_memory (MB), queue, staging_dir and properties (Spark configuration).
+class Yarn(ResourceManager):
+    def __init__(self, address, port=8088, timeout=30, poll_interval=5, request_timeout=5., max_retries=3,
+                 backoff=0.5, failure_threshold=5, reset_timeout=30., spark=None):
+        # timeout: seconds a call may take with its retries, request_timeout: seconds of each request
+        self.spark = spark
+        self.client = YarnClient(address, port, timeout=request_timeout, deadline=timeout, max_retries=max_retries,
+                                 backoff=backoff, circuit_breaker=CircuitBreaker(failure_threshold, reset_timeout))
+        self.cluster_started_on = self.client.cluster_information()['clusterInfo']['startedOn']
+        self.__next_app_id = self.client.cluster_metrics()['clusterMetrics']['appsSubmitted']
+        # the ids are predicted by several submission threads (-sw) and by the REST submissions
+        self.__next_app_id_lock = Lock()
+        self.poller = ApplicationPoller(self, interval=poll_interval)
+
+    def run_application(self, application, on_finish=None, sleep_during_loop=5):
+        if self.spark is None or not hasattr(application, 'yarn_submission') or not application.is_staged(self.spark):
+            self._on_submitted(application, on_finish, False)
+            return
+        # the requests of the submission and their retries are made off the event loop of an AsyncioClock
+        self.poller.clock.run_blocking(
+            lambda submitted: self._on_submitted(application, on_finish, submitted), self._submit, application
+        )
+
+    def _on_submitted(self, application, on_finish, submitted):
+        # submitted is None if the submission raised
+        if not submitted:
+            application._submit()
+        self.poller.track(application, on_finish)
+
+    def _submit(self, application) -> bool:
+        # submits the application with the REST API, False if its command line has to be used
+        application_id = None
+        try:
+            application_id = self.client.new_application()['application-id']
+            self.client.submit_application(application.yarn_submission(application_id, self.spark))
+        except YarnError as e:
+            print("Could not submit {} with the REST API ({}), using its command line".format(application, e))
+            if application_id is not None:
+                # the id predicted for the command line follows the one given to the failed submission
+                application.id = self.next_application_id()
+            return False
+
+        print("Submitted {} as {}".format(application, application_id))
+        application.id = application_id
+        application._on_submitted()
+        return True
+
+    def application_states(self, application_ids, started_after=None):
+        try:
+            # a minute of margin as the submission time is taken before spark-submit reaches the RM
+            apps = self.client.cluster_applications(
+                started_time_begin=None if started_after is None else started_after - 60000
+            )['apps']
+        except YarnError as e:
+            print(e)
+            return None
+
+        wanted = set(application_ids)
+        states = {}
+        for app in ([] if apps is None else apps['app']):
+            if app['id'] in wanted:
+                states[app['id']] = app['state']
+        return states
+
     def nodes(self):
         nodes = {}
 
-        for node in self.cluster_nodes().data['nodes']['node']:
+        for node in self.client.cluster_nodes()['nodes']['node']:
             nodes[node['nodeHostName']] = node['availableVirtualCores']
 
         return nodes
 
-    def next_application_id(self):
-        self.__next_app_id += 1
-        return "application_{}_{:04}".format(self.cluster_started_on, self.__next_app_id)
-
-    def is_application_running(self, application_id):
-        self.lock.acquire()
+    def node_reports(self):
         try:
-            output = self.cluster_application(application_id).data['app']['state'] == "RUNNING"
-        except BaseException as e:
+            nodes = self.client.cluster_nodes()['nodes']
+        except YarnError as e:
             print(e)
-            output = False
+            return None
 
-        self.lock.release()
-        return output
+        reports = {}
+        for node in ([] if nodes is None else nodes['node']):
+            reports[node['nodeHostName']] = NodeReport(
+                node.get('usedVirtualCores', 0) + node.get('availableVirtualCores', 0),
+                node.get('usedVirtualCores', 0),
+                node.get('usedMemoryMB', 0) + node.get('availMemoryMB', 0),
+                node.get('usedMemoryMB', 0),
+                node.get('state') == RUNNING
+            )
+        return reports
 
-    def is_application_finished(self, application_id):
-        self.lock.acquire()
+    def next_application_id(self):
+        with self.__next_app_id_lock:
+            self.__next_app_id += 1
+            next_app_id = self.__next_app_id
+        return "application_{}_{:04}".format(self.cluster_started_on, next_app_id)
 
+    def kill_application(self, application_id):
         try:
-            app_data = self.cluster_application(application_id).data
-            output = app_data['app']['state'] == "FINISHED"
-            #print("Check status of application with ID =  {} : {}".format(application_id, app_data['app']['state']))
+            self.client.kill_application(application_id)
+        except YarnError as e:
+            print("Could not kill {}: {}".format(application_id, e))
 
-        except BaseException as e:
+    def application_state(self, application_id):
+        try:
+            return self.client.cluster_application(application_id)['app']['state']
+        except YarnError as e:
             print(e)
-            output = False
+            return None
 
-        self.lock.release()
-        return output
+    def is_application_running(self, application_id):
+        return self.application_state(application_id) == RUNNING
+
+    def is_application_finished(self, application_id):
+        return self.application_state(application_id) == FINISHED
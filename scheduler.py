@@ -1,13 +1,16 @@
-import subprocess
 from abc import ABCMeta, abstractmethod
-from sklearn.cross_validation import LeaveOneOut
 from cluster import Cluster, Node
+from clock import WallClock
+from arrival import ArrivalProcess
 from application import Application
 from complementarity import ComplementarityEstimation
+from pending_queue import PendingQueue
+from submission import SubmissionPool, ThreadSubmissionPool
 from job_group_data import JobGroupData
-from repeated_timer import RepeatedTimer
+import decision_trace
 from threading import Lock
-from typing import List
+from typing import Iterable, List
+import itertools
 import time
 import numpy as np
 
@@ -19,48 +22,163 @@ class NoApplicationCanBeScheduled(BaseException):
 class Scheduler(metaclass=ABCMeta):
 
     jobs_to_peek_arg = 7
-    activate_random_arrival = False
     waiting_limit = -1
-
-    def __init__(self, estimation: ComplementarityEstimation, cluster: Cluster, update_interval=60):
-        self.queue = []
+    export_data = True
+    # failed applications are scheduled again after retry_backoff * retry_backoff_factor ** (attempts - 1) seconds
+    max_retries = 2
+    retry_backoff = 30
+    retry_backoff_factor = 2
+    # applications are launched by submission workers, submission_spacing seconds apart in a cluster slot
+    submission_workers = 1
+    submission_spacing = 1
+    # seconds between two reconciliations of the cluster with the nodes reported by the RM, 0 to never reconcile
+    reconcile_interval = 0
+    # jobs of a stream kept in the queue, it is refilled once it is down to half of them
+    queue_size = 10000
+
+    def __init__(self, estimation: ComplementarityEstimation, cluster: Cluster, update_interval=60, clock=None,
+                 submissions: SubmissionPool = None, arrivals: ArrivalProcess = None):
+        self.queue = PendingQueue()
         self.estimation = estimation
         self.cluster = cluster
-        self._timer = RepeatedTimer(update_interval, self.update_estimation)
+        self.clock = WallClock() if clock is None else clock
+        self._timer = self.clock.timer(update_interval, self._on_usage_tick)
+        self._reconcile_timer = None
+        if self.reconcile_interval > 0:
+            self._reconcile_timer = self.clock.timer(self.reconcile_interval, self._on_reconcile_tick)
+        if submissions is None:
+            submissions = ThreadSubmissionPool(self.submission_workers, self.submission_spacing, self.clock)
+        self.submissions = submissions
+        self.submissions.on_launched = self._on_app_launched
+        self.submissions.on_failed = self._on_launch_failed
         self.scheduler_lock = Lock()
         self.started_at = None
         self.stopped_at = None
         self.print_estimation = False
+        # checkpoints the estimation after every update when set
+        self.estimation_store = None
         self.waiting_time = {}
         self.scheduled_apps_num = 0
         self.jobs_to_peek = self.jobs_to_peek_arg
-        self.random_arrival_rate = [0, 0, 0, 0, 0, 1, 2, 0, 0, 0, 1, 0, 2, 0, 2,
-                                    1, 0, 2, 2, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0]
+        self.pending_retries = 0
+        self.failed_apps = []
+        # jobs added to the queue, and the jobs of a streamed experiment not in the queue yet
+        self.n_queued = 0
+        self._stream = None
+        self._stream_arrival = None
+        # with an arrival process, the jobs added are released into the queue one by one at its arrivals
+        self.arrivals = arrivals
+        self._arriving = None
+        self._arrivals_start = None
+        # seconds waited in the queue by the scheduled jobs, and longest queue
+        self.total_queue_delay = 0.
+        self.max_queue_length = 0
 
     def start(self):
+        if self.arrivals is not None:
+            self._arrivals_start = self.clock.time()
+            self._plan_arrival(0.)
         self.schedule()
         self._timer.start()
-        self.started_at = time.time() - 3600
+        if self._reconcile_timer is not None:
+            self._reconcile_timer.start()
+        self.started_at = self.clock.time() - 3600
 
     def stop(self):
         self._timer.cancel()
-        self.stopped_at = time.time() - 3600
+        if self._reconcile_timer is not None:
+            self._reconcile_timer.cancel()
+        self.submissions.stop()
+        self.clock.stop()
+        self.stopped_at = self.clock.time() - 3600
+
+    def _on_usage_tick(self):
+        # the stat collector is queried off the event loop of an AsyncioClock
+        self.clock.run_blocking(self._on_usage, self.cluster.stat_collector.mean_usage, dict(self.cluster.nodes))
+
+    def _on_reconcile_tick(self):
+        # the RM is queried off the event loop of an AsyncioClock
+        self.clock.run_blocking(self._on_node_reports, self.cluster.resource_manager.node_reports)
+
+    def _on_node_reports(self, reports):
+        if reports is None:
+            return
+        with self.scheduler_lock:
+            self.cluster.reconcile(reports)
+            # containers may have been freed
+            self.schedule()
+
+    def _on_usage(self, mean_usage):
+        if mean_usage is not None:
+            self.update_estimation(self.cluster.apps_rates(mean_usage))
 
-    def update_estimation(self):
-        for (apps, usage) in self.cluster.apps_usage():
-            if len(apps) > 0 and usage.is_not_idle():
-                for rest, out in LeaveOneOut(len(apps)):
-                    self.estimation.update_app(apps[out[0]], [apps[i] for i in rest], usage.rate())
+    def update_estimation(self, apps_rates=None):
+        if apps_rates is None:
+            apps_rates = self.cluster.apps_rates()
+        batch = self.estimation.leave_one_out(apps_rates)
+        if self.estimation_store is not None:
+            self.estimation_store.update(*batch)
+        else:
+            self.estimation.update_batch(*batch)
         if self.print_estimation:
             self.estimation.print()
 
     def add(self, app: Application):
-        self.queue.append(app)
+        if self.arrivals is not None:
+            self.add_stream([app])
+            return
+        self.queue.append(app, self.clock.time())
+        self.n_queued += 1
 
     def add_all(self, apps: List[Application]):
-        self.queue.extend(apps)
+        if self.arrivals is not None:
+            self.add_stream(apps)
+            return
+        self.queue.extend(apps, self.clock.time())
+        self.n_queued += len(apps)
+
+    def add_stream(self, jobs: Iterable[Application]):
+        # the jobs are read when the queue needs them, only the first queue_size ones are in the queue
+        self._stream = iter(jobs) if self._stream is None else itertools.chain(self._stream, jobs)
+        self._stream_arrival = self.clock.time()
+        if self.arrivals is not None and self._arrivals_start is not None and self._arriving is None:
+            # the previous jobs have all arrived
+            self._plan_arrival(self.clock.time() - self._arrivals_start)
+        self._fill_queue()
+
+    def _plan_arrival(self, t):
+        # the next job of the stream arrives at the arrival of the process following t
+        self._arriving = next(self._stream, None) if self._stream is not None else None
+        if self._arriving is None:
+            self._stream = None
+            return
+        t = self.arrivals.next_arrival(t)
+        self.clock.call_later(max(0., self._arrivals_start + t - self.clock.time()), self._on_arrival, t)
+
+    def _on_arrival(self, t):
+        with self.scheduler_lock:
+            app = self._arriving
+            self.queue.append(app, self.clock.time())
+            self.n_queued += 1
+            self.max_queue_length = max(self.max_queue_length, len(self.queue))
+            decision_trace.info("scheduler.arrival", name=app.name, queue=len(self.queue))
+            self._plan_arrival(t)
+            self.schedule()
+
+    def _fill_queue(self):
+        # the queue always holds more jobs than the scheduler peeks at, unless the stream is over
+        if self.arrivals is not None or self._stream is None \
+                or len(self.queue) > max(self.queue_size // 2, self.jobs_to_peek):
+            return
+        n = max(self.queue_size, 2 * self.jobs_to_peek) - len(self.queue)
+        jobs = list(itertools.islice(self._stream, n))
+        if len(jobs) < n:
+            self._stream = None
+        self.queue.extend(jobs, self._stream_arrival)
+        self.n_queued += len(jobs)
 
     def schedule(self):
+        self._fill_queue()
         while len(self.queue) > 0:
             try:
                 app = self.schedule_application()
@@ -71,166 +189,106 @@ class Scheduler(metaclass=ABCMeta):
                 else:
                     self.waiting_time[app.waiting_time] = 1
             except NoApplicationCanBeScheduled:
-                print("No Application can be scheduled right now")
+                decision_trace.info(
+                    "scheduler.blocked",
+                    queue=len(self.queue),
+                    available_containers=self.cluster.available_containers()
+                )
                 break
-            app.start(self.cluster.resource_manager, self._on_app_finished)
-            if self.jobs_to_peek < len(self.queue) and self.activate_random_arrival:
-                print("Update random arrival rate")
-                self.jobs_to_peek = self.jobs_to_peek + self.random_arrival_rate[self.scheduled_apps_num]
-            print("Scheduler round: {}".format(self.scheduled_apps_num))
-            print("Jobs_to_peek = {}".format(self.jobs_to_peek))
+            self.submissions.submit(app, self._launch)
+            self.total_queue_delay += self.clock.time() - app.arrival_time
+            decision_trace.info(
+                "scheduler.round",
+                round=self.scheduled_apps_num,
+                name=app.name,
+                waiting_time=app.waiting_time,
+                jobs_to_peek=self.jobs_to_peek
+            )
             self.scheduled_apps_num = self.scheduled_apps_num + 1
-            time.sleep(1) # add a slight delay so jobs could be submitted to yarn in order
-        self.cluster.print_nodes()
+            self._fill_queue()
+        if decision_trace.enabled(decision_trace.DEBUG):
+            decision_trace.debug("cluster.nodes", nodes=self.cluster.node_applications())
 
     def schedule_application(self) -> Application:
         if self.cluster.available_containers()==0:
             raise NoApplicationCanBeScheduled
         app = self.get_application_to_schedule()
         if app.n_containers > self.cluster.available_containers():
-            self.queue = [app] + self.queue
+            self.queue.appendleft(app)
             raise NoApplicationCanBeScheduled
 
         self.place_containers(app)
 
         return app
 
+    def _launch(self, app: Application):
+        app.start(self.cluster.resource_manager, self._on_app_finished)
+
+    def _on_app_launched(self, app: Application):
+        decision_trace.info("scheduler.launched", app=app.id, name=app.name, attempts=app.attempts)
+
+    def _on_launch_failed(self, app: Application, error):
+        # handled like an application which failed on the cluster, it is retried after a backoff
+        print("Could not launch {}: {}".format(app, error))
+        app.failure = "NOT_LAUNCHED"
+        self._on_app_finished(app)
+
     def _on_app_finished(self, app: Application):
-        self.scheduler_lock.acquire()
-        self.cluster.remove_applications(app)
-        if len(self.queue) == 0 and self.cluster.has_application_scheduled() == 0:
-            self.stop()
-            self.on_stop()
-        else:
+        with self.scheduler_lock:
+            self.cluster.remove_applications(app)
+            if app.failure is not None:
+                self._retry(app)
+            self._fill_queue()
+            if len(self.queue) == 0 and self._stream is None and self.cluster.has_application_scheduled() == 0 \
+                    and self.pending_retries == 0:
+                self.stop()
+                self.on_stop()
+            else:
+                self.schedule()
+
+    def _retry(self, app: Application):
+        if app.attempts > self.max_retries:
+            print("Application {} failed {} times, giving up".format(app, app.attempts))
+            self.failed_apps.append(app)
+            return
+
+        delay = self.retry_backoff * self.retry_backoff_factor ** (app.attempts - 1)
+        print("Application {} failed ({}), retrying in {}s".format(app, app.failure, delay))
+        self.pending_retries += 1
+        self.clock.call_later(delay, self._on_retry, app)
+
+    def _on_retry(self, app: Application):
+        with self.scheduler_lock:
+            self.pending_retries -= 1
+            app.reset()
+            self.queue.appendleft(app)
             self.schedule()
-        self.scheduler_lock.release()
 
     def on_stop(self):
         delta = self.stopped_at - self.started_at
         print("Queue took {:.0f}'{:.0f} to complete".format(delta // 60, delta % 60))
+        if self.estimation_store is not None:
+            self.estimation_store.close()
         self.estimation.save(self.estimation.output_folder)
-        self.export_experiment_data()
+        if self.export_data and Application.exporter is not None:
+            self.export_experiment_data()
         print("\n\n\n((((((((((  Waiting times  ))))))))))")
         for (key, value) in self.waiting_time.items():
             print("{} rounds waiting - {}".format(key,value))
         print(str(self.waiting_time))
+        if len(self.failed_apps) > 0:
+            print("Failed applications: {}".format(",".join(map(str, self.failed_apps))))
 
     def export_experiment_data(self):
         print("\n\n\n=======Generate experiment output=======\n\n\n")
-        host_list = "|".join([address for address in self.cluster.nodes.keys()])
-
-        cmd_query_cpu = "\ninflux -precision rfc3339 -username root -password root" \
-                        " -database 'telegraf' -host 'localhost' -execute 'SELECT usage_user,usage_iowait " \
-                        "FROM \"telegraf\".\"autogen\".\"cpu\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                        "AND cpu = '\\''cpu-total'\\'' GROUP BY host' -format 'csv' > /data/vinh.tran/new/expData/{}/cpu_{}.csv" \
-            .format(time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.started_at)),
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.stopped_at)),
-                    host_list,
-                    Application.experiment_name,
-                    Application.experiment_name)
-        print(cmd_query_cpu)
-        # subprocess.Popen(cmd_query_cpu, shell=True)
-
-        cmd_query_cpu_mean = "\ninflux -precision rfc3339 -username root -password root" \
-                             " -database 'telegraf' -host 'localhost' -execute 'SELECT mean(usage_user) as \"mean_cpu_percent\",mean(usage_iowait) as \"mean_io_wait\" " \
-                             "FROM \"telegraf\".\"autogen\".\"cpu\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                             "AND cpu = '\\''cpu-total'\\'' GROUP BY time(10s)' -format 'csv' > /data/vinh.tran/new/expData/{}/cpu_{}_mean.csv" \
-            .format(time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.started_at)),
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.stopped_at)),
-                    host_list,
-                    Application.experiment_name,
-                    Application.experiment_name)
-        print(cmd_query_cpu_mean)
-
-        cmd_query_mem = "\ninflux -precision rfc3339 -username root -password root " \
-                        "-database 'telegraf' -host 'localhost' -execute 'SELECT used_percent " \
-                        "FROM \"telegraf\".\"autogen\".\"mem\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                        "GROUP BY host' -format 'csv' > /data/vinh.tran/new/expData/{}/mem_{}.csv" \
-            .format(time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.started_at)),
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.stopped_at)),
-                    host_list,
-                    Application.experiment_name,
-                    Application.experiment_name)
-        print(cmd_query_mem)
-
-        cmd_query_mem_mean = "\ninflux -precision rfc3339 -username root -password root " \
-                             "-database 'telegraf' -host 'localhost' -execute 'SELECT mean(used_percent) " \
-                             "FROM \"telegraf\".\"autogen\".\"mem\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                             "GROUP BY time(10s)' -format 'csv' > /data/vinh.tran/new/expData/{}/mem_{}_mean.csv" \
-            .format(time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.started_at)),
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.stopped_at)),
-                    host_list,
-                    Application.experiment_name,
-                    Application.experiment_name)
-        print(cmd_query_mem_mean)
-
-        cmd_query_disk = "\ninflux -precision rfc3339 -username root -password root " \
-                         "-database 'telegraf' -host 'localhost' -execute 'SELECT sum(read_bytes),sum(write_bytes) " \
-                         "FROM (SELECT derivative(last(\"read_bytes\"),1s) as \"read_bytes\",derivative(last(\"write_bytes\"),1s) as \"write_bytes\",derivative(last(\"io_time\"),1s) as \"io_time\" " \
-                         "FROM \"telegraf\".\"autogen\".\"diskio\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                         "GROUP BY \"host\",\"name\",time(10s)) WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' GROUP BY host,time(10s)' -format 'csv' > /data/vinh.tran/new/expData/{}/disk_{}.csv" \
-            .format(time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.started_at)),
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.stopped_at)),
-                    host_list,
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.started_at)),
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.stopped_at)),
-                    Application.experiment_name,
-                    Application.experiment_name)
-        print(cmd_query_disk)
-
-        cmd_query_disk_mean = "\ninflux -precision rfc3339 -username root -password root " \
-                              "-database 'telegraf' -host 'localhost' -execute 'SELECT sum(read_bytes),sum(write_bytes) " \
-                              "FROM (SELECT derivative(last(\"read_bytes\"),1s) as \"read_bytes\",derivative(last(\"write_bytes\"),1s) as \"write_bytes\",derivative(last(\"io_time\"),1s) as \"io_time\" " \
-                              "FROM \"telegraf\".\"autogen\".\"diskio\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                              "GROUP BY \"host\",\"name\",time(10s)) WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' GROUP BY time(10s)' -format 'csv' > /data/vinh.tran/new/expData/{}/disk_{}_mean.csv" \
-            .format(time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.started_at)),
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.stopped_at)),
-                    host_list,
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.started_at)),
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.stopped_at)),
-                    Application.experiment_name,
-                    Application.experiment_name)
-        print(cmd_query_disk_mean)
-
-        cmd_query_net = "\ninflux -precision rfc3339 -username root -password root " \
-                        "-database 'telegraf' -host 'localhost' -execute 'SELECT sum(download_bytes),sum(upload_bytes) FROM (SELECT  derivative(first(\"bytes_recv\"),1s) " \
-                        "as \"download_bytes\",derivative(first(\"bytes_sent\"),1s) as \"upload_bytes\"" \
-                        "FROM \"telegraf\".\"autogen\".\"net\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                        "GROUP BY \"host\",time(10s)) WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' GROUP BY host,time(10s)' -format 'csv' > /data/vinh.tran/new/expData/{}/net_{}.csv" \
-            .format(time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.started_at)),
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.stopped_at)),
-                    host_list,
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.started_at)),
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.stopped_at)),
-                    Application.experiment_name,
-                    Application.experiment_name)
-        print(cmd_query_net)
-
-        cmd_query_net_mean = "\ninflux -precision rfc3339 -username root -password root " \
-                             "-database 'telegraf' -host 'localhost' -execute 'SELECT sum(download_bytes),sum(upload_bytes) FROM (SELECT  derivative(first(\"bytes_recv\"),1s) " \
-                             "as \"download_bytes\",derivative(first(\"bytes_sent\"),1s) as \"upload_bytes\"" \
-                             "FROM \"telegraf\".\"autogen\".\"net\" WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' AND host =~ /{}/  " \
-                             "GROUP BY \"host\",time(10s)) WHERE time > '\\''{}'\\'' and time < '\\''{}'\\'' GROUP BY time(10s)' -format 'csv' > /data/vinh.tran/new/expData/{}/net_{}_mean.csv" \
-            .format(time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.started_at)),
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.stopped_at)),
-                    host_list,
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.started_at)),
-                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.stopped_at)),
-                    Application.experiment_name,
-                    Application.experiment_name)
-        print(cmd_query_net_mean)
-
-        subprocess.Popen(
-            cmd_query_cpu + " && " + cmd_query_mem + " && " + cmd_query_disk + " && " + cmd_query_net + " && "
-            + cmd_query_cpu_mean + " && " + cmd_query_mem_mean + " && " + cmd_query_disk_mean + " && " + cmd_query_net_mean,
-            shell=True)
-
-        time.sleep(1)
-
-        with open("/data/vinh.tran/new/expData/{}/cmd.txt".format(Application.experiment_name), 'a') as file:
-            file.write("{}\n\n{}\n\n{}\n\n{}\n\n\n\n{}\n\n{}\n\n{}\n\n{}\n".
-                       format(cmd_query_cpu, cmd_query_mem, cmd_query_disk, cmd_query_net,
-                              cmd_query_cpu_mean, cmd_query_mem_mean, cmd_query_disk_mean, cmd_query_net_mean))
+        Application.exporter.export_experiment(
+            Application.experiment_name,
+            self.cluster.nodes.keys(),
+            time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.started_at)),
+            time.strftime('%Y-%m-%dT%H:%M:%SZ', time.localtime(self.stopped_at))
+        )
+        # waits for the views of the applications
+        Application.exporter.close()
 
     def get_application_to_schedule(self) -> Application:
         app = self.queue[0]
@@ -242,6 +300,11 @@ class Scheduler(metaclass=ABCMeta):
     def place_containers(self, app: Application):
         pass
 
+    def _group_positions(self, group, jobs_to_peek, index) -> List[int]:
+        # positions of the applications of the group among the considered ones of the peeked jobs
+        considered = set(index)
+        return [int(i) for i in self.queue.group_positions(group, jobs_to_peek) if i in considered]
+
     def _place_random(self, app: Application, n_containers=4):
         nodes = self.cluster.non_full_nodes()
         good_nodes = [
@@ -253,19 +316,51 @@ class Scheduler(metaclass=ABCMeta):
         node = good_nodes[np.random.randint(0, len(good_nodes))]
         return self._place(app, node, n_containers)
 
+    def _free_slot(self, app: Application):
+        # no preferred group to schedule with, slot 1 unless jobs are already running, or the other slot when
+        # the application does not fit (jobs arriving over time find any slot busy), None if neither fits
+        slot = JobGroupData.SLOT_2 if self.cluster.has_application_running() else JobGroupData.SLOT_1
+        other = JobGroupData.SLOT_1 if slot == JobGroupData.SLOT_2 else JobGroupData.SLOT_2
+        for slot in (slot, other):
+            if self.cluster.available_containers(slot) >= app.n_containers:
+                return slot
+        return None
+
+    def _place_on_nodes(self, app: Application, nodes: List[Node], n_containers=4):
+        # n_containers on each node, or its free containers when the RM left it fewer, then the containers still
+        # missing on the nodes which have free ones, those of the slot of the application first
+        for node in nodes:
+            if node.available_containers() > 0:
+                self._place(app, node, min(n_containers, node.available_containers()))
+        if self._missing_containers(app) == 0:
+            return
+
+        spare_nodes = sorted(
+            self.cluster.non_full_nodes(),
+            key=lambda node: JobGroupData.cluster_slots_index.get(node.address) != app.cluster_slot
+        )
+        for node in spare_nodes:
+            missing = self._missing_containers(app)
+            if missing == 0:
+                break
+            self._place(app, node, min(missing, node.available_containers()))
+
+    @staticmethod
+    def _missing_containers(app: Application) -> int:
+        return max(0, app.n_containers - app.placed_tasks() - (1 if app.node is not None else 0))
+
     @staticmethod
     def _place(app: Application, node: Node, n_containers=4):
         if n_containers <= 0:
             raise ValueError("Can not place {} containers".format(n_containers))
         # print("Place {} on {} ({})".format(app, node, node.available_containers()))
 
-        n = len([t for t in app.tasks if t.node is not None])
+        n = app.placed_tasks()
         n += 1 if app.node is not None else 0
 
         for k in range(n, n + n_containers):
             if k < app.n_containers:
                 node.add_container(app.containers[k])
-                print("Place a task of {} on node {}".format(app, node))
 
         return k - n + 1
 
@@ -283,12 +378,11 @@ class EstimationBenchmark(Random):
         super().__init__(estimation=estimations[0], **kwargs)
         self.estimations = estimations
 
-    def update_estimation(self):
-        for (apps, usage) in self.cluster.apps_usage():
-            if len(apps) > 0 and usage.is_not_idle():
-                for rest, out in LeaveOneOut(len(apps)):
-                    for estimation in self.estimations:
-                        estimation.update_app(apps[out[0]], [apps[i] for i in rest], usage.rate())
+    def update_estimation(self, apps_rates=None):
+        if apps_rates is None:
+            apps_rates = self.cluster.apps_rates()
+        for estimation in self.estimations:
+            estimation.update_batch(*estimation.leave_one_out(apps_rates))
         for estimation in self.estimations:
             print(str(estimation))
             estimation.print()
@@ -305,7 +399,12 @@ class RoundRobin(Scheduler):
         empty_nodes = self.cluster.empty_nodes()
 
         n_containers_scheduled = 0
-        print("App {} requires {} containers".format(app, app.n_containers))
+        decision_trace.info(
+            "scheduler.placement",
+            name=app.name,
+            n_containers=app.n_containers,
+            empty_nodes=len(empty_nodes)
+        )
         while len(empty_nodes) > 0 and n_containers_scheduled < app.n_containers:
             n_containers_scheduled += self._place(app, empty_nodes.pop())
 
@@ -322,31 +421,34 @@ class Adaptive(RoundRobin):
     def get_application_to_schedule(self):
         scheduled_apps, scheduled_apps_weight = self.cluster.applications(by_name=True)
         available_containers = self.cluster.available_containers()
-        index = list(range(min(self.jobs_to_peek, len(self.queue))))
+        window = self.queue.window_applications(self.jobs_to_peek)
+        index = list(range(len(window)))
         # Update waiting time for apps in considering queue
         # first schedule round only count the last scheduled app out of 4
         if self.scheduled_apps_num > 2:
-            for i in index:
-                self.queue[i].waiting_time = self.queue[i].waiting_time + 1
+            self.queue.increment_waiting(len(window))
 
         while len(index) > 0:
             best_i = self.estimation.best_app_index(
                 scheduled_apps,
-                [self.queue[i] for i in index],
+                [window[i] for i in index],
                 scheduled_apps_weight
             )
 
-            best_app = self.queue[best_i]
+            best_app = window[best_i]
 
             if best_app.n_containers <= available_containers:
-                print("Best app is {} ({}) of queue {}".format(
-                    best_app.name,
-                    best_i,
-                    ",".join([self.queue[i].name for i in index])
-                ))
+                if decision_trace.enabled(decision_trace.INFO):
+                    decision_trace.info(
+                        "scheduler.decision",
+                        reason="estimation",
+                        name=best_app.name,
+                        position=best_i,
+                        queue=[window[i].name for i in index]
+                    )
                 return self.queue.pop(best_i)
 
-            index.pop(best_i)
+            index.remove(best_i)
 
         raise NoApplicationCanBeScheduled
 
@@ -359,13 +461,12 @@ class GroupAdaptive(RoundRobin):
         self.print_estimation = True
 
     def schedule_application(self) -> Application:
-        print("GroupAdaptive-schedule_application()")
         if self.cluster.available_containers()==0:
             raise NoApplicationCanBeScheduled
         app, existing_group = self.get_application_to_schedule()
-        print("Marking self.get_app_to_schedule()")
-        if app.n_containers > self.cluster.available_containers():
-            self.queue = [app] + self.queue
+        if app.n_containers > self.cluster.available_containers() \
+                or existing_group == -1 and self._free_slot(app) is None:
+            self.queue.appendleft(app)
             raise NoApplicationCanBeScheduled
 
         self.place_containers_with_group(app, existing_group)
@@ -373,36 +474,38 @@ class GroupAdaptive(RoundRobin):
         return app
 
     def place_containers_with_group(self, app: Application, existing_group):
-        print("App {} requires {} containers".format(app, app.n_containers))
-
+        co_located_app = None
         if existing_group == -1:
-            print("No preferred group to schedule with, check if can schedule on slot 1")
-            chosen_slot = JobGroupData.SLOT_1
-            if self.cluster.has_application_running():
-                print("There are already job running, scheduling on slot 2")
-                chosen_slot = JobGroupData.SLOT_2
+            chosen_slot = self._free_slot(app)
             app.cluster_slot = chosen_slot
-            for address,node in self.cluster.nodes.items():
-                if JobGroupData.cluster_slots_index[address] == chosen_slot:
-                    self._place(app, node, 4)
+            # the nodes which joined the cluster after the start have no slot
+            self._place_on_nodes(app, [
+                node for address, node in self.cluster.nodes.items()
+                if JobGroupData.cluster_slots_index.get(address) == chosen_slot
+            ])
         else:
-            print("The chosen existing group to co-locate is: {}".format(existing_group))
-            co_located_app = None
             running_apps, running_apps_weight = self.cluster.applications(with_full_nodes=False, by_name=True)
             #print(running_apps.__str__())
             for running_app in running_apps:
                 if JobGroupData.groupIndexes[running_app.name] == existing_group:
-                    print("Choose app {} of group {} to co-locate".format(running_app.name, existing_group))
                     co_located_app = running_app
                     break
             if co_located_app is not None:
-                print("The chosen slot to place new job is {}".format(co_located_app.cluster_slot))
                 app.cluster_slot = co_located_app.cluster_slot
-                for address, node in self.cluster.nodes.items():
-                    #print(co_located_app.nodes)
-                    #print(address)
-                    if address in co_located_app.nodes:
-                        self._place(app, node, 4)
+                # the co-located application may not be launched yet, so its nodes are taken from the cluster
+                co_located_nodes = self.cluster.application_nodes(co_located_app)
+                self._place_on_nodes(app, [
+                    node for address, node in self.cluster.nodes.items() if address in co_located_nodes
+                ])
+
+        decision_trace.info(
+            "scheduler.placement",
+            name=app.name,
+            n_containers=app.n_containers,
+            existing_group=existing_group,
+            co_located_with=co_located_app.id if co_located_app is not None else None,
+            slot=app.cluster_slot
+        )
 
         # n_containers_scheduled = 0
         # print("App {} requires {} containers".format(app, app.n_containers))
@@ -418,47 +521,42 @@ class GroupAdaptive(RoundRobin):
         #for app in scheduled_apps:
         #    print(app.__str__())
         available_containers = self.cluster.available_containers()
-        index = list(range(min(self.jobs_to_peek, len(self.queue))))
+        window = self.queue.window_applications(self.jobs_to_peek)
+        index = list(range(len(window)))
         best_app = None
         # Update waiting time for apps in considering queue
         # first schedule round only count the last scheduled app out of 4
         if self.scheduled_apps_num > 2:
-            for i in index:
-                self.queue[i].waiting_time = self.queue[i].waiting_time + 1
+            self.queue.increment_waiting(len(window))
 
         while len(index) > 0:
             best_group_to_schedule, best_group_existing = self.estimation.best_app_index(
                 scheduled_apps,
-                [self.queue[i] for i in index],
+                [window[i] for i in index],
                 scheduled_apps_weight
             )
 
             if best_group_to_schedule == -1:
-                print("No app is scheduling, pick randomly")
+                # no app is scheduling, pick randomly
                 best_app = self.queue.pop(np.random.randint(0, len(index)))
-                print("Choose randomly app {} to schedule".format(best_app.name))
+                decision_trace.info("scheduler.decision", reason="random", name=best_app.name)
                 return best_app, best_group_existing
             else:
                 # Pick app from the best group to schedule
-                print("Queue to consider: {}".format(",".join([self.queue[i].name for i in index])))
-                print("Best app group to schedule: {}".format(best_group_to_schedule))
-                print("Best app group existing: {}".format(best_group_existing))
-                # print("Index = {}".format(index))
-                list_best_jobs_indexes = []
-                for i in index:
-                    print("Job {} index = {}".format(self.queue[i].name, JobGroupData.groupIndexes[self.queue[i].name]))
-                    if JobGroupData.groupIndexes[self.queue[i].name] == best_group_to_schedule:
-                        print("Add job {} to list of best apps to choose from best group".format(self.queue[i].name))
-                        list_best_jobs_indexes.append(i)
+                list_best_jobs_indexes = self._group_positions(best_group_to_schedule, len(window), index)
                 best_i = list_best_jobs_indexes[np.random.randint(0, len(list_best_jobs_indexes))]
-                best_app = self.queue[best_i]
-                # print("Best app group to schedule: {}".format(best_group_to_schedule))
-                # print("Best app group existing: {}".format(best_group_existing))
-                print("Best app is {} ({}) of queue {}".format(
-                    best_app.name,
-                    best_group_to_schedule,
-                    ",".join([self.queue[i].name for i in index])
-                ))
+                best_app = window[best_i]
+                if decision_trace.enabled(decision_trace.INFO):
+                    decision_trace.info(
+                        "scheduler.decision",
+                        reason="estimation",
+                        name=best_app.name,
+                        position=best_i,
+                        group=best_group_to_schedule,
+                        existing_group=best_group_existing,
+                        queue=[window[i].name for i in index],
+                        candidates=list_best_jobs_indexes
+                    )
                 #print("Best app n_containers = {} | available_containers = {}".format(best_app.n_containers,
                 #                                                                      available_containers))
             if best_app is None:
@@ -474,7 +572,7 @@ class GroupAdaptive(RoundRobin):
                 #))
                 return self.queue.pop(best_i), best_group_existing
 
-            index.pop(best_i)
+            index.remove(best_i)
 
         raise NoApplicationCanBeScheduled
 
@@ -487,17 +585,16 @@ class GroupAdaptiveExtend(RoundRobin):
             self.waiting_limit = self.jobs_to_peek_arg * 2
         print("Init scheduler - set jobs_to_peek = {}".format(self.jobs_to_peek))
         print("Init scheduler - set waiting_limit = {}".format(self.waiting_limit))
-        print("Init scheduler - activate random arrival rate = {}".format(self.activate_random_arrival))
+        print("Init scheduler - arrival process = {}".format(type(self.arrivals).__name__))
         self.print_estimation = True
 
     def schedule_application(self) -> Application:
-        print("GroupAdaptive-schedule_application()")
         if self.cluster.available_containers()==0:
             raise NoApplicationCanBeScheduled
         app, existing_group = self.get_application_to_schedule()
-        print("Marking self.get_app_to_schedule()")
-        if app.n_containers > self.cluster.available_containers():
-            self.queue = [app] + self.queue
+        if app.n_containers > self.cluster.available_containers() \
+                or existing_group == -1 and self._free_slot(app) is None:
+            self.queue.appendleft(app)
             raise NoApplicationCanBeScheduled
 
         self.place_containers_with_group(app, existing_group)
@@ -505,36 +602,38 @@ class GroupAdaptiveExtend(RoundRobin):
         return app
 
     def place_containers_with_group(self, app: Application, existing_group):
-        print("App {} requires {} containers".format(app, app.n_containers))
-
+        co_located_app = None
         if existing_group == -1:
-            print("No preferred group to schedule with, check if can schedule on slot 1")
-            chosen_slot = JobGroupData.SLOT_1
-            if self.cluster.has_application_running():
-                print("There are already job running, scheduling on slot 2")
-                chosen_slot = JobGroupData.SLOT_2
+            chosen_slot = self._free_slot(app)
             app.cluster_slot = chosen_slot
-            for address,node in self.cluster.nodes.items():
-                if JobGroupData.cluster_slots_index[address] == chosen_slot:
-                    self._place(app, node, 4)
+            # the nodes which joined the cluster after the start have no slot
+            self._place_on_nodes(app, [
+                node for address, node in self.cluster.nodes.items()
+                if JobGroupData.cluster_slots_index.get(address) == chosen_slot
+            ])
         else:
-            print("The chosen existing group to co-locate is: {}".format(existing_group))
-            co_located_app = None
             running_apps, running_apps_weight = self.cluster.applications(with_full_nodes=False, by_name=True)
             #print(running_apps.__str__())
             for running_app in running_apps:
                 if JobGroupData.groupIndexes[running_app.name] == existing_group:
-                    print("Choose app {} of group {} to co-locate".format(running_app.name, existing_group))
                     co_located_app = running_app
                     break
             if co_located_app is not None:
-                print("The chosen slot to place new job is {}".format(co_located_app.cluster_slot))
                 app.cluster_slot = co_located_app.cluster_slot
-                for address, node in self.cluster.nodes.items():
-                    #print(co_located_app.nodes)
-                    #print(address)
-                    if address in co_located_app.nodes:
-                        self._place(app, node, 4)
+                # the co-located application may not be launched yet, so its nodes are taken from the cluster
+                co_located_nodes = self.cluster.application_nodes(co_located_app)
+                self._place_on_nodes(app, [
+                    node for address, node in self.cluster.nodes.items() if address in co_located_nodes
+                ])
+
+        decision_trace.info(
+            "scheduler.placement",
+            name=app.name,
+            n_containers=app.n_containers,
+            existing_group=existing_group,
+            co_located_with=co_located_app.id if co_located_app is not None else None,
+            slot=app.cluster_slot
+        )
 
         # n_containers_scheduled = 0
         # print("App {} requires {} containers".format(app, app.n_containers))
@@ -559,66 +658,62 @@ class GroupAdaptiveExtend(RoundRobin):
         #for app in scheduled_apps:
         #    print(app.__str__())
         available_containers = self.cluster.available_containers()
-        index = list(range(min(self.jobs_to_peek, len(self.queue))))
+        window = self.queue.window_applications(self.jobs_to_peek)
+        index = list(range(len(window)))
         best_app = None
         # Update waiting time for apps in considering queue
         # first schedule round only count the last scheduled app out of 4
         if self.scheduled_apps_num > 2:
-            late_app = None
-            late_index = -1
-            for i in index:
-                self.queue[i].waiting_time = self.queue[i].waiting_time + 1
-                if self.queue[i].waiting_time > self.waiting_limit:
-                    print("Job {} waiting time exceeds limit of {}".format(self.queue[i].short_str(), self.waiting_limit))
-                    if late_app is None or self.queue[i].waiting_time > late_app.waiting_time:
-                        late_app = self.queue[i]
-                        late_index = i
-            if late_app is not None:
-                print("Choose job {} to schedule because of late waiting time".format(late_app.short_str()))
-                return self.queue.pop(late_index), JobGroupData.groupIndexes[scheduled_apps[0].name]
+            waiting_rounds = self.queue.increment_waiting(len(window))
+            late_indexes = np.flatnonzero(waiting_rounds > self.waiting_limit)
+            if len(late_indexes) > 0:
+                late_index = late_indexes[np.argmax(waiting_rounds[late_indexes])]
+                if decision_trace.enabled(decision_trace.INFO):
+                    decision_trace.info(
+                        "scheduler.decision",
+                        reason="late",
+                        name=window[late_index].name,
+                        position=late_index,
+                        waiting_limit=self.waiting_limit,
+                        late=[window[i].short_str() for i in late_indexes]
+                    )
+                # the nodes of the scheduled applications may all be full when the RM left them fewer containers
+                existing_group = JobGroupData.groupIndexes[scheduled_apps[0].name] if len(scheduled_apps) > 0 else -1
+                return self.queue.pop(late_index), existing_group
 
 
         while len(index) > 0:
             best_group_to_schedule, best_group_existing = self.estimation.best_app_index(
                 scheduled_apps,
-                [self.queue[i] for i in index],
+                [window[i] for i in index],
                 scheduled_apps_weight
             )
 
             if best_group_to_schedule == -1:
-                print("No app is scheduling, pick randomly")
+                # no app is scheduling, pick randomly
                 best_app = self.queue.pop(np.random.randint(0, len(index)))
-                print("Choose randomly app {} to schedule".format(best_app.name))
+                decision_trace.info("scheduler.decision", reason="random", name=best_app.name)
                 return best_app, best_group_existing
             else:
                 # Pick app from the best group to schedule
-                print("Queue to consider: {}".format(",".join([self.queue[i].short_str() for i in index])))
-                print("Best app group to schedule: {}".format(best_group_to_schedule))
-                print("Best app group existing: {}".format(best_group_existing))
-                # print("Index = {}".format(index))
-                list_best_jobs_indexes = []
-                list_best_jobs = []
-                for i in index:
-                    print("Job {} index = {}".format(self.queue[i].name, JobGroupData.groupIndexes[self.queue[i].name]))
-                    if JobGroupData.groupIndexes[self.queue[i].name] == best_group_to_schedule:
-                        print("Add job {} to list of best apps to choose from best group".format(self.queue[i].name))
-                        list_best_jobs_indexes.append(i)
-                        list_best_jobs.append(self.queue[i])
-
-                print("Apps to considered in best group: {}".format(",".join([app.short_str() for app in list_best_jobs])))
+                list_best_jobs_indexes = self._group_positions(best_group_to_schedule, len(window), index)
+                list_best_jobs = [window[i] for i in list_best_jobs_indexes]
                 waiting_based_probabilities = self.get_waiting_time_based_probability(list_best_jobs)
-                print("Waiting based selection probabilities = {}".format(str(waiting_based_probabilities)))
                 waiting_indices = np.arange(len(list_best_jobs))
                 best_i = list_best_jobs_indexes[np.random.choice(waiting_indices, p=waiting_based_probabilities)]
-                print("Chosen index in list best jobs = {}".format(best_i))
-                best_app = self.queue[best_i]
-                # print("Best app group to schedule: {}".format(best_group_to_schedule))
-                # print("Best app group existing: {}".format(best_group_existing))
-                print("Best app is {} ({}) of queue {}".format(
-                    best_app.name,
-                    best_group_to_schedule,
-                    ",".join([self.queue[i].name for i in index])
-                ))
+                best_app = window[best_i]
+                if decision_trace.enabled(decision_trace.INFO):
+                    decision_trace.info(
+                        "scheduler.decision",
+                        reason="estimation",
+                        name=best_app.name,
+                        position=best_i,
+                        group=best_group_to_schedule,
+                        existing_group=best_group_existing,
+                        queue=[window[i].short_str() for i in index],
+                        candidates=list_best_jobs_indexes,
+                        probabilities=waiting_based_probabilities
+                    )
                 #print("Best app n_containers = {} | available_containers = {}".format(best_app.n_containers,
                 #                                                                      available_containers))
             if best_app is None:
@@ -634,6 +729,6 @@ class GroupAdaptiveExtend(RoundRobin):
                 #))
                 return self.queue.pop(best_i), best_group_existing
 
-            index.pop(best_i)
+            index.remove(best_i)
 
         raise NoApplicationCanBeScheduled
@@ -1,10 +1,16 @@
 from influxdb import InfluxDBClient
 from abc import ABCMeta, abstractmethod
+import math
+import re
+import socketserver
+import threading
+import time
 import numpy as np
-from typing import Dict
+from typing import Dict, List, Tuple
 
 
 class Server:
+    __slots__ = ('address',)
     disk_max = 1e3
     net_max = 1e3
     net_interface = ''
@@ -36,21 +42,129 @@ class Usage:
         return self.cpu > 0.05 or self.io_wait > 0.05
 
 
+# Usage of many servers, one row per address in a structured array with one field per metric.
+# Indexing it by address gives the Usage of the server, rate() and is_not_idle() are computed for every
+# row at once.
+class UsageFrame:
+    metrics = ['cpu', 'io_wait', 'dsk_read', 'dsk_write', 'net_recv', 'net_sent']
+    dtype = [(metric, float) for metric in metrics]
+
+    def __init__(self, addresses: List[str], values=None):
+        # values: (addresses x metrics) array
+        self.addresses = list(addresses)
+        self.index = {address: i for i, address in enumerate(self.addresses)}
+        if values is None:
+            values = np.zeros((len(self.addresses), len(self.metrics)))
+        values = np.ascontiguousarray(values, dtype=float).reshape(len(self.addresses), len(self.metrics))
+        self.values = values.view(self.dtype).reshape(len(self.addresses))
+
+    @classmethod
+    def from_usages(cls, usages: Dict[str, Usage]) -> 'UsageFrame':
+        return cls(usages.keys(), [[getattr(usage, metric) for metric in cls.metrics] for usage in usages.values()])
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __contains__(self, address):
+        return address in self.index
+
+    def __getitem__(self, address) -> Usage:
+        return Usage(*self.values[self.index[address]].tolist())
+
+    def keys(self):
+        return self.index.keys()
+
+    def items(self):
+        return [(address, self[address]) for address in self.addresses]
+
+    def rate(self) -> np.ndarray:
+        v = self.values
+        dsk = np.tanh(v['dsk_read'] + v['dsk_write'])
+        net = np.tanh(v['net_recv'] + v['net_sent'])
+        r = v['cpu'] + (dsk + net) * np.exp(- 5 * v['io_wait'])
+        return np.exp(1 + r)
+
+    def is_not_idle(self) -> np.ndarray:
+        return (self.values['cpu'] > 0.05) | (self.values['io_wait'] > 0.05)
+
+
+def _scales(server: Server):
+    # (divisor of the values, value above which a warning is printed) of cpu, io_wait, dsk_read, dsk_write,
+    # net_recv and net_sent: percentages and bytes per second
+    Mo = 1024 ** 2
+    disk = (server.disk_max * Mo, Server.disk_max * Mo)
+    net = (server.net_max * Mo, Server.net_max * Mo)
+    return [(100., 100.), (100., 100.), disk, disk, net, net]
+
+
 class StatCollector(metaclass=ABCMeta):
     @abstractmethod
-    def mean_usage(self, servers: Dict[str, Server], time_interval: int = 60) -> Dict[str, Usage]:
+    def mean_usage(self, servers: Dict[str, Server], time_interval: int = 60) -> UsageFrame:
         pass
 
 
 class DummyStatCollector(StatCollector):
     def mean_usage(self, servers, time_interval=60):
-        return {
-            k: Usage(1, 1, 1, 1, 1, 1) for k, _ in servers.items()
-        }
+        return UsageFrame(servers.keys(), np.ones((len(servers), len(UsageFrame.metrics))))
+
+
+class SimulatedStatCollector(StatCollector):
+    def __init__(self, usages=None, default_usage=(0.3, 0.05, 0.2, 0.2, 0.2, 0.2), noise=0.05, seed=None):
+        # job name -> (cpu, io_wait, dsk_read, dsk_write, net_recv, net_sent) of one application on a node
+        self.usages = {} if usages is None else usages
+        self.default_usage = default_usage
+        self.noise = noise
+        self.random = np.random.RandomState(seed)
+
+    def mean_usage(self, servers, time_interval=60):
+        usages = np.zeros((len(servers), 6))
+        for usage, server in zip(usages, servers.values()):
+            for app in server.applications(is_running=True):
+                usage += self.usages.get(app.name, self.default_usage)
+        # one draw per server, in the order of the servers
+        usages *= 1 + self.random.normal(0, self.noise, usages.shape)
+        usages = usages.clip(0, None)
+        usages[:, :2] = usages[:, :2].clip(0, 1)
 
+        return UsageFrame(servers.keys(), usages)
 
+
+# Per host mean and max of every metric, aggregated by InfluxDB in one request of three statements
+# (cpu, disk, net). Disk and network rates are derivatives computed by subqueries.
 class InfluxDB(StatCollector):
     time_format = "%Y-%m-%dT%H:%M:%SZ"
+    query_template = """
+        SELECT mean(usage_user) AS cpu, max(usage_user) AS cpu_max,
+               mean(usage_iowait) AS io_wait, max(usage_iowait) AS io_wait_max
+        FROM cpu
+        WHERE time > now() - {time_in_sec}s
+        AND host =~ /^({hosts})$/
+        AND cpu = 'cpu-total'
+        GROUP BY host;
+        SELECT mean(dsk_read) AS dsk_read, max(dsk_read) AS dsk_read_max,
+               mean(dsk_write) AS dsk_write, max(dsk_write) AS dsk_write_max
+        FROM (
+            SELECT derivative(read_bytes, 1s) AS dsk_read, derivative(write_bytes, 1s) AS dsk_write
+            FROM diskio
+            WHERE time > now() - {time_in_sec}s
+            AND "name" = '{disk_name}'
+            AND host =~ /^({hosts})$/
+            GROUP BY host
+        )
+        GROUP BY host;
+        SELECT mean(net_recv) AS net_recv, max(net_recv) AS net_recv_max,
+               mean(net_sent) AS net_sent, max(net_sent) AS net_sent_max
+        FROM (
+            SELECT derivative(bytes_recv, 1s) AS net_recv, derivative(bytes_sent, 1s) AS net_sent
+            FROM net
+            WHERE time > now() - {time_in_sec}s
+            AND interface = '{net_interface}'
+            AND host =~ /^({hosts})$/
+            GROUP BY host
+        )
+        GROUP BY host
+    """
+    metrics = ['cpu', 'io_wait', 'dsk_read', 'dsk_write', 'net_recv', 'net_sent']
 
     def __init__(self, address, port=8086, username="root", password="root", db="telegraf"):
         self.client = InfluxDBClient(
@@ -62,122 +176,223 @@ class InfluxDB(StatCollector):
         )
 
     def mean_usage(self, servers: Dict[str, Server], time_interval=60):
-        cpu = self._cpu(time_interval, servers)
-        disk = self._disk(time_interval, servers)
-        net = self._net(time_interval, servers)
+        return UsageFrame.from_usages({address: mean for address, (mean, _) in self.usage(servers, time_interval).items()})
 
-        results = {}
-        for address, server in servers.items():
-            results[address] = Usage(
-                cpu=cpu[address]['cpu'] / 100,
-                io_wait=cpu[address]['io_wait'] / 100,
-                dsk_read=disk[address]['read'] / server.disk_max,
-                dsk_write=disk[address]['write'] / server.disk_max,
-                net_recv=net[address]['recv'] / server.net_max,
-                net_sent=net[address]['sent'] / server.net_max,
-            )
-
-        return results
-
-    def _cpu(self, time_in_sec, servers: Dict[str, Server]):
-        query_template = """
-            SELECT usage_user, usage_iowait
-            FROM cpu
-            WHERE time > now() - {time_in_sec}s
-            AND host =~ /^({hosts})$/
-            AND cpu = 'cpu-total'
-            GROUP BY host
-        """
-        data = self.client.query(query_template.format(
-            time_in_sec=int(time_in_sec),
-            hosts="|".join([address for address in servers.keys()])
+    def usage(self, servers: Dict[str, Server], time_interval=60) -> Dict[str, Tuple[Usage, Usage]]:
+        # (mean, max) usage of each server, a server without points has a zero usage
+        data = self.client.query(self.query_template.format(
+            time_in_sec=int(time_interval),
+            hosts="|".join([address for address in servers.keys()]),
+            disk_name=Server.disk_name,
+            net_interface=Server.net_interface,
         ))
+        values = self._parse([result.raw for result in (data if isinstance(data, list) else [data])])
 
-        cpu = {}
-        for address in servers.keys():
-            cpu[address] = {
-                'cpu': self._mean(data.get_points(tags={'host': address}), 'usage_user'),
-                'io_wait': self._mean(data.get_points(tags={'host': address}), 'usage_iowait')
-            }
+        usage = {}
+        for address, server in servers.items():
+            host = values.get(address, {})
+            scales = _scales(server)
+            mean, maximum = [], []
+            for metric, (scale, p_max) in zip(self.metrics, scales):
+                m = host.get(metric) or 0
+                max_value = host.get(metric + '_max') or 0
+                if max_value > p_max:
+                    print("/!\\ Max for {} exceed by {:.2%}".format(metric, max_value / p_max))
+                mean.append(m / scale)
+                maximum.append(max_value / scale)
+            usage[address] = (Usage(*mean), Usage(*maximum))
 
-        return cpu
+        return usage
 
-    def _disk(self, time_in_sec, servers: Dict[str, Server]):
-        query_template = """
-            SELECT derivative(read_bytes, 1s) as dsk_read, derivative(write_bytes, 1s) as dsk_write
-            FROM diskio
-            WHERE time > now() - {time_in_sec}s
-            AND "name" = '{disk_name}'
-            AND host =~ /^({hosts})$/
-            GROUP BY host
-        """
-        data = self.client.query(query_template.format(
-            time_in_sec=int(time_in_sec),
-            disk_name=Server.disk_name,
-            hosts="|".join([address for address in servers.keys()]),
-        ))
+    @staticmethod
+    def _parse(results) -> Dict[str, Dict[str, float]]:
+        # host -> {column: value} of the raw results, in one pass over their series
+        values = {}
+        for result in results:
+            if 'error' in result:
+                print("InfluxDB query failed: {}".format(result['error']))
+                continue
+            for series in result.get('series', []):
+                host = values.setdefault(series.get('tags', {}).get('host'), {})
+                for row in series.get('values', []):
+                    host.update(zip(series['columns'], row))
+        return values
 
-        disk = {}
-        Mo = 1024 ** 2
-        for address in servers.keys():
-            disk[address] = {
-                'read': self._mean(
-                    data.get_points(tags={'host': address}),
-                    'dsk_read',
-                    Server.disk_max * Mo
-                ) / Mo,
-                'write': self._mean(
-                    data.get_points(tags={'host': address}),
-                    'dsk_write',
-                    Server.disk_max * Mo
-                ) / Mo,
-            }
-
-        return disk
-
-    def _net(self, time_in_sec, servers: Dict[str, Server]):
-        query_template = """
-            SELECT derivative(bytes_recv, 1s) as net_recv, derivative(bytes_sent, 1s) as net_sent
-            FROM net
-            WHERE time > now() - {time_in_sec}s
-            AND interface = '{net_interface}'
-            AND host =~ /^({hosts})$/
-            GROUP BY host
-        """
-        data = self.client.query(query_template.format(
-            time_in_sec=int(time_in_sec),
-            net_interface=Server.net_interface,
-            hosts="|".join([address for address in servers.keys()])
-        ))
 
-        net = {}
-        Mo = 1024 ** 2
-        for address in servers.keys():
-            net[address] = {
-                'recv': self._mean(
-                    data.get_points(tags={'host': address}),
-                    'net_recv',
-                    Server.net_max * Mo
-                ) / Mo,
-                'sent': self._mean(
-                    data.get_points(tags={'host': address}),
-                    'net_sent',
-                    Server.net_max * Mo
-                ) / Mo,
-            }
-
-        return net
+# Usage pushed by Telegraf in line protocol (socket_writer output, or an influxdb output over UDP) to a local
+# UDP or TCP socket. Each host has a ring buffer of `resolution` second buckets covering the last `window`
+# seconds, holding the cumulative sum and count of the values of each metric up to the bucket, so the mean
+# over an interval is the difference of two buckets and mean_usage is answered from memory in O(hosts).
+# Disk and network counters are turned into rates between consecutive points of a host.
+class TelegrafStatCollector(StatCollector):
+    metrics = ['cpu', 'io_wait', 'dsk_read', 'dsk_write', 'net_recv', 'net_sent']
+    # measurement -> {field: (metric, is a counter)}
+    fields = {
+        'cpu': {'usage_user': (0, False), 'usage_iowait': (1, False)},
+        'diskio': {'read_bytes': (2, True), 'write_bytes': (3, True)},
+        'net': {'bytes_recv': (4, True), 'bytes_sent': (5, True)},
+    }
+
+    def __init__(self, address="127.0.0.1", port=8094, protocol="udp", window=600, resolution=1., clock=None):
+        self.resolution = resolution
+        self.n_buckets = int(math.ceil(window / resolution)) + 1
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._allocate(16)
+        # (host, metric) -> (time, value) of the last point of the counters
+        self._counters = {}
+
+        collector = self
+        if protocol == "udp":
+            class Handler(socketserver.BaseRequestHandler):
+                def handle(self):
+                    collector.receive(self.request[0])
+            self._server = socketserver.ThreadingUDPServer((address, port), Handler)
+        else:
+            class Handler(socketserver.StreamRequestHandler):
+                def handle(self):
+                    for line in self.rfile:
+                        collector.receive(line)
+            self._server = socketserver.ThreadingTCPServer((address, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def time(self) -> float:
+        return time.time() if self.clock is None else self.clock.time()
+
+    def receive(self, data: bytes):
+        for line in data.decode(errors='replace').splitlines():
+            try:
+                self._add_line(line)
+            except (ValueError, IndexError):
+                print("Invalid line protocol: {}".format(line))
+
+    def mean_usage(self, servers, time_interval=60):
+        now = int(self.time() // self.resolution)
+        start = now - min(int(math.ceil(time_interval / self.resolution)), self.n_buckets - 1)
+        addresses = list(servers.keys())
+        with self._lock:
+            rows = np.array([self._hosts.get(address, -1) for address in addresses], dtype=np.int64)
+            known = rows >= 0
+            rows = rows[known]
+            # cumulative values at the end of the interval and before it (zero before the first point)
+            end = np.minimum(self._last[rows], now)
+            end_slots = (rows, end % self.n_buckets)
+            start_slots = (rows, np.full(len(rows), start % self.n_buckets))
+            before = (self._bucket_ids[start_slots] == start)[:, None]
+            sums = self._sums[end_slots] - np.where(before, self._sums[start_slots], 0)
+            counts = self._counts[end_slots] - np.where(before, self._counts[start_slots], 0)
+            counts[(end <= start) | (end < self._first[rows])] = 0
+
+        means = np.zeros((len(addresses), len(self.metrics)))
+        means[known] = np.divide(sums, counts, out=np.zeros(sums.shape), where=counts > 0)
+        scales = np.array([[scale for scale, _ in _scales(servers[address])] for address in addresses])
+        return UsageFrame(addresses, means / scales.reshape(means.shape))
+
+    def _add_line(self, line):
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            return
+        parts = re.split(r'(?<!\\) ', line)
+        series = re.split(r'(?<!\\),', parts[0])
+        fields = self.fields.get(series[0])
+        if fields is None:
+            return
+        tags = dict(tag.split('=', 1) for tag in series[1:])
+        if not self._selected(series[0], tags) or 'host' not in tags:
+            return
+        at = int(parts[2]) / 1e9 if len(parts) > 2 else self.time()
+
+        for field in re.split(r'(?<!\\),', parts[1]):
+            key, value = field.split('=', 1)
+            if key not in fields:
+                continue
+            metric, is_counter = fields[key]
+            value = float(value.rstrip('iu'))
+            if is_counter:
+                value = self._rate(tags['host'], metric, at, value)
+                if value is None:
+                    continue
+            self._add(tags['host'], metric, at, value)
 
     @staticmethod
-    def _mean(points, key, p_max=100.):
-        points_sum = 0
-        n = 0
-        for p in points:
-            if p[key] is not None:
-                n += 1
-                points_sum += p[key]
-                if p[key] > p_max:
-                    print("/!\\ Max for {} exceed by {:.2%}".format(key, p[key] / p_max))
-        if n == 0:
-            return 0
-        return points_sum / n
+    def _selected(measurement, tags) -> bool:
+        if measurement == 'cpu':
+            return tags.get('cpu') == 'cpu-total'
+        if measurement == 'diskio':
+            return tags.get('name') == Server.disk_name
+        return tags.get('interface') == Server.net_interface
+
+    def _rate(self, host, metric, at, value):
+        with self._lock:
+            last = self._counters.get((host, metric))
+            self._counters[(host, metric)] = (at, value)
+        if last is None or at <= last[0] or value < last[1]:
+            # first point, or the counter was reset
+            return None
+        return (value - last[1]) / (at - last[0])
+
+    def _add(self, host, metric, at, value):
+        bucket = int(at // self.resolution)
+        with self._lock:
+            row = self._hosts.get(host)
+            if row is None:
+                row = len(self._hosts)
+                if row == len(self._last):
+                    self._allocate(2 * row)
+                self._hosts[host] = row
+                self._first[row] = bucket
+                self._last[row] = bucket - 1
+            last = self._last[row]
+            if bucket <= last - self.n_buckets:
+                # older than the window
+                return
+
+            if bucket > last:
+                # the buckets since the last point keep its cumulative values
+                gap = np.arange(max(last + 1, bucket - self.n_buckets + 1), bucket + 1)
+                previous = (row, last % self.n_buckets)
+                filled = last >= self._first[row]
+                self._sums[row, gap % self.n_buckets] = self._sums[previous] if filled else 0
+                self._counts[row, gap % self.n_buckets] = self._counts[previous] if filled else 0
+                self._bucket_ids[row, gap % self.n_buckets] = gap
+                self._last[row] = last = bucket
+
+            if bucket < self._first[row]:
+                # late point before the first one of the host
+                earlier = np.arange(bucket, self._first[row])
+                self._sums[row, earlier % self.n_buckets] = 0
+                self._counts[row, earlier % self.n_buckets] = 0
+                self._bucket_ids[row, earlier % self.n_buckets] = earlier
+                self._first[row] = bucket
+
+            # a point is counted in the cumulative values of its bucket and of the following ones
+            updated = np.arange(bucket, last + 1) % self.n_buckets
+            self._sums[row, updated, metric] += value
+            self._counts[row, updated, metric] += 1
+
+    def _allocate(self, n_hosts):
+        # copies the rows of the known hosts
+        n = len(self._hosts)
+        bucket_ids = np.full((n_hosts, self.n_buckets), -1, dtype=np.int64)
+        sums = np.zeros((n_hosts, self.n_buckets, len(self.metrics)))
+        counts = np.zeros((n_hosts, self.n_buckets, len(self.metrics)), dtype=np.int64)
+        first = np.zeros(n_hosts, dtype=np.int64)
+        last = np.full(n_hosts, -1, dtype=np.int64)
+        if n > 0:
+            bucket_ids[:n] = self._bucket_ids[:n]
+            sums[:n] = self._sums[:n]
+            counts[:n] = self._counts[:n]
+            first[:n] = self._first[:n]
+            last[:n] = self._last[:n]
+        self._bucket_ids, self._sums, self._counts = bucket_ids, sums, counts
+        self._first, self._last = first, last
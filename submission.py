@@ -0,0 +1,110 @@
+import queue
+import threading
+from abc import ABCMeta, abstractmethod
+from application import Application
+
+
+# Launches the applications chosen by the scheduler, outside of the scheduler lock.
+# Applications of the same lane (their cluster slot) are launched in the order they were submitted,
+# `spacing` seconds apart so that they reach YARN in that order. on_launched(app) or on_failed(app, error)
+# is called once the launch is done.
+class SubmissionPool(metaclass=ABCMeta):
+    def __init__(self, spacing=1., on_launched=None, on_failed=None):
+        self.spacing = spacing
+        self.on_launched = on_launched
+        self.on_failed = on_failed
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    @abstractmethod
+    def submit(self, app: Application, launch):
+        pass
+
+    def stop(self):
+        pass
+
+    def pending(self) -> int:
+        return self._pending
+
+    @staticmethod
+    def lane(app: Application):
+        return getattr(app, 'cluster_slot', None)
+
+    def _add_pending(self, delta):
+        with self._pending_lock:
+            self._pending += delta
+
+    def _launch(self, app: Application, launch):
+        try:
+            launch(app)
+        except BaseException as e:
+            self._add_pending(-1)
+            if self.on_failed is not None:
+                self.on_failed(app, e)
+            return
+
+        self._add_pending(-1)
+        if self.on_launched is not None:
+            self.on_launched(app)
+
+
+class ThreadSubmissionPool(SubmissionPool):
+    # each lane is bound to one of the n_workers threads, with one worker every launch is in submission order
+    def __init__(self, n_workers=1, spacing=1., clock=None, **kwargs):
+        super().__init__(spacing, **kwargs)
+        self.clock = clock
+        self._lanes = {}
+        self._queues = [queue.Queue() for _ in range(n_workers)]
+        self._workers = []
+
+    def submit(self, app: Application, launch):
+        if len(self._workers) == 0:
+            self._workers = [
+                threading.Thread(target=self._work, args=[q], daemon=True)
+                for q in self._queues
+            ]
+            for worker in self._workers:
+                worker.start()
+
+        lane = self.lane(app)
+        if lane not in self._lanes:
+            self._lanes[lane] = len(self._lanes) % len(self._queues)
+        self._add_pending(1)
+        self._queues[self._lanes[lane]].put((app, launch))
+
+    def join(self):
+        # wait until every submitted application has been launched
+        for q in self._queues:
+            q.join()
+
+    def stop(self):
+        # the workers may be the ones stopping the scheduler, so they are not joined
+        for q in self._queues:
+            q.put(None)
+
+    def _work(self, q: queue.Queue):
+        while True:
+            item = q.get()
+            if item is None:
+                q.task_done()
+                return
+            self._launch(*item)
+            if self.clock is not None:
+                self.clock.sleep(self.spacing)
+            q.task_done()
+
+
+class ClockSubmissionPool(SubmissionPool):
+    # launches are events of a VirtualClock or an AsyncioClock, each lane is free again `spacing` seconds after
+    # a launch
+    def __init__(self, clock, spacing=1., **kwargs):
+        super().__init__(spacing, **kwargs)
+        self.clock = clock
+        self._ready_at = {}
+
+    def submit(self, app: Application, launch):
+        lane = self.lane(app)
+        when = max(self.clock.time(), self._ready_at.get(lane, 0.))
+        self._ready_at[lane] = when + self.spacing
+        self._add_pending(1)
+        self.clock.call_at(when, self._launch, app, launch)
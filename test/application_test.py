@@ -29,6 +29,36 @@ class TestApplication:
         assert [app.name] == a
         assert app.is_running
 
+    def test_observe(self):
+        app = DummyApplication(name="WordCount")
+        app.submitted_at = app.last_seen_at = 0
+
+        assert not app._observe("ACCEPTED", 10)
+        assert not app._observe(RUNNING, 20)
+        assert app.is_running
+        assert app._observe(FINISHED, 30)
+        assert app.failure is None
+
+    def test_observe_failures(self):
+        for state, now, failure in [(FAILED, 10, FAILED), (KILLED, 10, KILLED),
+                                    (None, 1000, "MISSING"), ("ACCEPTED", 1000, "TIMEOUT")]:
+            app = DummyApplication(name="WordCount")
+            app.submitted_at = app.last_seen_at = 0
+
+            assert app._observe(state, now)
+            assert app.failure == failure
+
+    def test_reset(self):
+        app = DummyApplication(name="WordCount", is_running=True)
+        app.failure = FAILED
+        app.nodes.add("N0")
+        app.reset()
+
+        assert app.id is None
+        assert not app.is_running
+        assert app.failure is None
+        assert len(app.nodes) == 0
+
     def test_not_correctly_scheduled(self):
         app = DummyApplication()
         rm = DummyRM()
@@ -103,6 +133,22 @@ class TestFlinkApplication:
         assert "hdfs:///tmp/" in cmd[10]
         assert expected_cmd[11] in cmd[11]
 
+    def test_yarn_submission(self):
+        app, _ = self.gen_app()
+        app.cluster_slot = "slot1"
+        staged = {'resource': "hdfs:///jar", 'size': 1, 'timestamp': 1}
+        spark = {'archive': staged, 'conf': staged, 'jars': {"jar": staged}, 'am_memory': 2048,
+                 'properties': {"spark.executor.memory": "2g", "spark.executor.instances": 1}}
+
+        assert app.yarn_submission("application_1_0001", dict(spark, jars={})) is None
+        context = app.yarn_submission("application_1_0001", spark)
+        command = context['am-container-spec']['commands']['command']
+        assert "-Xmx2048m" in command
+        assert "-Dspark.executor.instances=8 -Dspark.executor.memory=2g" in command
+        assert "-Dspark.yarn.executor.nodeLabelExpression=slot1" in command
+        assert "--class JarClassK --jar __app__.jar --arg arg1 --arg hdfs:///tmp/" in command
+        assert context['resource'] == {'memory': 2048 + 384, 'vCores': 1}
+
     def test_is_a_copy_of(self):
         app = SparkApplication("app", 8, jar="jar", args=["arg1"])
         app1 = SparkApplication("app", 8, jar="jar", args=["arg1"])
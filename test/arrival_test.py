@@ -0,0 +1,56 @@
+from arrival import *
+import numpy as np
+import pytest
+
+
+class TestPoisson:
+    def test_rate(self):
+        times = np.array(list(Poisson(0.5, seed=0).times(20000)))
+
+        assert np.all(np.diff(times) >= 0)
+        assert np.isclose(len(times) / times[-1], 0.5, rtol=0.05)
+
+    def test_seed(self):
+        assert list(Poisson(1., seed=3).times(10)) == list(Poisson(1., seed=3).times(10))
+        assert list(Poisson(1., seed=3).times(10)) != list(Poisson(1., seed=4).times(10))
+
+    def test_error(self):
+        with pytest.raises(ValueError):
+            Poisson(0)
+
+
+class TestDiurnal:
+    def test_rate(self):
+        process = Diurnal(0.1, amplitude=0.8, period=1000., seed=0)
+        times = np.array(list(process.times(20000)))
+        phases = times % 1000.
+
+        # more arrivals in the first half of the period, when the sine is positive
+        assert np.mean(phases < 500) > 0.7
+        assert np.isclose(len(times) / times[-1], process.mean_rate(), rtol=0.05)
+
+
+class TestMMPP:
+    def test_rate(self):
+        process = MMPP([1., 0.], [10., 30.], seed=0)
+        times = np.array(list(process.times(20000)))
+
+        assert process.mean_rate() == 0.25
+        assert np.isclose(len(times) / times[-1], 0.25, rtol=0.1)
+        # bursts: the gaps are much more spread than the exponential ones of a Poisson process
+        gaps = np.diff(times)
+        assert np.std(gaps) > 2 * np.mean(gaps)
+
+
+class TestTrace:
+    def test_replay(self):
+        process = Trace([5., 0., 10.], scale=2.)
+
+        assert list(process.times(5)) == [0., 10., 20., 20., 20.]
+        assert process.mean_rate() == 0.1
+
+    def test_path(self, tmpdir):
+        path = tmpdir.join("trace.csv")
+        path.write("# time,name\n1.5,SVM\n3,Sort\n")
+
+        assert list(Trace(path=str(path)).times(2)) == [1.5, 3.]
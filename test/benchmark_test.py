@@ -0,0 +1,52 @@
+from benchmark import *
+import pytest
+
+
+class TestBenchmark:
+    def test_measure(self):
+        calls = []
+        result = measure(lambda: calls.append(1), min_time=0.01, repeat=3)
+
+        assert result['repeat'] == 3
+        assert result['number'] >= 1
+        assert 0 < result['min'] <= result['mean']
+        assert len(calls) >= result['number'] * result['repeat']
+
+    def test_gen_cluster(self):
+        cluster = gen_cluster(10)
+
+        assert cluster.available_containers() == 40
+        assert len(cluster.scheduled_applications()) == 5
+
+    def test_run(self, tmpdir):
+        results = run(quick=True, pattern="Cluster.applications[nodes=10,")
+
+        assert sorted(results.keys()) == [
+            "Cluster.applications[nodes=10,with_full_nodes=False]",
+            "Cluster.applications[nodes=10,with_full_nodes=True]",
+        ]
+
+        path = str(tmpdir.join("results.json"))
+        save(results, path)
+        assert load(path) == results
+
+    def test_scheduling_cases(self):
+        results = run(quick=True, pattern="nodes=10,queue=10]")
+
+        assert len(results) == 3
+        assert all(result['min'] > 0 for result in results.values())
+
+    def test_compare(self):
+        baseline = {
+            "a": {'min': 1.},
+            "b": {'min': 1.},
+            "c": {'min': 1.},
+        }
+        results = {
+            "a": {'min': 1.1},
+            "b": {'min': 1.5},
+            "d": {'min': 9.},
+        }
+
+        assert compare(results, baseline) == ["b"]
+        assert compare(results, baseline, tolerance=0.05) == ["a", "b"]
@@ -0,0 +1,94 @@
+from clock import *
+import threading
+
+
+class TestVirtualClock:
+    def test_run_in_order(self):
+        clock = VirtualClock()
+        result = []
+
+        clock.call_later(3, result.append, 3)
+        clock.call_later(1, result.append, 1)
+        clock.call_at(2, result.append, 2)
+
+        assert clock.run() == 3
+        assert [1, 2, 3] == result
+
+    def test_sleep_delays_events(self):
+        clock = VirtualClock()
+        result = []
+
+        def action():
+            clock.sleep(5)
+            result.append(clock.time())
+
+        clock.call_later(1, action)
+        clock.call_later(2, lambda: result.append(clock.time()))
+        clock.run()
+
+        assert [6, 6] == result
+
+    def test_timer(self):
+        clock = VirtualClock()
+        result = []
+
+        timer = clock.timer(10, lambda: result.append(clock.time()))
+        timer.start()
+        clock.call_later(35, timer.cancel)
+        clock.run()
+
+        assert [10, 20, 30] == result
+
+    def test_timer_does_not_keep_clock_alive(self):
+        clock = VirtualClock()
+        clock.timer(10, lambda: None).start()
+        clock.call_later(25, lambda: None)
+
+        assert clock.run() == 25
+
+
+class TestAsyncioClock:
+    def test_events_on_loop_thread(self):
+        clock = AsyncioClock()
+        result = []
+
+        def blocking(x):
+            result.append(("blocking", threading.current_thread() is threading.main_thread()))
+            return x * 2
+
+        def callback(x):
+            result.append(("callback", x, threading.current_thread() is threading.main_thread()))
+            clock.stop()
+
+        clock.call_later(0.01, clock.run_blocking, callback, blocking, 21)
+        clock.run()
+
+        assert [("blocking", False), ("callback", 42, True)] == result
+
+    def test_run_blocking_error(self):
+        clock = AsyncioClock()
+        result = []
+
+        def callback(x):
+            result.append(x)
+            clock.stop()
+
+        clock.call_later(0, clock.run_blocking, callback, lambda: 1 / 0)
+        clock.run()
+
+        assert [None] == result
+
+    def test_timer(self):
+        clock = AsyncioClock()
+        result = []
+        timer = clock.timer(0.01, lambda: result.append(1))
+
+        def stop():
+            timer.cancel()
+            clock.stop()
+
+        timer.start()
+        clock.call_later(0.055, stop)
+        clock.run()
+
+        assert 4 <= len(result) <= 6
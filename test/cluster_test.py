@@ -1,8 +1,9 @@
 import pytest
+import numpy as np
 from cluster import *
 from application import DummyApplication
-from resource_manager import DummyRM
-from stat_collector import DummyStatCollector
+from resource_manager import DummyRM, NodeReport
+from stat_collector import DummyStatCollector, UsageFrame
 
 
 class TestNode:
@@ -48,6 +49,29 @@ class TestNode:
 
         assert node.available_containers() == 2
 
+    def test_remove_application(self):
+        node, apps = self.gen_node(6)
+        node.add_container(apps[0])
+        other = Node("other", 8)
+        other.add_container(apps[0].tasks[2])
+        node.remove_application(apps[0])
+
+        assert node.available_containers() == 4
+        assert [t.node for t in apps[0].tasks[:3]] == [None, None, other]
+        assert apps[0].node is None and apps[0].placed_tasks() == 1
+        assert node.containers == [apps[1].tasks[0], apps[1].tasks[1], apps[2].tasks[0], apps[2].tasks[1]]
+
+    def test_compact(self):
+        node = Node("test", 64)
+        app = DummyApplication(n_tasks=64)
+        for task in app.tasks:
+            node.add_container(task)
+
+        # only the counts are kept, and no task needs a dict
+        assert node._containers == {app: 64}
+        assert not hasattr(app.tasks[0], '__dict__')
+        assert app.tasks[3] == app.tasks[3] and app.tasks[3].node is node
+
 
 class TestCluster:
     @staticmethod
@@ -117,6 +141,25 @@ class TestCluster:
             assert set(expected_result[i][0]) == set(result[0])
             assert isinstance(result[1], Usage)
 
+    def test_apps_rates(self):
+        cluster = Cluster(DummyRM(n_nodes=4, n_containers=4), DummyStatCollector(), application_master=None)
+        addresses = sorted(cluster.nodes.keys())
+        apps = [DummyApplication(name="app{}".format(i), id=str(i), is_running=True) for i in range(3)]
+        for address, app in zip(addresses, apps):
+            cluster.nodes[address].add_container(app.containers[0])
+        mean_usage = UsageFrame(addresses, [
+            [0.5, 0., 0., 0., 0., 0.],
+            [0.01, 0.01, 1., 1., 0., 0.],
+            [0., 0.5, 0., 0., 1., 1.],
+            [1., 1., 1., 1., 1., 1.],
+        ])
+
+        result = cluster.apps_rates(mean_usage)
+
+        # the second node is idle, the last one has no application
+        assert [apps for apps, _ in result] == [[apps[0]], [apps[2]]]
+        assert [rate for _, rate in result] == [mean_usage[addresses[i]].rate() for i in (0, 2)]
+
     def test_applications_without_full_node(self):
         cluster, apps = self.gen_cluster_with_apps()
 
@@ -163,3 +206,151 @@ class TestCluster:
 
 
 
+class TestClusterIndexes:
+    names = ["WordCount", "SVM", "PageRank", "TPCH", "KMeans"]
+
+    @staticmethod
+    def gen_cluster(n_nodes=6, n_containers=4):
+        rm = DummyRM(n_nodes=n_nodes, n_containers=n_containers)
+        return Cluster(rm, DummyStatCollector(), application_master=None)
+
+    @staticmethod
+    def brute_force_applications(cluster, with_full_nodes, by_name):
+        apps = {}
+        for node in cluster.nodes.values():
+            if node.available_containers() > 0 or with_full_nodes:
+                for app in node.applications(by_name=by_name):
+                    key = getattr(app, 'name' if by_name else 'id')
+                    apps[key] = apps.get(key, 0) + 1
+        return apps
+
+    def check(self, cluster):
+        assert cluster.available_containers() == sum(n.available_containers() for n in cluster.nodes.values())
+        assert cluster.has_application_scheduled() == any(
+            len(n.applications()) > 0 for n in cluster.nodes.values()
+        )
+        for with_full_nodes in (True, False):
+            for by_name in (True, False):
+                applications, weights = cluster.applications(with_full_nodes=with_full_nodes, by_name=by_name)
+                key = 'name' if by_name else 'id'
+                result = {getattr(app, key): weight for app, weight in zip(applications, weights)}
+                assert self.brute_force_applications(cluster, with_full_nodes, by_name) == result
+
+    def test_random_operations(self):
+        np.random.seed(0)
+        cluster = self.gen_cluster()
+        scheduled = []
+
+        for i in range(200):
+            if len(scheduled) > 0 and (cluster.available_containers() == 0 or np.random.uniform() < 0.4):
+                app = scheduled.pop(np.random.randint(0, len(scheduled)))
+                cluster.remove_applications(app)
+                assert all(task.node is None for task in app.tasks)
+            else:
+                app = DummyApplication(name=self.names[i % len(self.names)], id=str(i), n_tasks=3)
+                for task in app.tasks:
+                    nodes = cluster.non_full_nodes()
+                    if len(nodes) == 0:
+                        break
+                    nodes[np.random.randint(0, len(nodes))].add_container(task)
+                scheduled.append(app)
+            self.check(cluster)
+
+    def test_remove_application(self):
+        cluster = self.gen_cluster(2, 4)
+        app0 = DummyApplication(name="WordCount", id="0", n_tasks=4)
+        app1 = DummyApplication(name="SVM", id="1", n_tasks=4)
+        for i in range(4):
+            cluster.nodes["N{}".format(i % 2)].add_container(app0.tasks[i])
+            cluster.nodes["N{}".format(i % 2)].add_container(app1.tasks[i])
+
+        assert cluster.available_containers() == 0
+        assert {"N0": 2, "N1": 2} == cluster.application_nodes(app0)
+
+        cluster.remove_applications(app0)
+
+        assert cluster.available_containers() == 4
+        assert [app1] == cluster.scheduled_applications()
+        assert [] == cluster.nodes["N0"].applications(by_name=True, is_running=True)
+        assert [app1] == cluster.nodes["N0"].applications()
+        assert len(cluster.nodes["N0"].containers) == 2
+
+
+class TestReconcile:
+    @staticmethod
+    def gen_cluster():
+        cluster = Cluster(DummyRM(n_nodes=3, n_containers=4), DummyStatCollector(), application_master=None)
+        app = DummyApplication(id="A", name="App0", is_running=True)
+        for i in range(3):
+            cluster.nodes["N0"].add_container(app.containers[i])
+        cluster.nodes["N1"].add_container(app.containers[3])
+        return cluster, app
+
+    @staticmethod
+    def check_indexes(cluster):
+        assert cluster.available_containers() == sum(n.available_containers() for n in cluster.nodes.values())
+        assert cluster._n_containers == sum(n.n_containers for n in cluster.nodes.values())
+
+    def test_unchanged(self):
+        cluster, _ = self.gen_cluster()
+        cluster.reconcile()
+
+        assert [n.n_containers for n in cluster.nodes.values()] == [4, 4, 4]
+        assert cluster.available_containers() == 8
+
+    def test_join_and_leave(self):
+        cluster, app = self.gen_cluster()
+        cluster.reconcile({"N0": NodeReport(4, 3), "N3": NodeReport(8), "N4": NodeReport(8, healthy=False)})
+
+        # N2 is empty, N1 still runs a container
+        assert sorted(cluster.nodes.keys()) == ["N0", "N1", "N3"]
+        assert cluster.nodes["N1"].available_containers() == 0
+        assert cluster.available_containers() == 1 + 8
+        self.check_indexes(cluster)
+
+        cluster.remove_applications(app)
+        cluster.reconcile({"N0": NodeReport(4), "N3": NodeReport(8)})
+        assert sorted(cluster.nodes.keys()) == ["N0", "N3"]
+        assert cluster.available_containers() == 12
+        self.check_indexes(cluster)
+
+    def test_other_tenants(self):
+        cluster, app = self.gen_cluster()
+        # 3 vcores of N0 are used by the application, 1 by another one, 2 of N2 by another one
+        cluster.reconcile({"N0": NodeReport(4, 4), "N1": NodeReport(4, 1), "N2": NodeReport(4, 2)})
+
+        assert cluster.nodes["N0"].available_containers() == 0
+        assert cluster.nodes["N1"].available_containers() == 3
+        assert cluster.nodes["N2"].available_containers() == 2
+        self.check_indexes(cluster)
+        # N0 is full now
+        assert cluster._open_nodes == {app: 1, app.name: 1}
+
+        cluster.reconcile({"N0": NodeReport(4, 3), "N1": NodeReport(4, 1), "N2": NodeReport(4)})
+        assert cluster.nodes["N0"].available_containers() == 1
+        assert cluster.nodes["N2"].available_containers() == 4
+        assert cluster._open_nodes == {app: 2, app.name: 2}
+        self.check_indexes(cluster)
+
+    def test_never_below_placed(self):
+        # the application is not running yet, its containers are not allocated by the RM
+        cluster, app = self.gen_cluster()
+        app.is_running = False
+        cluster.reconcile({"N0": NodeReport(2), "N1": NodeReport(4), "N2": NodeReport(4, healthy=False)})
+
+        assert cluster.nodes["N0"].n_containers == 3
+        assert cluster.nodes["N2"].n_containers == 0
+        assert cluster.available_containers() == 3
+        self.check_indexes(cluster)
+
+    def test_memory(self, monkeypatch):
+        monkeypatch.setattr(Cluster, 'container_memory', 1024)
+        cluster, _ = self.gen_cluster()
+        cluster.reconcile({
+            "N0": NodeReport(4, 3, memory=8192, used_memory=3072),
+            "N1": NodeReport(4, 1, memory=2048, used_memory=1024),
+            "N2": NodeReport(4, 0, memory=8192, used_memory=5000),
+        })
+
+        assert [cluster.nodes[a].available_containers() for a in ["N0", "N1", "N2"]] == [1, 1, 0]
+        self.check_indexes(cluster)
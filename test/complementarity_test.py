@@ -102,3 +102,191 @@ class TestGradientEstimation:
 
 if __name__ == '__main__':
     TestGradientEstimation().main()
+
+
+class TestUpdateBatch:
+    names = ["WordCount", "KMeans", "LinearRegression", "LogisticRegression", "SVM",
+             "SortedWordCount", "PageRank", "TPCH", "Sort", "ConnectedComponent"]
+
+    @staticmethod
+    def sequential_update(estimation, app, concurrent_apps, rate):
+        # update_app before update_batch
+        app = estimation.indices(app)
+        concurrent_apps = estimation.indices(concurrent_apps)
+        if isinstance(estimation, EpsilonGreedy):
+            ix = np.ix_(app, concurrent_apps)
+            estimation.update_count[ix] += 1
+            estimation.average[ix] += (rate - estimation.average[ix]) / estimation.update_count[ix]
+            return
+
+        estimation.update_count[app] += 1
+        estimation.average[app] += (rate - estimation.average[app]) / estimation.update_count[app]
+        other_apps = np.delete(estimation._columns(), concurrent_apps)
+        exp = np.exp(estimation.preferences[app])
+        ap_concurrent = (exp[:, concurrent_apps].T / exp.sum(axis=1)).T
+        ap_other = (exp[:, other_apps].T / exp.sum(axis=1)).T
+        constant = estimation.alpha * (rate - estimation.average[app])
+        estimation.preferences[np.ix_(app, concurrent_apps)] += constant * (1 - ap_concurrent)
+        estimation.preferences[np.ix_(app, other_apps)] -= constant * ap_other
+
+    def gen_nodes(self, n_nodes=30, seed=0):
+        random = np.random.RandomState(seed)
+        nodes = []
+        for _ in range(n_nodes):
+            apps = [DummyApplication(self.names[i]) for i in random.randint(0, len(self.names), random.randint(1, 5))]
+            nodes.append((apps, random.uniform(0, 3)))
+        return nodes
+
+    def check(self, estimation_class, **kwargs):
+        recurrent_apps = [DummyApplication(name) for name in self.names]
+        expected = estimation_class(recurrent_apps, **kwargs)
+        estimation = estimation_class(recurrent_apps, **kwargs)
+
+        for tick in range(3):
+            nodes = self.gen_nodes(seed=tick)
+            for apps, rate in nodes:
+                for out in range(len(apps)):
+                    self.sequential_update(expected, apps[out], apps[:out] + apps[out + 1:], rate)
+            estimation.update_batch(*estimation.leave_one_out(nodes))
+
+        assert np.allclose(expected.average, estimation.average, rtol=0, atol=1e-12)
+        assert expected.update_count.tolist() == estimation.update_count.tolist()
+        if hasattr(expected, 'preferences'):
+            assert np.allclose(expected.preferences, estimation.preferences, rtol=0, atol=1e-12)
+
+    def test_epsilon_greedy(self):
+        self.check(EpsilonGreedy, initial_average=1)
+
+    def test_gradient(self):
+        self.check(Gradient, alpha=0.5)
+
+    def test_group_gradient(self):
+        self.check(GroupGradient, alpha=0.5)
+
+    def test_leave_one_out(self):
+        estimation = EpsilonGreedy([DummyApplication(name) for name in self.names])
+        wc, km = DummyApplication("WordCount"), DummyApplication("KMeans")
+        app_indices, masks, rates = estimation.leave_one_out([([wc, wc, km], 2.), ([km], 1.)])
+
+        assert app_indices.tolist() == estimation.indices([wc, wc, km, km])
+        assert [np.flatnonzero(m).tolist() for m in masks] == [
+            sorted(estimation.indices([wc, km])),
+            sorted(estimation.indices([wc, km])),
+            estimation.indices([wc]),
+            [],
+        ]
+        assert rates.tolist() == [2., 2., 2., 1.]
+
+    def test_update_app(self):
+        recurrent_apps = [DummyApplication(name) for name in self.names]
+        expected = Gradient(recurrent_apps, alpha=0.5)
+        estimation = Gradient(recurrent_apps, alpha=0.5)
+        for apps, rate in self.gen_nodes():
+            self.sequential_update(expected, apps[0], apps[1:], rate)
+            estimation.update_app(apps[0], apps[1:], rate)
+
+        assert np.allclose(expected.preferences, estimation.preferences, rtol=0, atol=1e-12)
+
+
+class TestCachedProbabilities:
+    names = TestUpdateBatch.names
+
+    @staticmethod
+    def softmax(preferences):
+        exp = np.exp(preferences - preferences.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def test_cache_follows_updates(self):
+        for estimation_class in (Gradient, GroupGradient):
+            estimation = estimation_class([DummyApplication(name) for name in self.names], alpha=0.5)
+            for tick in range(3):
+                estimation.update_batch(*estimation.leave_one_out(TestUpdateBatch().gen_nodes(seed=tick)))
+
+            assert np.allclose(estimation._probabilities, self.softmax(estimation.preferences), rtol=0, atol=1e-12)
+
+    def test_large_preferences(self):
+        recurrent_apps = [DummyApplication(name) for name in self.names]
+        estimation = Gradient(recurrent_apps, alpha=0.5)
+        preferences = np.full(estimation.shape, 1000.)
+        preferences[:, 0] = 2000.
+        estimation.preferences = preferences
+        estimation.update_app(recurrent_apps[0], recurrent_apps[1:3], 2.)
+
+        assert np.all(np.isfinite(estimation.preferences))
+        p = estimation.normalized_action_probabilities(recurrent_apps[:1], recurrent_apps)
+        assert np.all(np.isfinite(p))
+        assert np.isclose(p.sum(), 1.)
+
+    def test_underflow(self):
+        # the probabilities of the candidates all underflow, they are compared in the log domain
+        recurrent_apps = [DummyApplication(name) for name in self.names]
+        for estimation_class in (Gradient, SparseGradient):
+            estimation = estimation_class(recurrent_apps)
+            columns = estimation.indices(recurrent_apps[1:3])
+            preferences = np.zeros(estimation.shape)
+            preferences[:, columns] = [-2000., -2001.]
+            estimation.preferences = preferences
+            p = estimation.normalized_action_probabilities(recurrent_apps[:1], recurrent_apps[1:3])
+
+            assert np.allclose(p, self.softmax(np.array([[0., -1.]]))[0])
+
+
+class TestSparseEstimation:
+    names = TestUpdateBatch.names
+
+    def check(self, dense_class, sparse_class, **kwargs):
+        recurrent_apps = [DummyApplication(name) for name in self.names]
+        dense = dense_class(recurrent_apps, **kwargs)
+        sparse = sparse_class(recurrent_apps, **kwargs)
+
+        for tick in range(3):
+            nodes = TestUpdateBatch().gen_nodes(seed=tick)
+            dense.update_batch(*dense.leave_one_out(nodes))
+            sparse.update_batch(*sparse.leave_one_out(nodes))
+        apps, rate = TestUpdateBatch().gen_nodes(n_nodes=1, seed=3)[0]
+        dense.update_app(apps[0], apps[1:], rate)
+        sparse.update_app(apps[0], apps[1:], rate)
+
+        assert np.allclose(dense.average, sparse.average, rtol=0, atol=1e-12)
+        assert dense.update_count.tolist() == sparse.update_count.tolist()
+        return dense, sparse
+
+    def test_epsilon_greedy(self):
+        dense, sparse = self.check(EpsilonGreedy, SparseEpsilonGreedy, initial_average=1)
+        scheduled, apps = [DummyApplication("KMeans"), DummyApplication("SVM")], [DummyApplication(n) for n in self.names]
+        assert np.allclose(dense.expected_rates(scheduled, apps), sparse.expected_rates(scheduled, apps))
+
+    def test_gradient(self):
+        dense, sparse = self.check(Gradient, SparseGradient, alpha=0.5)
+        assert np.allclose(dense.preferences, sparse.preferences, rtol=0, atol=1e-12)
+        scheduled, apps = [DummyApplication("KMeans"), DummyApplication("SVM")], [DummyApplication(n) for n in self.names]
+        assert np.allclose(
+            dense.normalized_action_probabilities(scheduled, apps),
+            sparse.normalized_action_probabilities(scheduled, apps),
+            rtol=0, atol=1e-12
+        )
+
+    def test_observed_pairs(self):
+        names = ["App{}".format(i) for i in range(1000)]
+        estimation = SparseGradient([DummyApplication(name) for name in names], alpha=0.5)
+        assert estimation.n_pairs() == 0
+        for rate in (1., 2.):
+            estimation.update_batch(*estimation.leave_one_out([
+                ([DummyApplication("App1"), DummyApplication("App2")], rate),
+                ([DummyApplication("App3")], rate),
+            ]))
+
+        assert estimation.n_pairs() == 2
+        p = estimation.normalized_action_probabilities([DummyApplication("App1")], [DummyApplication(n) for n in names])
+        assert np.isclose(p.sum(), 1.)
+        assert p.argmax() == names.index("App2")
+
+    def test_save_load(self, tmpdir):
+        for sparse_class in (SparseEpsilonGreedy, SparseGradient):
+            _, sparse = self.check(sparse_class, sparse_class)
+            sparse.save(str(tmpdir))
+            loaded = sparse_class([DummyApplication(name) for name in self.names])
+            loaded.load(str(tmpdir))
+
+            assert sorted(loaded._items()) == sorted(sparse._items())
+            assert np.allclose(loaded.average, sparse.average)
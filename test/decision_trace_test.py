@@ -0,0 +1,55 @@
+from decision_trace import *
+from clock import VirtualClock
+import gzip
+import json
+import os
+import numpy as np
+import pytest
+
+
+def read(path):
+    with (gzip.open(path, "rt") if path.endswith(".gz") else open(path)) as f:
+        return [json.loads(line) for line in f]
+
+
+class TestDecisionTrace:
+    def test_off(self, tmpdir):
+        path = str(tmpdir.join("trace.jsonl"))
+        trace = DecisionTrace(path, OFF)
+        trace.info("scheduler.round", round=1)
+        trace.close()
+
+        assert not trace.enabled(INFO)
+        assert not os.path.exists(path)
+        assert not DecisionTrace(None, DEBUG).enabled(INFO)
+
+    def test_levels(self, tmpdir):
+        path = str(tmpdir.join("trace.jsonl"))
+        trace = DecisionTrace(path, INFO, clock=VirtualClock(42))
+        trace.debug("estimation.groups", groups=[1, 2])
+        trace.info("scheduler.round", round=1)
+        trace.close()
+
+        assert trace.enabled(INFO) is False
+        assert read(path) == [{"t": 42., "level": "info", "event": "scheduler.round", "round": 1}]
+
+    def test_numpy_fields(self, tmpdir):
+        path = str(tmpdir.join("trace.jsonl.gz"))
+        trace = DecisionTrace(path, DEBUG, batch_size=2)
+        for i in range(5):
+            trace.debug("estimation.best_group", group=np.int64(i), probabilities=np.array([0.25, 0.75]))
+        trace.close()
+
+        records = read(path)
+        assert [r["group"] for r in records] == list(range(5))
+        assert all(r["probabilities"] == [0.25, 0.75] for r in records)
+
+    def test_configure(self, tmpdir):
+        path = str(tmpdir.join("trace.jsonl"))
+        configure(path, "debug")
+        assert enabled(DEBUG)
+        debug("cluster.nodes", nodes={"N0": ["app"]})
+        configure(None)
+
+        assert not enabled(INFO)
+        assert read(path)[0]["nodes"] == {"N0": ["app"]}
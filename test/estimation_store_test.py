@@ -0,0 +1,150 @@
+from estimation_store import *
+from application import DummyApplication
+from complementarity import EpsilonGreedy, Gradient, SparseGradient
+import os
+import numpy as np
+import pytest
+
+NAMES = ["WordCount", "KMeans", "LinearRegression", "LogisticRegression", "SVM", "PageRank", "Sort"]
+
+
+def gen_batches(estimation, n, seed=0):
+    random = np.random.RandomState(seed)
+    batches = []
+    for _ in range(n):
+        nodes = [
+            ([DummyApplication(NAMES[i]) for i in random.randint(0, len(NAMES), random.randint(1, 4))],
+             random.uniform(0, 3))
+            for _ in range(5)
+        ]
+        batches.append(estimation.leave_one_out(nodes))
+    return batches
+
+
+def recurrent_apps():
+    return [DummyApplication(name) for name in NAMES]
+
+
+class TestEstimationStore:
+    def check(self, estimation_class, folder, n_updates=7, compact_every=3, **kwargs):
+        expected = estimation_class(recurrent_apps(), **kwargs)
+        estimation = estimation_class(recurrent_apps(), **kwargs)
+        store = EstimationStore(folder, estimation, compact_every, sync=False)
+        for batch in gen_batches(estimation, n_updates):
+            expected.update_batch(*batch)
+            store.update(*batch)
+
+        # no close, as if the scheduler crashed
+        restored = estimation_class(recurrent_apps(), **kwargs)
+        assert load(restored, folder) == n_updates
+        assert np.allclose(expected.average, restored.average, rtol=0, atol=1e-12)
+        if hasattr(expected, "preferences"):
+            assert np.allclose(expected.preferences, restored.preferences, rtol=0, atol=1e-12)
+        return store, restored
+
+    def test_restore(self, tmpdir):
+        self.check(EpsilonGreedy, str(tmpdir.join("epsilon_greedy")), initial_average=1)
+        self.check(Gradient, str(tmpdir.join("gradient")), alpha=0.5)
+        self.check(SparseGradient, str(tmpdir.join("sparse_gradient")), alpha=0.5)
+
+    def test_compaction(self, tmpdir):
+        folder = str(tmpdir)
+        store, _ = self.check(Gradient, folder, n_updates=7, compact_every=3)
+
+        snapshot, seq = read_current(folder)
+        assert seq == 6
+        assert [name for name in os.listdir(folder) if name.startswith("snapshot-")] == ["snapshot-6"]
+        assert [record["seq"] for record in read_wal(folder)] == [7]
+
+        store.close()
+        assert read_current(folder)[1] == 7
+        assert read_wal(folder) == []
+
+    def test_torn_record(self, tmpdir):
+        folder = str(tmpdir)
+        estimation = Gradient(recurrent_apps(), alpha=0.5)
+        store = EstimationStore(folder, estimation, compact_every=10, sync=False)
+        batches = gen_batches(estimation, 2)
+        store.update(*batches[0])
+        store.update(*batches[1])
+        with open(os.path.join(folder, WAL), "a") as f:
+            f.write('{"seq": 3, "rows": [0')
+
+        expected = Gradient(recurrent_apps(), alpha=0.5)
+        expected.update_batch(*batches[0])
+        expected.update_batch(*batches[1])
+        restored = Gradient(recurrent_apps(), alpha=0.5)
+        assert load(restored, folder) == 2
+        assert np.allclose(expected.preferences, restored.preferences, rtol=0, atol=1e-12)
+
+    def test_restart(self, tmpdir):
+        # the restarted store continues the sequence of the folder it was loaded from
+        folder = str(tmpdir)
+        self.check(EpsilonGreedy, folder, n_updates=4, compact_every=3)
+        estimation = EpsilonGreedy(recurrent_apps())
+        load(estimation, folder)
+        store = EstimationStore(folder, estimation, compact_every=3, sync=False)
+        assert store.seq == 4
+
+        expected = EpsilonGreedy(recurrent_apps())
+        load(expected, folder)
+        batch = gen_batches(estimation, 1, seed=1)[0]
+        expected.update_batch(*batch)
+        store.update(*batch)
+
+        restored = EpsilonGreedy(recurrent_apps())
+        assert load(restored, folder) == 5
+        assert np.allclose(expected.average, restored.average, rtol=0, atol=1e-12)
+
+    def test_crash_during_compaction(self, tmpdir):
+        # restarted with an empty log, the first snapshot has the sequence number of the current one
+        folder = str(tmpdir)
+        store, _ = self.check(Gradient, folder, alpha=0.5)
+        store.close()
+        expected = Gradient(recurrent_apps(), alpha=0.5)
+        load(expected, folder)
+
+        estimation = Gradient(recurrent_apps(), alpha=0.5)
+        load(estimation, folder)
+        store = EstimationStore(folder, estimation, compact_every=3, sync=False)
+
+        def crash(path):
+            os.makedirs(path)
+            raise OSError("crash")
+        estimation.save = crash
+        with pytest.raises(OSError):
+            store.compact()
+
+        restored = Gradient(recurrent_apps(), alpha=0.5)
+        assert load(restored, folder) == 7
+        assert np.allclose(expected.preferences, restored.preferences, rtol=0, atol=1e-12)
+
+        del estimation.save
+        store.compact()
+        snapshot, seq = read_current(folder)
+        # the partial snapshot of the crash is removed with the previous one
+        assert seq == 7 and os.path.basename(snapshot) == "snapshot-7.2"
+        assert [name for name in os.listdir(folder) if name.startswith("snapshot-")] == ["snapshot-7.2"]
+
+    def test_memory_mapped(self, tmpdir):
+        folder = str(tmpdir)
+        store, _ = self.check(EpsilonGreedy, folder)
+        store.close()
+        restored = EpsilonGreedy(recurrent_apps())
+        load(restored, folder)
+
+        assert isinstance(restored.average, np.memmap)
+        restored.update_batch(*gen_batches(restored, 1)[0])
+        snapshot, _ = read_current(folder)
+        assert not np.allclose(np.load(os.path.join(snapshot, "average.npy")), restored.average)
+
+    def test_saved_folder(self, tmpdir):
+        folder = str(tmpdir)
+        estimation = Gradient(recurrent_apps(), alpha=0.5)
+        for batch in gen_batches(estimation, 3):
+            estimation.update_batch(*batch)
+        estimation.save(folder)
+
+        restored = Gradient(recurrent_apps(), alpha=0.5)
+        assert load(restored, folder) == 0
+        assert np.allclose(estimation.preferences, restored.preferences)
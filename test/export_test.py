@@ -0,0 +1,206 @@
+from export import *
+from application import DummyApplication
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import json
+import threading
+import pytest
+
+
+class FakeInfluxDB(ThreadingHTTPServer):
+    # answers every /query with the chunks of its series, after failing the first failures ones
+    def __init__(self, chunks, failures=0):
+        super().__init__(("127.0.0.1", 0), FakeInfluxDBHandler)
+        self.chunks = chunks
+        self.failures = failures
+        self.queries = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class FakeInfluxDBHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.queries.append(parse_qs(urlparse(self.path).query))
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = "".join(
+            json.dumps({'results': [{'statement_id': i, 'series': chunk, 'partial': True}]}) + "\n"
+            for i, chunk in enumerate(self.server.chunks)
+        ).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+T0 = epoch("2019-01-01T00:00:00Z")
+
+
+def series(name, host, columns, *values):
+    return {
+        'name': name,
+        'tags': {'host': host},
+        'columns': ['time'] + columns,
+        'values': [[T0 + t] + list(v) for t, *v in values],
+    }
+
+
+CHUNKS = [
+    [series('cpu', 'node1', ['cpu', 'io_wait'], (0, 10., 1.), (10, 20., 2.))],
+    [series('cpu', 'node1', ['cpu', 'io_wait'], (20, 30., 3.)),
+     series('cpu', 'node2', ['cpu', 'io_wait'], (0, 40., None), (30, 50., 5.))],
+    [series('diskio', 'node2', ['dsk_read', 'dsk_write'], (10, 100., 200.))],
+    [series('net', 'node3', ['net_recv', 'net_sent'], (10, 1., 1.))],
+]
+
+
+@pytest.fixture
+def influxdb():
+    server = FakeInfluxDB(CHUNKS)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def exporter(influxdb, folder, **kwargs):
+    client = InfluxDBClient("127.0.0.1", influxdb.port, "root", "root", "telegraf")
+    return Exporter(client, folder, **kwargs)
+
+
+def archive_time(t):
+    return datetime.datetime.utcfromtimestamp(T0 + t)
+
+
+def application(app_id, name, start, end, nodes):
+    app = DummyApplication(name, id=app_id)
+    app.start_at = archive_time(start)
+    app.end_at = archive_time(end)
+    app.nodes = set(nodes)
+    return app
+
+
+def read(path):
+    with gzip.open(path, 'rt') as file:
+        return file.read().splitlines()
+
+
+class TestMetricsArchive:
+    def archive(self):
+        return MetricsArchive.from_series(["node1", "node2"], [s for chunk in CHUNKS for s in chunk])
+
+    def test_from_series(self):
+        archive = self.archive()
+        cpu = archive.metrics.index('cpu')
+
+        assert (archive.times - T0).tolist() == [0, 10, 20, 30]
+        assert archive.values.shape == (2, len(MetricsArchive.metrics), 4)
+        assert archive.values[0, cpu, :3].tolist() == [10., 20., 30.] and np.isnan(archive.values[0, cpu, 3])
+        assert np.isnan(archive.values[1, archive.metrics.index('io_wait'), 0])
+        assert archive.values[1, archive.metrics.index('dsk_write'), 1] == 200.
+
+    def test_view(self):
+        archive = self.archive()
+        archive.add_application("A1", "SVM", archive_time(15), archive_time(25), ["node2", "node4"])
+        view = archive.application("A1")
+
+        assert view.hosts == ["node2"]
+        assert (view.times - T0).tolist() == [10, 20]
+        assert view.values[0, view.metrics.index('dsk_read')].tolist()[0] == 100.
+
+    def test_total(self):
+        total = self.archive().total()
+        metrics = MetricsArchive.metrics
+
+        assert total[metrics.index('cpu')].tolist() == [25., 20., 30., 50.]
+        assert total[metrics.index('dsk_read')][1] == 100.
+        assert np.isnan(total[metrics.index('dsk_read')][0])
+
+    def test_save_load(self, tmpdir):
+        archive = self.archive()
+        archive.add_application("A1", "SVM", archive_time(0), archive_time(10), ["node1"])
+        path = str(tmpdir.join("metrics.npz"))
+        archive.save(path)
+        loaded = MetricsArchive.load(path)
+
+        assert loaded.hosts == archive.hosts
+        assert np.array_equal(loaded.values, archive.values, equal_nan=True)
+        assert loaded.applications == {"A1": ("SVM", T0, T0 + 10, ["node1"])}
+
+
+class TestExporter:
+    def test_export(self, influxdb, tmpdir):
+        e = exporter(influxdb, str(tmpdir), chunk_size=2)
+        e.add_application(application("A1", "SVM", 5, 25, ["node1"]))
+        e.add_application(application("A2", "KMeans", 0, 40, ["node1", "node2"]))
+        e.export_experiment("exp", ["node1", "node2", "node3"], "2019-01-01T00:00:00Z", "2019-01-01T00:00:30Z")
+        e.close()
+
+        # one query for the experiment and its applications
+        assert len(influxdb.queries) == 1
+        query = influxdb.queries[0]
+        assert query['chunked'] == ['true'] and query['chunk_size'] == ['2'] and query['epoch'] == ['s']
+        assert "host =~ /^(node1|node2|node3)$/" in query['q'][0]
+        # widened to the end of A2
+        assert "time < '2019-01-01T00:00:40Z'" in query['q'][0]
+
+        archive = MetricsArchive.load(str(tmpdir.join("metrics_exp.npz")))
+        assert archive.hosts == ["node1", "node2", "node3"]
+        assert sorted(archive.applications) == ["A1", "A2"]
+
+        assert read(str(tmpdir.join("A1_SVM", "metrics_SVM.csv.gz")))[:3] == [
+            "host,time,cpu,io_wait,mem,dsk_read,dsk_write,net_recv,net_sent",
+            "node1,{},10.0,1.0,nan,nan,nan,nan,nan".format(T0),
+            "node1,{},20.0,2.0,nan,nan,nan,nan,nan".format(T0 + 10),
+        ]
+        mean = read(str(tmpdir.join("A2_KMeans", "metrics_KMeans_mean.csv.gz")))
+        assert mean[1].startswith("{},25.0,1.0".format(T0))
+        assert len(mean) == 5
+
+    def test_retry(self, influxdb, tmpdir):
+        influxdb.failures = 2
+        e = exporter(influxdb, str(tmpdir), workers=1, max_retries=2, retry_backoff=0.01)
+        e.export_experiment("exp", ["node1"], "2019-01-01T00:00:00Z", "2019-01-01T00:00:30Z")
+        e.close()
+
+        assert len(influxdb.queries) == 3
+        assert e.failed == []
+        assert MetricsArchive.load(str(tmpdir.join("metrics_exp.npz"))).hosts == ["node1"]
+
+    def test_failure(self, influxdb, tmpdir, capsys):
+        influxdb.failures = 3
+        e = exporter(influxdb, str(tmpdir), workers=1, max_retries=1, retry_backoff=0.01)
+        e.add_application(application("A1", "SVM", 5, 25, ["node1"]))
+        e.export_experiment("exp", ["node1"], "2019-01-01T00:00:00Z", "2019-01-01T00:00:30Z")
+        e.close()
+
+        assert e.failed == [str(tmpdir.join("metrics_exp.npz"))]
+        # no partial file is left behind
+        assert sorted(p.basename for p in tmpdir.listdir()) == ["cmd.txt"]
+        assert "Failed exports" in capsys.readouterr().out
+
+    def test_backpressure(self, tmpdir):
+        released = threading.Event()
+        e = Exporter(None, str(tmpdir), workers=1, max_pending=1)
+        submitter = threading.Thread(target=lambda: [e.submit(i, lambda _: released.wait()) for i in range(3)])
+        submitter.start()
+
+        # one job is running, one is waiting, the last one can not be queued
+        submitter.join(0.3)
+        assert submitter.is_alive()
+
+        released.set()
+        submitter.join(5)
+        assert not submitter.is_alive()
+        e.close()
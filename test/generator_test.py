@@ -1,9 +1,14 @@
 import generator
-from resource_manager import DummyRM
+from resource_manager import DummyRM, NodeReport
 from stat_collector import DummyStatCollector, Server
 from yarn_workloader import Experiment
-from scheduler import RoundRobin
-from complementarity import EpsilonGreedy
+from scheduler import RoundRobin, GroupAdaptiveExtend
+from complementarity import EpsilonGreedy, GroupGradient
+from clock import VirtualClock, AsyncioClock
+from submission import ClockSubmissionPool
+from arrival import Poisson
+import numpy as np
+import pytest
 
 
 class TestGenerators:
@@ -66,3 +71,225 @@ class TestGenerators:
         assert len(scheduler.queue) == len(exp.applications)
         for i in range(len(scheduler.queue)):
             assert scheduler.queue[i].is_a_copy_of(exp.applications[i])
+
+    def test_simulation(self, tmpdir):
+        with open('test/simulation/config.yaml') as config, \
+                open('test/single_run_8_containers/jobs.xml') as jobs_file, \
+                open('test/single_run_8_containers/experiment.xml') as exp_file:
+            scheduler = generator.simulation(
+                scheduler_class=GroupAdaptiveExtend,
+                estimation_class=GroupGradient,
+                exp_xml_str=exp_file.read(),
+                jobs_xml_str=jobs_file.read(),
+                config_yaml=config
+            )
+        scheduler.estimation.output_folder = str(tmpdir)
+        n_jobs = len(scheduler.queue)
+
+        assert isinstance(scheduler.clock, VirtualClock)
+        assert scheduler.cluster.resource_manager.clock is scheduler.clock
+
+        scheduler.start()
+        scheduler.clock.run()
+
+        assert len(scheduler.queue) == 0
+        assert scheduler.stopped_at is not None
+        assert len(scheduler.cluster.resource_manager.apps_finished) == n_jobs
+        assert not scheduler.cluster.has_application_scheduled()
+
+    def test_streamed_simulation(self, tmpdir, monkeypatch):
+        # the queue only holds a few jobs of the experiment at a time
+        monkeypatch.setattr(GroupAdaptiveExtend, 'queue_size', 4)
+        monkeypatch.setattr(GroupAdaptiveExtend, 'jobs_to_peek_arg', 2)
+        with open('test/simulation/config.yaml') as config, \
+                open('test/single_run_8_containers/jobs.xml') as jobs_file, \
+                open('test/single_run_8_containers/experiment.xml') as exp_file:
+            n_jobs = len(Experiment(exp_file, jobs_xml=jobs_file).jobs)
+            config.seek(0)
+            jobs_file.seek(0)
+            exp_file.seek(0)
+            scheduler = generator.simulation(
+                scheduler_class=GroupAdaptiveExtend,
+                estimation_class=GroupGradient,
+                exp_xml_str=None,
+                exp_xml=exp_file,
+                jobs_xml_str=jobs_file.read(),
+                config_yaml=config
+            )
+            scheduler.estimation.output_folder = str(tmpdir)
+
+            assert len(scheduler.queue) == 4 and n_jobs == 8
+            scheduler.start()
+            scheduler.clock.run()
+
+        assert len(scheduler.queue) == 0
+        assert scheduler.n_queued == n_jobs
+        assert len(scheduler.cluster.resource_manager.apps_finished) == n_jobs
+
+    def test_write_experiment(self, tmpdir):
+        path = str(tmpdir.join("experiment.xml"))
+        with open('test/single_run_8_containers/jobs.xml') as jobs_xml:
+            jobs_xml_str = jobs_xml.read()
+        np.random.seed(0)
+        expected = generator.experiment(jobs_xml_str, 30).to_xml()
+        np.random.seed(0)
+        with open(path, 'w') as file:
+            generator.write_experiment(jobs_xml_str, 30, file)
+
+        with open(path) as file:
+            assert file.read() == expected
+
+    def test_failing_schedule(self, tmpdir):
+        with open('test/simulation/config.yaml') as config, \
+                open('test/single_run_8_containers/jobs.xml') as jobs_file, \
+                open('test/single_run_8_containers/experiment.xml') as exp_file:
+            scheduler = generator.simulation(
+                scheduler_class=GroupAdaptiveExtend,
+                estimation_class=GroupGradient,
+                exp_xml_str=exp_file.read(),
+                jobs_xml_str=jobs_file.read(),
+                config_yaml=config
+            )
+        scheduler.estimation.output_folder = str(tmpdir)
+        app = scheduler.queue.pop(0)
+        app.failure = "FAILED"
+
+        def schedule():
+            raise RuntimeError("schedule")
+        scheduler.schedule = schedule
+
+        # the callbacks of the poller and of the clock release the lock when the scheduling raises
+        for callback in (scheduler._on_app_finished, scheduler._on_retry):
+            with pytest.raises(RuntimeError):
+                callback(app)
+            assert scheduler.scheduler_lock.acquire(blocking=False)
+            scheduler.scheduler_lock.release()
+
+    def test_reconciled_nodes(self, tmpdir):
+        with open('test/simulation/config.yaml') as config, \
+                open('test/single_run_8_containers/jobs.xml') as jobs_file, \
+                open('test/single_run_8_containers/experiment.xml') as exp_file:
+            scheduler = generator.simulation(
+                scheduler_class=GroupAdaptiveExtend,
+                estimation_class=GroupGradient,
+                exp_xml_str=exp_file.read(),
+                jobs_xml_str=jobs_file.read(),
+                config_yaml=config
+            )
+        scheduler.estimation.output_folder = str(tmpdir)
+        cluster = scheduler.cluster
+        n_jobs = len(scheduler.queue)
+
+        # a node without slot joins, a node of each slot has only 2 free containers left by other applications
+        reports = {address: NodeReport(node.n_containers) for address, node in cluster.nodes.items()}
+        reports["wally060.cit.tu-berlin.de"] = NodeReport(8, used=6)
+        reports["wally078.cit.tu-berlin.de"] = NodeReport(8, used=6)
+        reports["joined"] = NodeReport(8)
+        scheduler._on_node_reports(reports)
+        assert "joined" in cluster.nodes
+
+        scheduler.start()
+        scheduler.clock.run()
+
+        assert len(cluster.resource_manager.apps_finished) == n_jobs
+        assert cluster.nodes["joined"].is_empty()
+
+    def test_arrivals(self, tmpdir):
+        with open('test/simulation/config.yaml') as config, \
+                open('test/single_run_8_containers/jobs.xml') as jobs_file, \
+                open('test/single_run_8_containers/experiment.xml') as exp_file:
+            scheduler = generator.simulation(
+                scheduler_class=GroupAdaptiveExtend,
+                estimation_class=GroupGradient,
+                exp_xml_str=exp_file.read(),
+                jobs_xml_str=jobs_file.read(),
+                config_yaml=config.read() + "\narrival:\n  type: Poisson\n  kwargs:\n    rate: 0.001\n    seed: 0\n"
+            )
+        scheduler.estimation.output_folder = str(tmpdir)
+        rm = scheduler.cluster.resource_manager
+        launched_at = []
+        scheduler.submissions.on_launched = lambda app: launched_at.append(scheduler.clock.time())
+
+        # the jobs are released over time instead of being queued at the start
+        assert isinstance(scheduler.arrivals, Poisson)
+        assert len(scheduler.queue) == 0
+        scheduler.start()
+        scheduler.clock.run()
+
+        assert scheduler.n_queued == 8 and len(rm.apps_finished) == 8
+        assert scheduler.stopped_at is not None
+        assert launched_at[-1] > 1000
+
+    def test_load_test(self):
+        with open('test/simulation/config.yaml') as config, \
+                open('test/single_run_8_containers/jobs.xml') as jobs_file:
+            config_yaml = config.read()
+            jobs_xml_str = jobs_file.read()
+        results = [
+            generator.load_test(GroupAdaptiveExtend, GroupGradient, jobs_xml_str, config_yaml, Poisson(rate, seed=0), 60)
+            for rate in (0.001, 0.05)
+        ]
+
+        # the cluster keeps up with the low rate, the queue grows with the high one
+        assert np.isclose(results[0]['throughput'], 0.001, rtol=0.2)
+        assert results[0]['mean_queue_delay'] < 600 < results[1]['mean_queue_delay']
+        assert results[1]['throughput'] < 0.05 / 2
+        assert results[1]['max_queue_length'] > 10 * results[0]['max_queue_length']
+
+    def test_simulation_with_failures(self, tmpdir):
+        with open('test/simulation/config.yaml') as config, \
+                open('test/single_run_8_containers/jobs.xml') as jobs_file, \
+                open('test/single_run_8_containers/experiment.xml') as exp_file:
+            scheduler = generator.simulation(
+                scheduler_class=GroupAdaptiveExtend,
+                estimation_class=GroupGradient,
+                exp_xml_str=exp_file.read(),
+                jobs_xml_str=jobs_file.read(),
+                config_yaml=config
+            )
+        scheduler.estimation.output_folder = str(tmpdir)
+        scheduler.max_retries = 1
+        rm = scheduler.cluster.resource_manager
+        rm.failure_rate = 0.5
+        n_jobs = len(scheduler.queue)
+
+        scheduler.start()
+        scheduler.clock.run()
+
+        assert len(scheduler.queue) == 0
+        assert scheduler.pending_retries == 0
+        assert not scheduler.cluster.has_application_running()
+        assert len(rm.apps_failed) > 0
+        assert len(rm.apps_finished) + len(scheduler.failed_apps) == n_jobs
+        assert len(rm.apps_finished) + len(rm.apps_failed) == rm.apps_submitted
+
+    def test_asyncio(self, tmpdir):
+        clock = AsyncioClock()
+        with open('test/simulation/config.yaml') as config, \
+                open('test/single_run_8_containers/jobs.xml') as jobs_file, \
+                open('test/single_run_8_containers/experiment.xml') as exp_file:
+            scheduler = generator.scheduler(
+                scheduler_class=GroupAdaptiveExtend,
+                estimation_class=GroupGradient,
+                exp_xml_str=exp_file.read(),
+                jobs_xml_str=jobs_file.read(),
+                config_yaml=config,
+                clock=clock,
+                submissions=ClockSubmissionPool(clock, 0)
+            )
+        scheduler.estimation.output_folder = str(tmpdir)
+        scheduler.export_data = False
+        rm = scheduler.cluster.resource_manager
+        rm.clock = clock
+        # jobs of a few milliseconds
+        rm.startup_time = 0.001
+        rm.durations = {}
+        rm.default_duration = (0.01, 0.)
+        n_jobs = len(scheduler.queue)
+
+        clock.call_later(0, scheduler.start)
+        clock.run()
+
+        assert len(scheduler.queue) == 0
+        assert scheduler.stopped_at is not None
+        assert len(rm.apps_finished) == n_jobs
@@ -0,0 +1,111 @@
+from pending_queue import *
+from application import DummyApplication, JobTemplate, QueuedJob, SparkApplication
+from job_group_data import JobGroupData
+import pytest
+
+names = ["WordCount", "SVM", "PageRank", "TPCH", "Sort", "KMeans"]
+
+
+def gen_queue(n=12):
+    apps = [DummyApplication(name=names[i % len(names)], id=str(i)) for i in range(n)]
+    return PendingQueue(apps, capacity=4), apps
+
+
+class TestPendingQueue:
+    def test_order(self):
+        queue, apps = gen_queue()
+
+        assert len(queue) == len(apps)
+        assert apps == list(queue)
+        assert apps == [queue[i] for i in range(len(queue))]
+        assert apps[-1] is queue[-1]
+
+    def test_pop(self):
+        queue, apps = gen_queue()
+
+        assert queue.pop(3) is apps[3]
+        assert queue.pop() is apps[0]
+        assert queue.pop(-1) is apps[-1]
+        del apps[3]
+        del apps[0]
+        del apps[-1]
+
+        assert apps == list(queue)
+        assert apps == [queue[i] for i in range(len(queue))]
+        with pytest.raises(IndexError):
+            queue.pop(len(apps))
+
+    def test_appendleft(self):
+        queue, apps = gen_queue()
+        app = queue.pop(5)
+        for i in range(20):
+            queue.appendleft(queue.pop(len(queue) - 1))
+        queue.appendleft(app)
+
+        assert len(queue) == len(apps)
+        assert queue[0] is app
+        assert set(apps) == set(queue)
+        assert [queue[i] for i in range(len(queue))] == list(queue)
+
+    def test_window(self):
+        queue, apps = gen_queue(100)
+        queue.pop(1)
+        queue.pop(2)
+
+        expected = [apps[0], apps[2]] + apps[4:9]
+        assert expected == queue.window_applications(7)
+        assert [app.group for app in expected] == queue.window_groups(7).tolist()
+        assert len(queue.window(1000)) == 98
+
+    def test_group_positions(self):
+        queue, apps = gen_queue()
+        group = JobGroupData.groupIndexes["WordCount"]
+
+        # WordCount and KMeans are in the same group
+        assert [0, 5, 6] == queue.group_positions(group, 7).tolist()
+        queue.pop(0)
+        assert [4, 5] == queue.group_positions(group, 7).tolist()
+        assert 3 == queue.group_size(group)
+        assert 4 == queue.first_of_group(group)
+        assert -1 == queue.first_of_group(JobGroupData.groupIndexes["ConnectedComponent"])
+
+    def test_increment_waiting(self):
+        queue, apps = gen_queue()
+        queue.increment_waiting(3)
+        waiting_rounds = queue.increment_waiting(2)
+
+        assert [2, 2] == waiting_rounds.tolist()
+        assert [2, 2, 1, 0] == [app.waiting_time for app in apps[:4]]
+
+        queue.pop(2)
+        app = queue.pop(0)
+        queue.appendleft(app)
+        assert [2, 2, 0] == queue.waiting_rounds[queue.window(3)].tolist()
+
+    def test_queued_jobs(self):
+        template = JobTemplate("SVM", 4, "/jobs/svm.jar", ("in",))
+        job = QueuedJob(template, "1")
+        queue = PendingQueue([job] * 10, capacity=4)
+        queue.increment_waiting(2)
+
+        assert queue.window_groups(10).tolist() == [JobGroupData.groupIndexes["SVM"]] * 10
+        # only the applications looked at are instantiated
+        assert sum(isinstance(app, QueuedJob) for app in queue.applications) == 8
+        app = queue.pop(1)
+        assert isinstance(app, SparkApplication) and app.template is template
+        assert (app.data_set, app.waiting_time) == ("1", 1)
+        assert queue[0] is not queue[1]
+
+    def test_extend(self):
+        queue, apps = gen_queue(3)
+        queue.pop(1)
+        more = [DummyApplication(name=names[i % len(names)], id="M{}".format(i)) for i in range(100)]
+        queue.extend(more, arrival_time=5.)
+
+        expected = [apps[0], apps[2]] + more
+        assert expected == list(queue)
+        assert expected[:10] == queue.window_applications(10)
+        assert more[0].arrival_time == 5. and apps[0].arrival_time == 0.
+        group = JobGroupData.groupIndexes["WordCount"]
+        assert queue.group_size(group) == len([a for a in expected if a.group == group])
+        assert queue.pop(50) is expected[50]
@@ -0,0 +1,390 @@
+from resource_manager import *
+from application import DummyApplication, SparkApplication
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import json
+import threading
+import time
+import pytest
+from clock import AsyncioClock
+
+
+class TestApplicationPoller:
+    @staticmethod
+    def gen_poller(n_apps=3):
+        rm = DummyRM()
+        poller = ApplicationPoller(rm, interval=60)
+        finished = []
+        apps = []
+        for i in range(n_apps):
+            app = DummyApplication(name="WordCount", id="A{}".format(i))
+            app._finish = lambda on_finish, app=app: on_finish(app)
+            app._fail = lambda on_finish, app=app: on_finish(app)
+            app.submitted_at = app.last_seen_at = time.time()
+            poller.track(app, finished.append)
+            apps.append(app)
+        return rm, poller, apps, finished
+
+    def test_poll(self):
+        rm, poller, apps, finished = self.gen_poller()
+        rm.apps_running["A0"] = True
+        rm.apps_running["A1"] = True
+        rm.apps_finished["A1"] = True
+
+        poller.poll()
+        poller.stop()
+
+        assert apps[0].is_running
+        assert not apps[2].is_running
+        assert [apps[1]] == finished
+        assert {"A0", "A2"} == set(poller.applications.keys())
+
+    def test_finished_once(self):
+        rm, poller, apps, finished = self.gen_poller(1)
+        rm.apps_finished["A0"] = True
+
+        poller.poll()
+        poller.poll()
+        poller.stop()
+
+        assert [apps[0]] == finished
+        assert len(poller.applications) == 0
+
+    def test_single_request_per_tick(self):
+        rm, poller, apps, finished = self.gen_poller(10)
+        calls = []
+
+        def application_states(application_ids, started_after=None):
+            calls.append(application_ids)
+            return {application_ids[0]: FINISHED}
+
+        rm.application_states = application_states
+        poller.poll()
+        poller.stop()
+
+        assert len(calls) == 1
+        assert len(calls[0]) == 10
+        assert [apps[0]] == finished
+
+    def test_failed(self):
+        rm, poller, apps, finished = self.gen_poller(2)
+        rm.apps_failed["A1"] = True
+
+        poller.poll()
+        poller.stop()
+
+        assert [apps[1]] == finished
+        assert apps[1].failure == FAILED
+        assert apps[0].failure is None
+
+    def test_lost(self):
+        # given up before the RM started it or while it does not report it, it is killed before it is completed
+        rm, poller, apps, finished = self.gen_poller(3)
+        rm.application_states = lambda application_ids, started_after=None: {"A1": "ACCEPTED", "A2": FAILED}
+        apps[0].submitted_at = apps[0].last_seen_at = 0
+        apps[1].submitted_at = 0
+        killed = []
+        for app in apps:
+            app._fail = lambda on_finish, app=app: killed.append(list(rm.apps_killed)) or on_finish(app)
+
+        poller.poll()
+        poller.stop()
+
+        assert [app.failure for app in apps] == ["MISSING", "TIMEOUT", FAILED]
+        assert rm.apps_killed == ["A0", "A1"]
+        assert killed == [["A0"], ["A0", "A1"], ["A0", "A1"]]
+        assert finished == apps
+
+    def test_unreachable_rm(self):
+        rm, poller, apps, finished = self.gen_poller(2)
+        rm.application_states = lambda application_ids, started_after=None: None
+        for app in apps:
+            app.submitted_at = app.last_seen_at = 0
+
+        poller.poll()
+        poller.stop()
+
+        assert [] == finished
+
+    def test_poll_on_event_loop(self):
+        rm, poller, apps, finished = self.gen_poller(2)
+        clock = AsyncioClock()
+        rm.clock = clock
+        rm.apps_finished["A1"] = True
+        threads = []
+
+        def on_finish(app):
+            threads.append(threading.current_thread())
+            clock.stop()
+
+        for app in apps:
+            poller.track(app, on_finish)
+        poller.stop()
+        poller.interval = 0.01
+        poller.track(apps[0], on_finish)
+        clock.run()
+        poller.stop()
+
+        assert [threading.main_thread()] == threads
+        assert {"A0"} == set(poller.applications.keys())
+
+
+class FakeRM(ThreadingHTTPServer):
+    # YARN RM REST API of a cluster started at 1, with the applications given as id -> state
+    def __init__(self, apps=None):
+        super().__init__(("127.0.0.1", 0), FakeRMHandler)
+        self.apps = {} if apps is None else apps
+        self.nodes = [{'nodeHostName': 'N0', 'state': RUNNING, 'availableVirtualCores': 8, 'usedVirtualCores': 0,
+                       'availMemoryMB': 8192, 'usedMemoryMB': 0}]
+        self.requests = []
+        self.connections = set()
+        # submission contexts posted to the RM, the submissions answer 500 when they are rejected
+        self.submitted = []
+        self.reject_submissions = False
+        # the next failures requests answer 500, each request waits delay seconds
+        self.failures = 0
+        self.delay = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class FakeRMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.server.requests.append((url.path, parse_qs(url.query)))
+        self.server.connections.add(self.client_address)
+        time.sleep(self.server.delay)
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            return self.reply(500, {})
+
+        path = url.path[len("/ws/v1/cluster"):]
+        if path == "/info":
+            return self.reply(200, {'clusterInfo': {'startedOn': 1}})
+        if path == "/metrics":
+            return self.reply(200, {'clusterMetrics': {'appsSubmitted': 4}})
+        if path == "/nodes":
+            return self.reply(200, {'nodes': {'node': self.server.nodes}})
+        if path == "/apps":
+            apps = [{'id': i, 'state': state} for i, state in self.server.apps.items()]
+            return self.reply(200, {'apps': {'app': apps} if len(apps) > 0 else None})
+        if path.startswith("/apps/") and path[len("/apps/"):] in self.server.apps:
+            return self.reply(200, {'app': {'state': self.server.apps[path[len("/apps/"):]]}})
+        self.reply(404, {'RemoteException': {'message': 'not found'}})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append((url.path, {}))
+        path = url.path[len("/ws/v1/cluster"):]
+        if path == "/apps/new-application":
+            return self.reply(200, {'application-id': "application_1_{:04}".format(5 + len(self.server.submitted)),
+                                    'maximum-resource-capability': {'memory': 8192, 'vCores': 8}})
+        if path == "/apps" and not self.server.reject_submissions:
+            context = json.loads(body)
+            self.server.submitted.append(context)
+            self.server.apps[context['application-id']] = "ACCEPTED"
+            self.send_response(202)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.reply(500, {'RemoteException': {'message': 'rejected'}})
+
+    def do_PUT(self):
+        url = urlparse(self.path)
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        self.server.requests.append((url.path, body))
+        path = url.path[len("/ws/v1/cluster/apps/"):]
+        if path.endswith("/state") and path[:-len("/state")] in self.server.apps:
+            self.server.apps[path[:-len("/state")]] = body['state']
+            return self.reply(202, {'state': body['state']})
+        self.reply(404, {'RemoteException': {'message': 'not found'}})
+
+    def reply(self, code, content):
+        body = json.dumps(content).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_rm():
+    server = FakeRM({"application_1_0003": FINISHED, "application_1_0004": RUNNING})
+    yield server
+    server.delay = 0
+    server.shutdown()
+    server.server_close()
+
+
+class TestYarn:
+    def test_states(self, fake_rm):
+        rm = Yarn("127.0.0.1", fake_rm.port)
+
+        assert rm.next_application_id() == "application_1_0005"
+        assert rm.nodes() == {'N0': 8}
+        assert rm.application_states(["application_1_0004", "application_1_0005"], 120000) == {
+            "application_1_0004": RUNNING
+        }
+        assert fake_rm.requests[-1] == ("/ws/v1/cluster/apps", {'startedTimeBegin': ['60000']})
+        assert rm.application_state("application_1_0003") == FINISHED
+        assert rm.application_state("application_1_0005") is None
+        # every request went through the same connection
+        assert len(fake_rm.connections) == 1
+
+    def test_kill(self, fake_rm):
+        rm = Yarn("127.0.0.1", fake_rm.port)
+        rm.kill_application("application_1_0004")
+
+        assert fake_rm.requests[-1] == ("/ws/v1/cluster/apps/application_1_0004/state", {'state': KILLED})
+        assert rm.application_state("application_1_0004") == KILLED
+        # an unknown application is reported, not raised
+        rm.kill_application("application_1_0009")
+
+    def test_node_reports(self, fake_rm):
+        rm = Yarn("127.0.0.1", fake_rm.port)
+        fake_rm.nodes.append({'nodeHostName': 'N1', 'state': "UNHEALTHY", 'availableVirtualCores': 2,
+                              'usedVirtualCores': 6, 'availMemoryMB': 1024, 'usedMemoryMB': 7168})
+        reports = rm.node_reports()
+
+        assert sorted(reports.keys()) == ['N0', 'N1']
+        assert vars(reports['N0']) == {'capacity': 8, 'used': 0, 'memory': 8192, 'used_memory': 0, 'healthy': True}
+        assert vars(reports['N1']) == {'capacity': 8, 'used': 6, 'memory': 8192, 'used_memory': 7168,
+                                       'healthy': False}
+
+        # the RM could not be reached
+        rm.client.max_retries = 0
+        fake_rm.failures = 1
+        assert rm.node_reports() is None
+
+    def test_retry(self, fake_rm):
+        rm = Yarn("127.0.0.1", fake_rm.port, backoff=0.01)
+        fake_rm.failures = 2
+
+        assert rm.application_states(["application_1_0003"]) == {"application_1_0003": FINISHED}
+        assert len(fake_rm.requests) == 2 + 3
+
+    def test_deadline(self, fake_rm):
+        rm = Yarn("127.0.0.1", fake_rm.port, timeout=0.5, request_timeout=0.2, backoff=0.01)
+        fake_rm.delay = 1
+
+        started_at = time.monotonic()
+        assert rm.application_states(["application_1_0003"]) is None
+        assert time.monotonic() - started_at < 0.9
+
+    def test_retry_budget(self, fake_rm):
+        client = YarnClient("127.0.0.1", fake_rm.port, backoff=0.01, retry_budget=RetryBudget(ratio=0, initial=2),
+                            circuit_breaker=CircuitBreaker(failure_threshold=100))
+        fake_rm.failures = 100
+
+        for _ in range(3):
+            with pytest.raises(YarnError):
+                client.cluster_metrics()
+        # two retries for the three calls
+        assert len(fake_rm.requests) == 3 + 2
+
+    def test_circuit_breaker(self, fake_rm):
+        rm = Yarn("127.0.0.1", fake_rm.port, max_retries=0, failure_threshold=2, reset_timeout=0.2)
+        fake_rm.failures = 3
+
+        assert rm.application_states(["application_1_0003"]) is None
+        assert rm.application_states(["application_1_0003"]) is None
+        n_requests = len(fake_rm.requests)
+        # the circuit is open, the RM is not called
+        assert rm.application_state("application_1_0003") is None
+        assert len(fake_rm.requests) == n_requests
+
+        time.sleep(0.25)
+        # the trial call fails and opens the circuit again
+        assert rm.application_state("application_1_0003") is None
+        assert rm.application_state("application_1_0003") is None
+        assert len(fake_rm.requests) == n_requests + 1
+
+        time.sleep(0.25)
+        assert rm.application_state("application_1_0003") == FINISHED
+        assert rm.application_state("application_1_0004") == RUNNING
+
+
+SPARK = {
+    'archive': {'resource': "hdfs:///spark/spark-libs.zip", 'size': 100, 'timestamp': 1},
+    'conf': {'resource': "hdfs:///spark/spark-conf.zip", 'size': 10, 'timestamp': 2},
+    'jars': {"/jobs/wc.jar": {'resource': "hdfs:///jobs/wc.jar", 'size': 1000, 'timestamp': 3}},
+}
+
+
+class TestNativeSubmission:
+    @staticmethod
+    def gen_app(rm, jar="/jobs/wc.jar"):
+        app = SparkApplication("WordCount", 2, jar, ["input", "--output TEMP"], jar_class="WC")
+        app.id = rm.next_application_id()
+        app.submissions = []
+        app._submit = lambda: app.submissions.append(app.id)
+        return app
+
+    def test_submission(self, fake_rm):
+        rm = Yarn("127.0.0.1", fake_rm.port, spark=SPARK)
+        app = self.gen_app(rm)
+        rm.run_application(app)
+        rm.poller.stop()
+
+        assert app.submissions == []
+        assert app.id == "application_1_0005" and app.submitted_at is not None
+        context = fake_rm.submitted[0]
+        assert context['application-id'] == app.id and context['application-type'] == "SPARK"
+        command = context['am-container-spec']['commands']['command']
+        assert "-Dspark.executor.instances=2" in command
+        assert "ApplicationMaster --class WC --jar __app__.jar --arg input --arg --output --arg hdfs:///tmp/" in command
+        assert [e['key'] for e in context['am-container-spec']['local-resources']['entry']] == [
+            "__app__.jar", "__spark_libs__", "__spark_conf__"
+        ]
+        assert rm.application_state(app.id) == "ACCEPTED"
+
+    def test_submission_on_event_loop(self, fake_rm):
+        clock = AsyncioClock()
+        rm = Yarn("127.0.0.1", fake_rm.port, spark=SPARK)
+        rm.clock = clock
+        app = self.gen_app(rm)
+        tracked = []
+
+        def track(application, on_finish=None):
+            tracked.append(threading.current_thread())
+            clock.stop()
+
+        rm.poller.track = track
+        fake_rm.delay = 0.3
+        started = time.monotonic()
+        rm.run_application(app)
+
+        # the requests of the submission do not block the event loop
+        assert time.monotonic() - started < 0.2
+        clock.run()
+        assert app.id == "application_1_0005" and len(fake_rm.submitted) == 1
+        assert [threading.main_thread()] == tracked
+
+    def test_not_staged(self, fake_rm):
+        rm = Yarn("127.0.0.1", fake_rm.port, spark=SPARK)
+        app = self.gen_app(rm, jar="/jobs/other.jar")
+        rm.run_application(app)
+        rm.poller.stop()
+
+        assert app.submissions == ["application_1_0005"]
+        assert not any(path.endswith("new-application") for path, _ in fake_rm.requests)
+
+    def test_rejected(self, fake_rm):
+        rm = Yarn("127.0.0.1", fake_rm.port, max_retries=0, spark=SPARK)
+        fake_rm.reject_submissions = True
+        app = self.gen_app(rm)
+        rm.run_application(app)
+        rm.poller.stop()
+
+        # the id given to the rejected submission is used, spark-submit gets the next one
+        assert app.submissions == ["application_1_0006"]
@@ -0,0 +1,244 @@
+from stat_collector import *
+from clock import VirtualClock
+from cluster import Node
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+import json
+import socket
+import threading
+import time
+import numpy as np
+import pytest
+
+
+class FakeInfluxDB(HTTPServer):
+    # answers every /query with the results given for its statements
+    def __init__(self, results):
+        super().__init__(("127.0.0.1", 0), FakeInfluxDBHandler)
+        self.results = results
+        self.queries = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class FakeInfluxDBHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.handle_query(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        params = parse_qs(urlparse(self.path).query)
+        params.update(parse_qs(body))
+        self.handle_query(params)
+
+    def handle_query(self, params):
+        self.server.queries.append(params['q'][0])
+        body = json.dumps({'results': self.server.results}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def series(name, host, values):
+    return {
+        'name': name,
+        'tags': {'host': host},
+        'columns': ['time'] + list(values.keys()),
+        'values': [['1970-01-01T00:00:00Z'] + list(values.values())],
+    }
+
+
+Mo = 1024 ** 2
+
+
+@pytest.fixture
+def influxdb(monkeypatch):
+    # the experiment configurations loaded by other tests change the maxima
+    monkeypatch.setattr(Server, 'disk_max', 1e3)
+    monkeypatch.setattr(Server, 'net_max', 1e3)
+    results = [
+        {'statement_id': 0, 'series': [
+            series('cpu', 'node1', {'cpu': 50., 'cpu_max': 80., 'io_wait': 10., 'io_wait_max': 20.}),
+            series('cpu', 'node2', {'cpu': 20., 'cpu_max': 30., 'io_wait': None, 'io_wait_max': None}),
+        ]},
+        {'statement_id': 1, 'series': [
+            series('diskio', 'node1', {'dsk_read': 100. * Mo, 'dsk_read_max': 200. * Mo,
+                                       'dsk_write': 300. * Mo, 'dsk_write_max': 400. * Mo}),
+        ]},
+        {'statement_id': 2, 'series': [
+            series('net', 'node1', {'net_recv': 500. * Mo, 'net_recv_max': 600. * Mo,
+                                    'net_sent': 700. * Mo, 'net_sent_max': 2000. * Mo}),
+        ]},
+    ]
+    server = FakeInfluxDB(results)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestUsageFrame:
+    usages = {
+        "N0": Usage(0.5, 0.01, 0.2, 0.1, 0.3, 0.4),
+        "N1": Usage(0.01, 0.02, 0., 0., 0., 0.),
+        "N2": Usage(0., 0.6, 1., 2., 3., 4.),
+    }
+
+    def test_rate(self):
+        frame = UsageFrame.from_usages(self.usages)
+
+        assert np.allclose(frame.rate(), [usage.rate() for usage in self.usages.values()], rtol=0, atol=1e-12)
+        assert frame.is_not_idle().tolist() == [usage.is_not_idle() for usage in self.usages.values()]
+
+    def test_mapping(self):
+        frame = UsageFrame.from_usages(self.usages)
+
+        assert len(frame) == 3 and "N1" in frame and "N3" not in frame
+        assert list(frame.keys()) == ["N0", "N1", "N2"]
+        assert vars(frame["N2"]) == vars(self.usages["N2"])
+        assert frame.values['cpu'].tolist() == [0.5, 0.01, 0.]
+
+    def test_simulated(self):
+        # empty nodes, the servers have no attribute for their applications
+        servers = {address: Node(address, 8) for address in ["N0", "N1"]}
+        frame = SimulatedStatCollector(seed=0).mean_usage(servers)
+
+        assert isinstance(frame, UsageFrame)
+        assert frame.rate().shape == (2,)
+        assert not frame.is_not_idle().any()
+
+
+class TestInfluxDB:
+    servers = {address: Server(address) for address in ['node1', 'node2', 'node3']}
+
+    def test_one_request(self, influxdb):
+        InfluxDB("127.0.0.1", influxdb.port).mean_usage(self.servers, 30)
+
+        assert len(influxdb.queries) == 1
+        query = influxdb.queries[0]
+        assert query.count("GROUP BY host") == 5
+        assert "mean(usage_user)" in query and "max(usage_user)" in query
+        assert "now() - 30s" in query
+        assert "/^(node1|node2|node3)$/" in query
+
+    def test_mean_usage(self, influxdb):
+        usage = InfluxDB("127.0.0.1", influxdb.port).mean_usage(self.servers)
+
+        assert sorted(usage.keys()) == ['node1', 'node2', 'node3']
+        node1 = usage['node1']
+        assert (node1.cpu, node1.io_wait) == (0.5, 0.1)
+        assert (node1.dsk_read, node1.dsk_write) == (0.1, 0.3)
+        assert (node1.net_recv, node1.net_sent) == (0.5, 0.7)
+        # missing values and hosts have a zero usage
+        assert (usage['node2'].cpu, usage['node2'].io_wait, usage['node2'].dsk_read) == (0.2, 0, 0)
+        assert usage['node3'].rate() == Usage(0, 0, 0, 0, 0, 0).rate()
+
+    def test_max_usage(self, influxdb, capsys):
+        usage = InfluxDB("127.0.0.1", influxdb.port).usage(self.servers)
+
+        mean, maximum = usage['node1']
+        assert (maximum.cpu, maximum.net_sent) == (0.8, 2.)
+        assert "Max for net_sent exceed" in capsys.readouterr().out
+
+    def test_error(self, capsys):
+        values = InfluxDB._parse([{'statement_id': 0, 'error': "database not found"}, {'statement_id': 1}])
+
+        assert values == {}
+        assert "database not found" in capsys.readouterr().out
+
+
+class TestTelegrafStatCollector:
+    servers = {address: Server(address) for address in ['node1', 'node2']}
+
+    @staticmethod
+    def send(collector, lines, protocol="udp"):
+        kind = socket.SOCK_DGRAM if protocol == "udp" else socket.SOCK_STREAM
+        with socket.socket(socket.AF_INET, kind) as s:
+            s.connect(("127.0.0.1", collector.port))
+            s.sendall(("\n".join(lines) + "\n").encode())
+
+    @staticmethod
+    def wait(condition, timeout=5.):
+        deadline = time.time() + timeout
+        while not condition():
+            assert time.time() < deadline
+            time.sleep(0.01)
+
+    @pytest.fixture
+    def collector(self, monkeypatch):
+        monkeypatch.setattr(Server, 'disk_max', 1e3)
+        monkeypatch.setattr(Server, 'net_max', 1e3)
+        monkeypatch.setattr(Server, 'disk_name', 'sda')
+        monkeypatch.setattr(Server, 'net_interface', 'eth0')
+        collector = TelegrafStatCollector(port=0, clock=VirtualClock(1000))
+        yield collector
+        collector.close()
+
+    def test_mean_usage(self, collector):
+        self.send(collector, [
+            "cpu,cpu=cpu-total,host=node1 usage_user=40,usage_iowait=10 {}".format(990 * 10 ** 9),
+            "cpu,cpu=cpu-total,host=node1 usage_user=60,usage_iowait=30 {}".format(995 * 10 ** 9),
+            "cpu,cpu=cpu0,host=node1 usage_user=100 {}".format(995 * 10 ** 9),
+            "mem,host=node1 used=12i {}".format(995 * 10 ** 9),
+            "diskio,host=node1,name=sda read_bytes=0i,write_bytes=0i {}".format(990 * 10 ** 9),
+            "diskio,host=node1,name=sdb read_bytes=0i,write_bytes=0i {}".format(992 * 10 ** 9),
+            "diskio,host=node1,name=sda read_bytes={}i,write_bytes={}i {}".format(
+                100 * Mo * 10, 300 * Mo * 10, 1000 * 10 ** 9),
+        ])
+        self.wait(lambda: collector.mean_usage(self.servers)['node1'].dsk_read > 0)
+
+        usage = collector.mean_usage(self.servers)
+        assert np.isclose(usage['node1'].cpu, 0.5)
+        assert np.isclose(usage['node1'].io_wait, 0.2)
+        assert np.isclose(usage['node1'].dsk_read, 0.1)
+        assert np.isclose(usage['node1'].dsk_write, 0.3)
+        assert usage['node1'].net_recv == 0
+        assert usage['node2'].cpu == 0
+
+    def test_interval(self, collector):
+        self.send(collector, [
+            "cpu,cpu=cpu-total,host=node1 usage_user=10 {}".format(900 * 10 ** 9),
+            "cpu,cpu=cpu-total,host=node1 usage_user=30 {}".format(999 * 10 ** 9),
+        ])
+        self.wait(lambda: np.isclose(collector.mean_usage(self.servers, 200)['node1'].cpu, 0.2))
+
+        assert np.isclose(collector.mean_usage(self.servers, 60)['node1'].cpu, 0.3)
+        collector.clock.sleep(120)
+        assert collector.mean_usage(self.servers, 60)['node1'].cpu == 0
+
+    def test_late_point(self, collector):
+        collector.receive("cpu,cpu=cpu-total,host=node1 usage_user=30 999000000000".encode())
+        collector.receive("cpu,cpu=cpu-total,host=node1 usage_user=10 990000000000".encode())
+        collector.receive("cpu,cpu=cpu-total,host=node1 usage_user=90 100000000000".encode())
+
+        assert np.isclose(collector.mean_usage(self.servers, 60)['node1'].cpu, 0.2)
+        assert np.isclose(collector.mean_usage(self.servers, 5)['node1'].cpu, 0.3)
+
+    def test_tcp(self, monkeypatch):
+        monkeypatch.setattr(Server, 'net_interface', 'eth0')
+        collector = TelegrafStatCollector(port=0, protocol="tcp", clock=VirtualClock(1000))
+        try:
+            self.send(collector, [
+                "net,host=node2,interface=eth0 bytes_recv=0i,bytes_sent=0i {}".format(990 * 10 ** 9),
+                "net,host=node2,interface=eth0 bytes_recv={}i,bytes_sent=0i {}".format(500 * Mo * 10, 1000 * 10 ** 9),
+            ], protocol="tcp")
+            self.wait(lambda: collector.mean_usage(self.servers)['node2'].net_recv > 0)
+
+            assert np.isclose(collector.mean_usage(self.servers)['node2'].net_recv, 500 * Mo / (Server.net_max * Mo))
+        finally:
+            collector.close()
+
+    def test_many_hosts(self, collector):
+        for i in range(40):
+            collector.receive("cpu,cpu=cpu-total,host=h{} usage_user={} 999000000000".format(i, i).encode())
+        servers = {"h{}".format(i): Server("h{}".format(i)) for i in range(40)}
+
+        usage = collector.mean_usage(servers)
+        assert [round(usage["h{}".format(i)].cpu * 100) for i in range(40)] == list(range(40))
@@ -0,0 +1,77 @@
+from submission import *
+from clock import VirtualClock
+from application import DummyApplication
+import threading
+import pytest
+
+
+def gen_apps(slots):
+    apps = []
+    for i, slot in enumerate(slots):
+        app = DummyApplication(name="WordCount", id=str(i))
+        app.cluster_slot = slot
+        apps.append(app)
+    return apps
+
+
+class TestThreadSubmissionPool:
+    def test_order(self):
+        launched = []
+        pool = ThreadSubmissionPool(n_workers=1, spacing=0, on_launched=launched.append)
+        apps = gen_apps(["slot1", "slot2", "slot1", None])
+        for app in apps:
+            pool.submit(app, lambda app: None)
+        pool.join()
+        pool.stop()
+
+        assert launched == apps
+        assert pool.pending() == 0
+
+    def test_lanes(self):
+        # a blocked lane does not delay the other one
+        blocked = threading.Event()
+        launched = []
+        pool = ThreadSubmissionPool(n_workers=2, spacing=0, on_launched=launched.append)
+        apps = gen_apps(["slot1", "slot2", "slot1"])
+
+        pool.submit(apps[0], lambda app: blocked.wait(5))
+        pool.submit(apps[1], lambda app: None)
+        pool.submit(apps[2], lambda app: None)
+        pool._queues[1].join()
+        assert launched == [apps[1]]
+
+        blocked.set()
+        pool.join()
+        pool.stop()
+        assert launched == [apps[1], apps[0], apps[2]]
+
+    def test_failure(self):
+        failed = []
+        pool = ThreadSubmissionPool(spacing=0, on_failed=lambda app, e: failed.append((app, str(e))))
+        app = gen_apps([None])[0]
+
+        def launch(app):
+            raise OSError("spark-submit not found")
+
+        pool.submit(app, launch)
+        pool.join()
+        pool.stop()
+
+        assert failed == [(app, "spark-submit not found")]
+        assert pool.pending() == 0
+
+
+class TestClockSubmissionPool:
+    def test_spacing(self):
+        clock = VirtualClock()
+        launched = []
+        pool = ClockSubmissionPool(clock, spacing=1, on_launched=lambda app: launched.append((app, clock.time())))
+        apps = gen_apps(["slot1", "slot1", "slot2", "slot1"])
+        for app in apps:
+            pool.submit(app, lambda app: None)
+
+        assert pool.pending() == 4
+        clock.run()
+
+        assert launched == [(apps[0], 0), (apps[2], 0), (apps[1], 1), (apps[3], 2)]
+        assert pool.pending() == 0
@@ -1,5 +1,6 @@
 from yarn_workloader import *
 import xml.etree.ElementTree as ET
+import io
 
 
 class Xml2Application:
@@ -56,6 +57,34 @@ class TestExperiment:
         assert exp.applications[1].is_a_copy_of(TestJobs.expected_apps['tpch-1'])
         assert exp.applications[2].is_a_copy_of(TestJobs.expected_apps['tpch-1-full'])
 
+    def test_shared_jobs(self):
+        with open('test/single_run_8_containers/jobs.xml') as jobs_xml:
+            jobs = Jobs(jobs_xml)
+        exp = Experiment()
+        exp.read('<suite><experiment name="e"><job name="SVM" dataset="5"/><job name="Sort"/>'
+                 '<job name="SVM" dataset="5"/><job name="SVM"/></experiment></suite>', jobs)
+
+        # the entries are not instantiated and share the template of their job
+        assert exp.jobs[0] is exp.jobs[2] is jobs.job('SVM', '5')
+        assert exp.jobs[3].template is exp.jobs[0].template is jobs.template('SVM')
+        app = exp.applications[0]
+        assert app.template is jobs.template('SVM') and app.data_set == '5'
+        assert app is not exp.applications[2]
+        assert jobs['Sort'].template is jobs.template('Sort')
+
+    def test_stream(self):
+        with open('test/single_run_8_containers/jobs.xml') as jobs_xml:
+            jobs = Jobs(jobs_xml)
+        xml = io.StringIO('<suite><experiment name="e"><job name="SVM" dataset="5"/><job name="Sort"/>'
+                          '</experiment><experiment name="f"><job name="SVM"/></experiment></suite>')
+        exp = Experiment()
+        stream = exp.stream(xml, jobs)
+
+        assert next(stream) is jobs.job('SVM', '5')
+        assert exp.name == "e"
+        # only the jobs of the first experiment
+        assert list(stream) == [jobs.job('Sort')]
+
     def test_to_xml(self):
         app0 = TestJobs.expected_apps['tpch-1-full'].copy()
         app0.data_set = '5'
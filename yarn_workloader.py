@@ -1,11 +1,15 @@
-from xml.dom import minidom
+from xml.sax.saxutils import escape
 import xml.etree.ElementTree as ET
-from application import Application, SparkApplication
+from typing import Iterable, Iterator, List, TextIO
+import io
+from application import Application, JobTemplate, QueuedJob, SparkApplication
 
 
 class Jobs:
     def __init__(self, xml=None, applications=None):
         self._data = {}
+        # (name, data set) -> QueuedJob shared by the entries of the experiments
+        self._jobs = {}
 
         if applications is not None:
             for app in applications:
@@ -25,6 +29,15 @@ class Jobs:
     def __getitem__(self, item) -> Application:
         return self._data[item].copy()
 
+    def template(self, name) -> JobTemplate:
+        return self._data[name].template
+
+    def job(self, name, data_set='') -> QueuedJob:
+        job = self._jobs.get((name, data_set))
+        if job is None:
+            job = self._jobs[(name, data_set)] = QueuedJob(self.template(name), data_set)
+        return job
+
     def __len__(self):
         return len(self._data)
 
@@ -60,37 +73,71 @@ def xml_to_spark_application(job: ET.Element) -> SparkApplication:
     return SparkApplication(name, n_task, jar, args, jar_class=jar_class, tm=tm)
 
 
+# The jobs of an experiment are QueuedJob entries, instantiated by the queue of the scheduler
+# when it looks at them (or by applications)
 class Experiment:
     def __init__(self, xml=None, applications=None, name="generated_experiment",
                  jobs_xml=None, jobs: Jobs = None):
         self.name = name
-        self.applications = [] if None else applications
+        self.jobs = [] if applications is None else applications
 
         if xml is not None and (jobs_xml is not None or jobs is not None):
             if jobs is None:
                 jobs = Jobs(xml=jobs_xml)
-            self.__read(ET.parse(xml).getroot().find('experiment'), jobs)
+            self.jobs = list(self.stream(xml, jobs))
 
     def read(self, xml_str, jobs: Jobs):
-        self.__read(ET.fromstring(xml_str).find('experiment'), jobs)
+        self.jobs = list(self.stream(io.StringIO(xml_str), jobs))
+
+    def stream(self, xml, jobs: Jobs) -> Iterator[QueuedJob]:
+        # jobs of the first experiment of the file (or path), read as they are needed, the elements of the
+        # jobs already read are dropped
+        experiment = None
+        for event, element in ET.iterparse(xml, events=('start', 'end')):
+            if element.tag == 'experiment':
+                if experiment is None and event == 'start':
+                    self.name = element.get('name', self.name)
+                    experiment = element
+                elif element is experiment:
+                    return
+            elif element.tag == 'job' and event == 'end' and experiment is not None:
+                yield jobs.job(element.get('name'), element.get('dataset', ''))
+                experiment.clear()
+
+    @property
+    def applications(self) -> List[Application]:
+        return [job.instantiate() if isinstance(job, QueuedJob) else job for job in self.jobs]
 
-    def __read(self, experiment, jobs: Jobs):
-        self.name = experiment.get('name', self.name)
-        self.applications = []
+    def to_xml(self):
+        xml = io.StringIO()
+        with ExperimentWriter(xml, self.name) as writer:
+            writer.write_all(self.jobs)
+        return xml.getvalue()
 
-        for job in experiment.iter('job'):
-            app = jobs[job.get('name')]
-            app.data_set = job.get('dataset', '')
-            self.applications.append(app)
 
-    def to_xml(self):
-        suite = ET.Element('suite')
-        experiment = ET.SubElement(suite, 'experiment')
-        experiment.set('name', self.name)
-        for job in self.applications:
-            j = ET.SubElement(experiment, 'job')
-            j.set('name', job.name)
-            if job.data_set:
-                j.set('dataset', job.data_set)
-            j.text = '0'
-        return minidom.parseString(ET.tostring(suite, 'utf-8')).toprettyxml(indent="   ")
+# Writes an experiment job by job
+class ExperimentWriter:
+    def __init__(self, file: TextIO, name):
+        self.file = file
+        self.file.write('<?xml version="1.0" ?>\n<suite>\n   <experiment name={}>\n'.format(self._quote(name)))
+
+    def write(self, job):
+        data_set = ' dataset={}'.format(self._quote(job.data_set)) if job.data_set else ''
+        self.file.write('      <job name={}{}>0</job>\n'.format(self._quote(job.name), data_set))
+
+    def write_all(self, jobs: Iterable):
+        for job in jobs:
+            self.write(job)
+
+    def close(self):
+        self.file.write('   </experiment>\n</suite>\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def _quote(value):
+        return '"{}"'.format(escape(value, {'"': '&quot;'}))